@@ -0,0 +1,112 @@
+'''
+asyncio client for the debugger firmware (Python 3.5 or later).
+
+AsyncSerialDebugger has the read/write/call/execute interface of
+SerialDebugger as coroutines.  It does non-blocking I/O on the file
+descriptor of the serial port, so several boards (or k0boards) can be
+driven concurrently from one event loop:
+
+    async def main():
+        boards = [ await make_async_serial_debugger(port) for port in ports ]
+        results = await asyncio.gather(*[ b.read(0xfe00, 8) for b in boards ])
+
+'''
+import asyncio
+import os
+
+from k0emu.debug import SerialProtocol, make_serial
+
+
+class AsyncSerialDebugger(SerialProtocol):
+    '''asyncio interface to a board running the debugger firmware.
+    Commands from concurrent tasks are run one at a time.'''
+    TIMEOUT = 2  # seconds, like the pyserial timeout of make_serial()
+
+    def __init__(self, serial):
+        self.ser = serial
+        self._fd = serial.fileno()
+        self._buffer = bytearray()
+        self._lock = None  # created in the event loop, see _command()
+
+    async def find_prompt(self):
+        self.ser.flushOutput()
+        self.ser.flushInput()   # discard any stale prompt
+        self._buffer = bytearray()
+        await self._write(b'\n')
+        while True:
+            data = await self._read(1, timeout=None)
+            if data == b'>':
+                return
+
+    async def read(self, address, length):
+        return await self._command(self._read_packet(address, length), b'r', length)
+
+    async def write(self, address, data):
+        await self._command(self._write_packet(address, data), b'w')
+
+    async def call(self, address):
+        await self._command(self._call_packet(address), b'b')
+
+    async def execute(self, address, code, read_address, read_length):
+        packet = self._execute_packet(address, code, read_address, read_length)
+        return await self._command(packet, b'x', read_length)
+
+    async def _command(self, packet, response, length=0):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._write(packet)
+            data = await self._read(2 + length)
+            return self._parse_response(data, response, length)
+
+    # Non-blocking I/O ======================================================
+
+    async def _read(self, length, timeout=TIMEOUT):
+        '''Read <length> bytes.  Returns fewer if <timeout> seconds pass
+        without any byte being received.'''
+        while len(self._buffer) < length:
+            try:
+                chunk = os.read(self._fd, 4096)
+            except BlockingIOError:
+                chunk = b''
+            if chunk:
+                self._buffer.extend(chunk)
+                continue
+            try:
+                await asyncio.wait_for(self._ready(self._fd, 'reader'), timeout)
+            except asyncio.TimeoutError:
+                break
+        data = self._buffer[:length]
+        del self._buffer[:length]
+        return data
+
+    async def _write(self, data):
+        data = bytes(data)
+        while data:
+            try:
+                written = os.write(self._fd, data)
+            except BlockingIOError:
+                await self._ready(self._fd, 'writer')
+                continue
+            data = data[written:]
+
+    def _ready(self, fd, kind):
+        '''Return a future that is resolved when <fd> is ready for the
+        <kind> of I/O, either "reader" or "writer"'''
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        add = getattr(loop, 'add_' + kind)
+        remove = getattr(loop, 'remove_' + kind)
+        add(fd, lambda: future.done() or future.set_result(None))
+        future.add_done_callback(lambda f: remove(fd))
+        return future
+
+
+async def make_async_serial_debugger(port=None):
+    '''Open <port> (by default the port make_serial() would pick) and
+    wait for the prompt of the debugger firmware'''
+    ser = make_serial(port)
+    ser.timeout = 0
+    debug = AsyncSerialDebugger(ser)
+    await debug.find_prompt()
+    return debug
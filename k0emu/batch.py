@@ -0,0 +1,200 @@
+'''
+Vectorized byte sweeps on the emulator.  Requires NumPy, which is
+optional; without it EmulatorDebugger runs sweeps one case at a time.
+
+All cases of a sweep are run at once by the real instruction handlers of
+Processor.  Memory bytes that differ between cases (the patched bytes of
+the code and everything computed from them) hold a NumPy array with one
+lane per case.  When a handler branches on a condition that is true for
+some lanes and false for others, the run is restarted separately for
+each group of lanes.  An ALU instruction only has a few such paths, so a
+sweep over all (A, X, PSW) inputs takes a handful of array operations
+instead of a hundred thousand emulated snippets.
+'''
+try:
+    import numpy
+except ImportError: # optional
+    numpy = None
+
+from k0emu.processor import Memory, Processor
+
+
+class BatchUnsupported(Exception):
+    '''The sweep can't be vectorized, run it one case at a time'''
+    pass
+
+
+class _Split(Exception):
+    '''Raised when the lanes of a run must take different paths'''
+    def __init__(self, mask):
+        self.mask = mask
+
+
+def _scalar(value):
+    '''Return <value> as an int if it is the same in all lanes'''
+    if numpy is None or not isinstance(value, numpy.ndarray):
+        return value
+    plain = value.view(numpy.ndarray)
+    same = plain == plain[0]
+    if not same.all():
+        raise _Split(same)
+    return int(plain[0])
+
+
+class Lanes(numpy.ndarray if numpy is not None else object):
+    '''A value with one lane for each case being run'''
+
+    def __bool__(self):
+        plain = self.view(numpy.ndarray)
+        if plain.all():
+            return True
+        if not plain.any():
+            return False
+        raise _Split(plain.astype(bool))
+
+    def __int__(self):
+        return _scalar(self)
+
+    __index__ = __int__
+
+
+class BatchProcessor(Processor):
+    '''Processor whose memory bytes may hold Lanes.  Addresses, the PC
+    and opcodes must be the same in all lanes of a run.'''
+
+    def __init__(self, memory, overlay):
+        self.overlay = overlay  # address -> Lanes
+        self.written = set()
+        self.read_first = set() # addresses read before being written
+        Processor.__init__(self)
+        self.memory = memory
+        self.written.clear()
+        self.read_first.clear()
+
+    def step(self):
+        opcode = _scalar(self._consume_byte())
+        handler = self._opcode_map_unprefixed.get(opcode, self._opcode_not_implemented)
+        handler(opcode)
+        self.pc = _scalar(self.pc)
+        self.inst_count += 1
+
+    def read_memory(self, address):
+        address = _scalar(address)
+        if address not in self.written:
+            self.read_first.add(address)
+        return self.peek(address)
+
+    def peek(self, address):
+        '''Read memory without recording the access'''
+        values = self.overlay.get(address)
+        if values is None:
+            return Processor.read_memory(self, address)
+        return values.copy()
+
+    def write_memory(self, address, value):
+        address = _scalar(address)
+        self.written.add(address)
+        if not isinstance(value, Lanes):
+            self.overlay.pop(address, None)
+            Processor.write_memory(self, address, _scalar(value))
+        elif address not in self.RESERVED_ADDRESSES:
+            plain = value.view(numpy.ndarray)
+            if (plain < 0).any() or (plain > 0xFF).any():
+                raise ValueError("byte must be in range(0, 256)")
+            if address == self.PSW_ADDRESS:
+                value = value & 0b11111011  # psw bit 2 always stuck off
+            self.overlay[address] = value
+
+    def read_memory_bytes(self, address, length):
+        return [ self.read_memory((address + i) & 0xFFFF) for i in range(length) ]
+
+    def write_memory_bytes(self, address, data):
+        for i, value in enumerate(data):
+            self.write_memory((address + i) & 0xFFFF, value)
+
+
+class BatchExecutor(object):
+    '''Runs the cases of a sweep on a copy of a Processor all at once'''
+    MAX_PATHS = 4096
+    MAX_STEPS = 10000
+    RETURN_ADDRESS = 0xFFFF  # as EmulatorDebugger.RETURN_ADDRESS
+
+    def __init__(self, processor):
+        self.proc = processor
+
+    def sweep(self, address, code, patches, cases, read_address, read_length):
+        '''Like BaseDebugger.sweep() but returns a list with the bytes
+        read for each case.  The Processor is left as if the cases had
+        been run one at a time.  Raises BatchUnsupported if the cases
+        can't be run at once, e.g. because a case reads memory that an
+        earlier case wrote.'''
+        if numpy is None:
+            raise BatchUnsupported("NumPy is not installed")
+        if not cases:
+            return []
+        values = numpy.array(cases, dtype=numpy.int64).reshape(len(cases), len(patches))
+        memory = Memory(self.proc.memory)
+        for i, byte in enumerate(code):
+            memory[address + i] = byte
+
+        outputs = numpy.zeros((len(cases), read_length), dtype=numpy.uint8)
+        pending = [numpy.arange(len(cases))]
+        read_first = set()
+        last_writes = {}  # address -> (case, value) of the last case writing it
+        changed = set()   # addresses left different from before the sweep
+        last_pc = None
+        paths = 0
+        while pending:
+            index = pending.pop()
+            paths += 1
+            if paths > self.MAX_PATHS:
+                raise BatchUnsupported("Too many paths")
+            overlay = {}
+            for column, patch in enumerate(patches):
+                overlay[patch] = values[index, column].view(Lanes)
+            proc = BatchProcessor(Memory(memory), overlay)
+            try:
+                self._call(proc, address)
+            except _Split as split:
+                pending.append(index[~split.mask])
+                pending.append(index[split.mask])
+                continue
+            except Exception as exc:
+                raise BatchUnsupported("Emulator raised %r" % exc)
+            for offset in range(read_length):
+                outputs[index, offset] = proc.peek((read_address + offset) & 0xFFFF)
+            read_first |= proc.read_first
+            last_case = int(index[-1])
+            if last_case == len(cases) - 1:
+                last_pc = proc.pc
+            for written in proc.written:
+                value = proc.peek(written)
+                if (numpy.asarray(value) != memory[written]).any():
+                    changed.add(written)
+                if last_writes.get(written, (-1,))[0] < last_case:
+                    last_writes[written] = (last_case, value)
+
+        code_range = range(address, address + len(code))
+        if [ a for a in last_writes if a in code_range ]:
+            raise BatchUnsupported("Code modifies itself")
+        carried = [ a for a in read_first if a in changed and a not in code_range ]
+        if carried:
+            raise BatchUnsupported("Cases read memory written by earlier cases: %r" %
+                                   sorted(carried))
+
+        # leave the processor as the last case would
+        for patch, value in zip(patches, cases[-1]):
+            memory[patch] = value
+        self.proc.memory[:] = memory
+        for written, (_, values) in last_writes.items():
+            if isinstance(values, Lanes):
+                values = int(values.view(numpy.ndarray)[-1])
+            self.proc.write_memory(written, values)
+        self.proc.pc = last_pc
+        return [ bytearray(row) for row in outputs ]
+
+    def _call(self, proc, address):
+        # like EmulatorDebugger.call()
+        proc.push_word(self.RETURN_ADDRESS)
+        proc.pc = address
+        proc.run(self.RETURN_ADDRESS, self.MAX_STEPS)
@@ -0,0 +1,312 @@
+'''
+Usage: k0board
+
+Opens a pseudo-terminal that answers the same serial protocol as the
+debugger firmware (k0emu/debugger/firmware/debugger.asm).  Commands are
+carried out on a k0emu Processor instead of a real uPD78F0831Y.  Point
+FTDI_DEVICE at the port that is printed to run the test programs, or
+anything else that uses SerialDebugger, without the hardware:
+
+    $ k0board
+    Virtual board on /dev/pts/3
+    $ FTDI_DEVICE=/dev/pts/3 python k0emu/debugger/testprogs/run.py
+
+'''
+import os
+import select
+import sys
+import threading
+import tty
+
+from k0emu.debug import (BAUD_CHECK, BULK_BLOCK, RX_FIFO_SIZE, RX_OVERFLOW, TRACE_CONTEXT,
+                         TRACE_CONTEXT_LENGTH, TRACE_HASHED, EmulatorDebugger, crc_xmodem)
+from k0emu.processor import Flags, Processor
+
+
+# the instruction written over the code at each breakpoint of the T command
+BRK = 0xbf
+
+
+class BoardStopped(Exception):
+    pass
+
+
+class VirtualBoard(object):
+    '''Pseudo-terminal stand-in for a uPD78F0831Y running the debugger
+    firmware.  The protocol is implemented natively over a Processor.
+    Like the receive FIFO of the firmware, at most RX_FIFO_SIZE bytes
+    received ahead of the command being answered are kept.'''
+    POLL_INTERVAL = 0.1
+    FLUSH_TIMEOUT = 0.5  # quiet that ends the flush after an overflow
+
+    def __init__(self, processor=None):
+        if processor is None:
+            processor = Processor()
+        self.debug = EmulatorDebugger(processor)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # no echo, no newline translation
+        self.port = os.ttyname(self.slave)
+        self.commands = {
+            ord('R'): self._cmd_read,
+            ord('W'): self._cmd_write,
+            ord('B'): self._cmd_call,
+            ord('X'): self._cmd_execute,
+            ord('S'): self._cmd_sweep,
+            ord('U'): self._cmd_baud,
+            ord('F'): self._cmd_fetch,
+            ord('P'): self._cmd_put,
+            ord('T'): self._cmd_trace,
+        }
+        self._buffer = bytearray()
+        self._overflow = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._put(b'>')  # sent after reset, like the firmware
+
+    def serve_forever(self):
+        '''Answer commands until stop() is called'''
+        try:
+            while True:
+                command = self._get(1)[0]
+                handler = self.commands.get(command)
+                if handler is not None:
+                    handler()
+                if self._overflow:
+                    self._flush()
+                    self._put(RX_OVERFLOW)
+                else:
+                    self._put(b'>')
+        except BoardStopped:
+            pass
+
+    def start(self):
+        '''Answer commands in a background thread'''
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Commands ==============================================================
+
+    def _cmd_read(self):
+        address = self._get_word()
+        length = self._get_length()
+        data = self.debug.read(address, length)
+        self._put(b'r' + bytes(data))
+
+    def _cmd_write(self):
+        address = self._get_word()
+        length = self._get_length()
+        data = self._get(length)
+        self.debug.write(address, data)
+        self._put(b'w')
+
+    def _cmd_call(self):
+        address = self._get_word()
+        self._put(b'b')
+        self.debug.call(address)
+
+    def _cmd_execute(self):
+        address = self._get_word()
+        length = self._get(1)[0]  # 0 = call the code already in memory
+        code = self._get(length)
+        read_address = self._get_word()
+        read_length = self._get_length()
+        self._put(b'x')
+        data = self.debug.execute(address, code, read_address, read_length)
+        self._put(bytes(data))
+
+    def _cmd_sweep(self):
+        address = self._get_word()
+        length = self._get(1)[0]  # 0 = sweep the code already in memory
+        self.debug.write(address, self._get(length))
+        outer_address = self._get_word()
+        outer_value = self._get(1)[0]
+        rows = self._get_length()
+        inner_address = self._get_word()
+        inner_start = self._get(1)[0]
+        columns = self._get_length()
+        read_address = self._get_word()
+        read_length = self._get_length()
+        self._put(b's')
+        checksum = 0
+        self.debug.write(outer_address, [outer_value])
+        for row in range(rows):
+            self.debug.write(inner_address, [inner_start])
+            for column in range(columns):
+                self.debug.call(address)
+                data = self.debug.read(read_address, read_length)
+                checksum += sum(data)
+                self._put(bytes(data))
+                self._increment(inner_address)
+            self._increment(outer_address)
+        self._put(bytes([checksum & 0xFF, (checksum >> 8) & 0xFF]))
+
+    def _cmd_baud(self):
+        self._get(1)  # BRGC0 value, a pseudo-terminal has no baud rate
+        self._put(b'u')
+        for expected in BAUD_CHECK:
+            value = self._get(1)[0]
+            if value != expected:
+                return
+            self._put(bytes([value]))
+
+    def _cmd_fetch(self):
+        address = self._get_word()
+        length = self._get_word() or 0x10000
+        self._put(b'f')
+        for start in range(0, length, BULK_BLOCK):
+            data = self.debug.read(address + start, min(BULK_BLOCK, length - start))
+            crc = crc_xmodem(data)
+            self._put(bytes(data) + bytes([crc >> 8, crc & 0xFF]))
+
+    def _cmd_put(self):
+        address = self._get_word()
+        length = self._get_word() or 0x10000
+        self._put(b'p')
+        for start in range(0, length, BULK_BLOCK):
+            size = min(BULK_BLOCK, length - start)
+            while True:
+                block = self._get(size + 2)
+                self.debug.write(address + start, block[:size])
+                if crc_xmodem(block) == 0:  # CRC of data and its CRC
+                    break
+                self._put(b'n')
+            self._put(b'k')
+
+    def _cmd_trace(self):
+        count = self._get(1)[0]
+        breakpoints = [ self._get_word() for i in range(count) ]
+        proc = self.debug.proc
+        context = self.debug.read(TRACE_CONTEXT, TRACE_CONTEXT_LENGTH)
+        pc, sp, psw = _word(context, 0), _word(context, 2), context[4]
+
+        saved = [ (address, self.debug.read(address, 1)) for address in breakpoints ]
+        for address in breakpoints:
+            self.debug.write(address, [BRK])
+        # the firmware restores the context and runs the code with RETI
+        self.debug.write((sp - 3) & 0xFFFF, [pc & 0xFF, pc >> 8, psw])
+        self.debug.write(proc.REGISTERS_BASE_ADDRESS, context[6:14])
+        proc.write_sp(sp)
+        proc.write_psw(psw)
+        proc.pc = pc
+        for i in range(self.debug.MAX_INSTRUCTIONS):
+            if proc.pc in breakpoints:
+                break
+            proc.step()
+        else:
+            # the chip would never answer, the prompt alone is an error
+            # for the host and keeps the board usable
+            for address, byte in reversed(saved):
+                self.debug.write(address, byte)
+            proc.write_sp(0xfe1f)
+            return
+
+        # trace_trap: the BRK pushes PSW and the address after it
+        stop = proc.pc
+        psw = proc.read_psw()
+        proc.push(psw)
+        proc.push_word((stop + 1) & 0xFFFF)
+        sp = (proc.read_sp() + 3) & 0xFFFF
+        context[0:5] = [stop & 0xFF, stop >> 8, sp & 0xFF, sp >> 8, psw]
+        context[6:14] = self.debug.read(proc.REGISTERS_BASE_ADDRESS, 8)
+        self.debug.write(TRACE_CONTEXT, context)
+        proc.write_sp(0xfe1f)
+        proc.write_psw(psw & ~(Flags.RBS0 | Flags.RBS1 | Flags.IE))
+        for address, byte in reversed(saved):
+            self.debug.write(address, byte)
+
+        data = self.debug.read(TRACE_CONTEXT, TRACE_HASHED)
+        table = _word(context, 14)
+        for i in range(self.debug.read(table, 1)[0]):
+            entry = self.debug.read(table + 1 + 3 * i, 3)
+            data += self.debug.read(_word(entry, 0), entry[2] or 0x100)
+        crc = crc_xmodem(data)
+        self._put(b't' + bytes([stop & 0xFF, stop >> 8, crc >> 8, crc & 0xFF]))
+
+    def _increment(self, address):
+        # the firmware counts the patched bytes up in place
+        value = self.debug.read(address, 1)[0]
+        self.debug.write(address, [(value + 1) & 0xFF])
+
+    # Serial routines =======================================================
+
+    def _get(self, length):
+        while len(self._buffer) < length:
+            if self._stopped.is_set():
+                raise BoardStopped()
+            readable, _, _ = select.select([self.master], [], [], self.POLL_INTERVAL)
+            if readable:
+                self._buffer.extend(os.read(self.master, 4096))
+        data = self._buffer[:length]
+        del self._buffer[:length]
+        return data
+
+    def _get_word(self):
+        low, high = self._get(2)
+        return low + (high << 8)
+
+    def _get_length(self):
+        # the firmware loops with "dec b" so a length of 0 means 256
+        length = self._get(1)[0]
+        return length or 0x100
+
+    def _flush(self):
+        '''Discard everything received until nothing arrives for
+        FLUSH_TIMEOUT, like the firmware after an overflow'''
+        del self._buffer[:]
+        while True:
+            if self._stopped.is_set():
+                raise BoardStopped()
+            readable, _, _ = select.select([self.master], [], [], self.FLUSH_TIMEOUT)
+            if not readable:
+                break
+            os.read(self.master, 4096)
+        self._overflow = False
+
+    def _put(self, data):
+        # the firmware puts what arrives while it sends in its FIFO
+        while select.select([self.master], [], [], 0)[0]:
+            self._buffer.extend(os.read(self.master, 4096))
+        if len(self._buffer) > RX_FIFO_SIZE:
+            del self._buffer[RX_FIFO_SIZE:]
+            self._overflow = True
+        while data:
+            written = os.write(self.master, data)
+            data = data[written:]
+
+
+def _word(data, offset):
+    return data[offset] + (data[offset + 1] << 8)
+
+def main():
+    board = VirtualBoard()
+    print("Virtual board on %s" % board.port)
+    sys.stdout.flush()
+    try:
+        board.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        board.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+'''
+Usage: k0crosscheck <rom.bin> <instructions> [<candidate>]
+
+Runs two configurations of the emulator on the same code in lockstep
+and stops at the first instruction whose effects differ, so a faster
+implementation can be checked against the plain handlers of Processor.
+
+Both processors run INTERVAL instructions at a time and their states
+(the PC and all 64K of memory, which holds the registers, PSW and SP)
+are compared by a CRC-32 at the end of each interval.  The CRCs are
+chained into a running hash of the whole run, which is printed at the
+end so runs of different configurations can also be compared later.
+When the CRCs differ, both processors go back to the state at the last
+checkpoint and step one instruction at a time to the first one whose
+effects differ, which is reported field by field.
+
+The ROM is loaded like k0emu does.  <candidate> is one of CANDIDATES
+(default "batch"), which is checked against Processor, e.g.:
+
+    $ k0crosscheck rom.bin 100000000 batch
+'''
+import sys
+import zlib
+from k0dasm.disassemble import IllegalInstructionError, disassemble
+from k0emu.batch import BatchProcessor
+from k0emu.processor import Memory, Processor, load_rom
+
+# configurations that can be checked against Processor from the command line
+CANDIDATES = {
+    'batch': lambda: BatchProcessor(Memory(0x10000), {}),
+    'processor': Processor,
+}
+
+
+class Mismatch(object):
+    '''The first instruction whose effects differ on the reference and
+    the candidate.  <count> is its number in the run, from 1.
+    <differences> lists (name, reference value, candidate value) for
+    the PC and each byte of memory that differs, after an "exception"
+    if only one of them raised one.'''
+
+    def __init__(self, count, address, code, differences):
+        self.count = count
+        self.address = address
+        self.code = code
+        self.differences = differences
+
+    def __str__(self):
+        hexcode = ' '.join([ "%02x" % b for b in self.code ])
+        memory = bytearray(0x10000)
+        memory[self.address:self.address + len(self.code)] = self.code
+        lines = ["Instruction %d: %04x: %s  %s" % (self.count, self.address, hexcode,
+                                                  _decode(memory, self.address)[1])]
+        for name, reference, candidate in self.differences:
+            if name == 'exception':
+                lines.append("  %s: reference=%r candidate=%r" % (name, reference, candidate))
+                continue
+            width = 4 if name == 'PC' else 2
+            lines.append("  %s: reference=%0*x candidate=%0*x" % (
+                name, width, reference, width, candidate))
+        return '\n'.join(lines) + '\n'
+
+
+class CrossCheck(object):
+    '''Runs the Processors <reference> and <candidate> in lockstep.  The
+    candidate starts from the state of the reference.'''
+    INTERVAL = 10000  # instructions between checkpoints
+
+    def __init__(self, reference, candidate, interval=INTERVAL):
+        self.reference = reference
+        self.candidate = candidate
+        self.interval = interval
+        _restore(candidate, _snapshot(reference))
+        self.count = 0  # instructions run by each
+        self.hash = 0   # running hash of the states at the checkpoints
+
+    def run(self, instructions):
+        '''Run <instructions> more instructions.  Returns the first
+        Mismatch, after which the run can't go on, or None.'''
+        left = instructions
+        while left > 0:
+            n = min(left, self.interval)
+            snapshot = _snapshot(self.reference)
+            try:
+                _steps(self.reference, n)
+                _steps(self.candidate, n)
+            except Exception:
+                pass    # found again one step at a time, below
+            else:
+                digest = state_hash(self.reference)
+                if digest == state_hash(self.candidate):
+                    self.hash = zlib.crc32(digest.to_bytes(4, 'little'), self.hash)
+                    self.count += n
+                    left -= n
+                    continue
+            _restore(self.reference, snapshot)
+            _restore(self.candidate, snapshot)
+            return self._drill_down(n)
+        return None
+
+    def _drill_down(self, n):
+        '''Step both from the last checkpoint to the first instruction
+        whose effects differ, at most <n> instructions'''
+        for i in range(n):
+            address = self.reference.pc
+            code = _decode(self.reference.memory, address)[0]
+            self.count += 1
+            errors = [ _step(proc) for proc in (self.reference, self.candidate) ]
+            if errors[0] is not None and type(errors[0]) is type(errors[1]):
+                raise errors[0]
+            differences = _differences(self.reference, self.candidate)
+            if errors[0] is not errors[1]:
+                differences.insert(0, ('exception', errors[0], errors[1]))
+            if differences:
+                return Mismatch(self.count, address, code, differences)
+        raise Exception("No mismatch found when stepping %d instructions again, "
+                        "is the candidate deterministic?" % n)
+
+
+def state_hash(proc):
+    '''CRC-32 of the PC and memory of <proc>'''
+    return zlib.crc32(proc.memory, proc.pc)
+
+def field_name(address):
+    '''Name of the register at <address>, or the address in hex'''
+    if 0xfee0 <= address < 0xff00:
+        bank = 3 - (address - 0xfee0) // 8
+        return "RB%d.%s" % (bank, 'XACBEDLH'[address & 7])
+    names = {Processor.SP_ADDRESS: 'SPL', Processor.SP_ADDRESS + 1: 'SPH',
+             Processor.PSW_ADDRESS: 'PSW'}
+    return names.get(address, "%04x" % address)
+
+def _decode(memory, address):
+    '''Return the bytes of the instruction at <address> and its text'''
+    try:
+        instruction = disassemble(memory, address)
+    except IllegalInstructionError:
+        return bytearray(memory[address:address + 1]), "(illegal)"
+    return bytearray(instruction.all_bytes), str(instruction)
+
+def _steps(proc, n):
+    step = proc.step
+    for i in range(n):
+        step()
+
+def _step(proc):
+    '''Step <proc>, returning the exception it raised or None'''
+    try:
+        proc.step()
+    except Exception as exc:
+        return exc
+    return None
+
+def _snapshot(proc):
+    return bytes(proc.memory), proc.pc
+
+def _restore(proc, snapshot):
+    memory, pc = snapshot
+    proc.memory[:] = memory
+    proc.pc = pc
+
+def _differences(reference, candidate):
+    differences = []
+    if reference.pc != candidate.pc:
+        differences.append(('PC', reference.pc, candidate.pc))
+    a, b = reference.memory, candidate.memory
+    if a != b:
+        differences.extend([ (field_name(i), a[i], b[i]) for i in range(len(a))
+                             if a[i] != b[i] ])
+    return differences
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        rom = bytearray(f.read())
+    instructions = int(sys.argv[2])
+    candidate = CANDIDATES[sys.argv[3] if len(sys.argv) > 3 else 'batch']()
+
+    reference = Processor()
+    load_rom(reference, rom)
+    check = CrossCheck(reference, candidate)
+    mismatch = check.run(instructions)
+    if mismatch is not None:
+        sys.stdout.write(str(mismatch))
+        sys.exit(2)
+    print("%d instructions, hash %08x" % (check.count, check.hash))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,38 @@
+import binascii
+import collections
 import os
+import struct
 import sys
+import time
 import serial # pyserial
-from k0emu.processor import Processor
+from concurrent.futures import Future
+from k0emu.batch import BatchExecutor, BatchUnsupported
+from k0emu.processor import InstructionBudgetExceeded, Processor
+from k0emu.snippetcache import SnippetCache, emulator_version, snippet_key
+
+
+# main clock of the board, debugger.asm sets BRGC0=0x1B for 38400 baud
+FX = 4147200
+
+# check bytes echoed by the firmware after the U command (baud_check)
+BAUD_CHECK = bytearray([0x55, 0xaa, 0x00, 0xff])
+
+# block size of the F and P bulk transfer commands
+BULK_BLOCK = 0x100
+
+# bytes the receive FIFO of the firmware holds while it answers a command.
+# If more arrive they are lost, and RX_OVERFLOW is sent instead of the
+# next prompt.
+RX_FIFO_SIZE = 63
+RX_OVERFLOW = b'!'
+
+# context of the code stepped by the T command, kept by the firmware
+# between commands (trace_pc_lo in debugger.asm): PC, SP, PSW, a spare
+# byte, register bank 0 (X, A, C, B, E, D, L, H) and the address of the
+# table of watched ranges.  The first TRACE_HASHED bytes are in the CRC.
+TRACE_CONTEXT = 0xfec0
+TRACE_CONTEXT_LENGTH = 16
+TRACE_HASHED = 14
 
 
 class BaseDebugger(object):
@@ -14,86 +45,244 @@ class BaseDebugger(object):
         '''Write <data> bytes to memory starting at <address>.'''
         raise NotImplementedError
 
-    def call(self, address, data):
-        '''Call <address> in memory.  The code must return (0xAF RET).'''
+    def call(self, address, clobbers=None):
+        '''Call <address> in memory.  The code must return (0xAF RET).
+        <clobbers> is as for execute().'''
         raise NotImplementedError
 
+    def invalidate(self, ranges=None):
+        '''Forget any copy of the memory in <ranges>, or all memory if
+        None, so the next read of it comes from the target.'''
+        pass
+
+    def execute(self, address, code, read_address, read_length, clobbers=None):
+        '''Write <code> to memory at <address>, call it, and then read
+        <read_length> bytes from memory starting at <read_address>.
+        <clobbers> optionally lists the ranges of memory the code may
+        modify, so a debugger that caches memory can keep the rest.'''
+        self.write(address, code)
+        self.call(address)
+        return self.read(read_address, read_length)
+
+    def execute_many(self, address, codes, read_address, read_length, clobbers=None):
+        '''Like execute() for each code in <codes>.  Yields the bytes
+        read for each code, in order.'''
+        for code in codes:
+            yield self.execute(address, code, read_address, read_length, clobbers)
+
+    def sweep(self, address, code, patches, cases, read_address, read_length, clobbers=None):
+        '''Run <code> at <address> once for each case in <cases>.  A case
+        is a tuple of byte values, one for each address in <patches>,
+        that are patched into the code before it runs.  Yields the bytes
+        read after each case, in order.'''
+        def codes():
+            patched = bytearray(code)
+            for case in cases:
+                for patch, value in zip(patches, case):
+                    patched[patch - address] = value
+                yield bytearray(patched)
+        return self.execute_many(address, codes(), read_address, read_length, clobbers)
+
 
 class EmulatorDebugger(BaseDebugger):
     '''Debugger for the k0emu software emulator'''
+    RETURN_ADDRESS = 0xFFFF     # sentinel pushed by call(), no code runs there
+    MAX_INSTRUCTIONS = 1000000  # per call(), so runaway code can't hang
+
     def __init__(self, processor):
         self.proc = processor
-        self.proc.write_sp(0xfe1d)  # for consistency with serial debugger firmware
+        self.proc.write_sp(0xfe1f)  # for consistency with serial debugger firmware
 
     def read(self, address, length):
-        data = bytearray()
-        for i in range(length):
-            data.append(self.proc.read_memory(address + i))
-        return data
+        return self.proc.read_memory_bytes(address, length)
 
     def write(self, address, data):
-        for addr, d in enumerate(data, address):
-            self.proc.write_memory(addr, d)
+        self.proc.write_memory_bytes(address, data)
 
-    def call(self, address):
+    def call(self, address, clobbers=None, max_instructions=MAX_INSTRUCTIONS):
+        '''Call <address> like the firmware does, with a return address
+        on the stack.  The code must return (0xAF RET) to it, and may call
+        subroutines of its own.  Raises InstructionBudgetExceeded if it
+        runs more than <max_instructions>, with SP as it was before the
+        call so the next one starts clean.  There is no copy of the
+        memory to keep, so <clobbers> is ignored.'''
+        sp = self.proc.read_sp()
+        self.proc.push_word(self.RETURN_ADDRESS)
         self.proc.pc = address
-        while self.proc.read_memory(self.proc.pc) != 0xaf:  # ret
-            self.proc.step()
+        try:
+            self.proc.run(self.RETURN_ADDRESS, max_instructions)
+        except InstructionBudgetExceeded:
+            self.proc.write_sp(sp)
+            raise
 
+    def sweep(self, address, code, patches, cases, read_address, read_length, clobbers=None):
+        '''Runs all the cases at once with NumPy if it is installed and
+        the cases don't depend on each other, else one at a time'''
+        cases = list(cases)
+        try:
+            outputs = BatchExecutor(self.proc).sweep(address, code, patches, cases,
+                                                     read_address, read_length)
+        except BatchUnsupported:
+            return BaseDebugger.sweep(self, address, code, patches, cases,
+                                      read_address, read_length, clobbers)
+        return iter(outputs)
 
-class SerialDebugger(BaseDebugger):
-    '''Serial interface to a real uPD78F0831Y running the debugger firmware'''
-    def __init__(self, serial):
-        self.ser = serial
-        self.find_prompt()
 
-    def find_prompt(self):
-        self.ser.flushOutput()
-        self.ser.write(b'\n')
-        while True:
-            data = self.ser.read(1)
-            if data == b'>':
-                return
+class MemoDebugger(BaseDebugger):
+    '''Debugger in front of another that returns the outputs of snippets
+    it ran before from a SnippetCache instead of running them again.
+    Only execute(), execute_many() and sweep() are cached; a cached
+    snippet is not written to the target at all.  The memory written
+    and the code called since the last snippet are part of the keys of
+    the next snippets, since their outputs may depend on them.'''
+    def __init__(self, debug, cache):
+        self.debug = debug
+        self.cache = cache
+        self.state = bytearray()  # writes and calls since the last snippet
+
+    def __getattr__(self, name):
+        return getattr(self.debug, name)
 
     def read(self, address, length):
-        low, high = self._split_word(address)
-        self.ser.write(bytearray([ord(b'R'), low, high, length]))
-        response_length = 2 + length
-        data = bytearray(self.ser.read(response_length))
-        if len(data) != response_length:
-            raise Exception("too short")
-        if data[0] != ord('r'):
-            raise Exception("unexpected response: %r" % data[0])
-        if data[-1] != ord('>'):
-            raise Exception("no prompt")
-        data.pop(0) # remove first byte of packet ('r' response)
-        data.pop()  # remove last byte of packet ('>' prompt)
-        return data
+        return self.debug.read(address, length)
 
     def write(self, address, data):
+        data = bytearray(data)
+        self.state += struct.pack('<cHH', b'W', address, len(data)) + data
+        self.debug.write(address, data)
+
+    def call(self, address, clobbers=None):
+        self.state += struct.pack('<cH', b'B', address)
+        self.debug.call(address, clobbers)
+
+    def invalidate(self, ranges=None):
+        self.debug.invalidate(ranges)
+
+    def execute(self, address, code, read_address, read_length, clobbers=None):
+        key = self._key(address, code, read_address, read_length)
+        self.state = bytearray()
+        data = self.cache.get(key)
+        if data is None:
+            data = self.debug.execute(address, code, read_address, read_length, clobbers)
+            self.cache.put(key, data)
+        return data
+
+    def execute_many(self, address, codes, read_address, read_length, clobbers=None):
+        codes = [ bytearray(code) for code in codes ]
+        keys = [ self._key(address, code, read_address, read_length) for code in codes ]
+        self.state = bytearray()
+        missed = lambda missing: self.debug.execute_many(
+            address, [ codes[i] for i in missing ], read_address, read_length, clobbers)
+        return self._cached(keys, missed)
+
+    def sweep(self, address, code, patches, cases, read_address, read_length, clobbers=None):
+        cases = list(cases)
+        keys = []
+        patched = bytearray(code)
+        for case in cases:
+            for patch, value in zip(patches, case):
+                patched[patch - address] = value
+            keys.append(self._key(address, patched, read_address, read_length))
+        self.state = bytearray()
+        missed = lambda missing: self.debug.sweep(
+            address, code, patches, [ cases[i] for i in missing ],
+            read_address, read_length, clobbers)
+        return self._cached(keys, missed)
+
+    def _key(self, address, code, read_address, read_length):
+        return snippet_key(address, code, read_address, read_length, self.state)
+
+    def _cached(self, keys, missed):
+        '''Yield the output for each of <keys>.  missed(indexes) runs
+        the snippets of the keys not in the cache and yields their
+        outputs.'''
+        outputs = self.cache.get_many(keys)
+        missing = [ i for i, output in enumerate(outputs) if output is None ]
+        ran = iter(missed(missing) if missing else ())
+        try:
+            for key, output in zip(keys, outputs):
+                if output is None:
+                    output = next(ran)
+                    self.cache.put(key, output)
+                yield output
+        finally:
+            self.cache.flush()
+
+
+class SerialProtocol(object):
+    '''Packets of the serial protocol of the debugger firmware'''
+
+    def _read_packet(self, address, length):
+        low, high = self._split_word(address)
+        return bytearray([ord(b'R'), low, high, length])
+
+    def _write_packet(self, address, data):
         low, high = self._split_word(address)
         packet = bytearray([ord(b'W'), low, high, len(data)])
         for d in data:
             packet.append(d)
-        self.ser.write(packet)
-        response_length = 2
-        data = self.ser.read(response_length)
-        if len(data) != response_length:
-            raise Exception("too short: %r" % data)
-        if data[0] != ord('w'):
-            raise Exception("unexpected response: %r" % data[0])
-        if data[1] != ord('>'):
-            raise Exception("no prompt")
+        return packet
 
-    def call(self, address):
+    def _call_packet(self, address):
         low, high = self._split_word(address)
-        self.ser.write(bytearray([ord(b'B'), low, high]))
-        data = self.ser.read(2)
-        if len(data) != 2:
+        return bytearray([ord(b'B'), low, high])
+
+    def _execute_packet(self, address, code, read_address, read_length):
+        low, high = self._split_word(address)
+        packet = bytearray([ord(b'X'), low, high, len(code)])
+        packet.extend(code)
+        low, high = self._split_word(read_address)
+        packet.extend([low, high, read_length])
+        return packet
+
+    def _fetch_packet(self, address, length):
+        low, high = self._split_word(address)
+        length_low, length_high = self._split_word(length & 0xFFFF)
+        return bytearray([ord(b'F'), low, high, length_low, length_high])
+
+    def _put_packet(self, address, length):
+        low, high = self._split_word(address)
+        length_low, length_high = self._split_word(length & 0xFFFF)
+        return bytearray([ord(b'P'), low, high, length_low, length_high])
+
+    def _sweep_packet(self, address, code, outer_address, outer_start, rows,
+                      inner_address, inner_start, columns, read_address, read_length):
+        low, high = self._split_word(address)
+        packet = bytearray([ord(b'S'), low, high, len(code)])
+        packet.extend(code)
+        low, high = self._split_word(outer_address)
+        packet.extend([low, high, outer_start, rows & 0xFF])
+        low, high = self._split_word(inner_address)
+        packet.extend([low, high, inner_start, columns & 0xFF])
+        low, high = self._split_word(read_address)
+        packet.extend([low, high, read_length])
+        return packet
+
+    def _trace_packet(self, breakpoints):
+        packet = bytearray([ord(b'T'), len(breakpoints)])
+        for address in breakpoints:
+            packet.extend(self._split_word(address))
+        return packet
+
+    def _parse_response(self, data, response, length=0):
+        """Check a response packet read from the serial port: the
+        <response> byte, <length> bytes of data, and the prompt.
+        Returns the data."""
+        if len(data) != 2 + length:
             raise Exception("too short: %r" % data)
-        if data[0] != ord('b'):
+        if data[0] != ord(response):
             raise Exception("unexpected response: %r" % data[0])
-        if data[1] != ord('>'):
+        self._check_prompt(bytes(data[-1:]))
+        data.pop(0) # remove first byte of packet (response)
+        data.pop()  # remove last byte of packet ('>' prompt)
+        return data
+
+    def _check_prompt(self, data):
+        '''Check that <data>, read where the prompt should be, is the
+        prompt'''
+        if data == RX_OVERFLOW:
+            raise Exception("receive FIFO overflowed, commands were lost")
+        if data != b'>':
             raise Exception("no prompt")
 
     def _split_word(self, word):
@@ -102,22 +291,588 @@ class SerialDebugger(BaseDebugger):
         return low, high
 
 
-def make_serial():
-    name = os.environ.get('FTDI_DEVICE')
+class SerialDebugger(BaseDebugger, SerialProtocol):
+    '''Serial interface to a real uPD78F0831Y running the debugger firmware'''
+
+    # memory that changes without the host writing it, never shadowed
+    VOLATILE_RANGES = (
+        range(0xf800, 0xfb00),  # reserved, reads 0x08
+        range(0xfe0a, 0xfe20),  # stack
+        range(0xfe7d, 0xfec0),  # receive FIFO, its pointers and overflow flag
+        range(0xfed0, 0xfee0),  # command scratch
+        range(0xfef8, 0x10000), # register bank 0 used by firmware, SFRs
+    )
+
+    # fewer cases than this are quicker to pipeline than to sweep
+    SWEEP_MIN_CASES = 16
+
+    # the firmware restores the old baud rate after about 0.5 seconds
+    BAUD_TIMEOUT = 1.0
+
+    # transfers longer than an R or W packet can carry use F and P, which
+    # are retried this many times for each block with a bad CRC
+    BULK_RETRIES = 3
+
+    # tries to find the prompt again after bytes of a response were lost
+    RESYNC_TRIES = 3
+
+    def __init__(self, serial, shadow=False):
+        self.ser = serial
+        self.shadow = None
+        if shadow:
+            self.shadow = ShadowMemory(self.VOLATILE_RANGES)
+        self.find_prompt()
+
+    def find_prompt(self):
+        self.ser.flushOutput()
+        self.ser.flushInput()   # discard any stale prompt
+        self.ser.write(b'\n')
+        while True:
+            data = self.ser.read(1)
+            if data == b'>':
+                return
+
+    def set_baudrate(self, baudrate):
+        '''Switch the firmware and the serial port to <baudrate>.  The
+        link is checked by echoing BAUD_CHECK at the new rate.  If that
+        fails, both sides go back to the old rate.  Returns True if the
+        new rate is in use.  The firmware keeps it until reset.'''
+        brgc0 = brgc0_for_baudrate(baudrate)
+        old_baudrate = self.ser.baudrate
+        self.ser.write(bytearray([ord(b'U'), brgc0]))
+        data = self.ser.read(1)
+        if data != b'u':
+            raise Exception("unexpected response: %r" % data)
+        self.ser.baudrate = baudrate
+        for value in BAUD_CHECK:
+            self.ser.write(bytearray([value]))
+            if bytearray(self.ser.read(1)) != bytearray([value]):
+                break
+        else:
+            if self.ser.read(1) == b'>':
+                return True
+        self.ser.baudrate = old_baudrate
+        time.sleep(self.BAUD_TIMEOUT)
+        self.find_prompt()
+        return False
+
+    def read(self, address, length):
+        if self.shadow is not None:
+            data = self.shadow.lookup(address, length)
+            if data is not None:
+                return data
+        if length > 0xff:
+            data = self._fetch(address, length)
+        else:
+            self.ser.write(self._read_packet(address, length))
+            data = self._read_response(b'r', length)
+        if self.shadow is not None:
+            self.shadow.update(address, data)
+        return data
+
+    def write(self, address, data):
+        if self.shadow is None:
+            runs = [(address, data)]
+        else:
+            runs = self.shadow.changes(address, data)
+        if sum([ len(chunk) for _, chunk in runs ]) > 0xff:
+            # one bulk transfer from the first change to the last
+            start = runs[0][0] - address
+            end = runs[-1][0] + len(runs[-1][1]) - address
+            self._put(runs[0][0], bytearray(data[start:end]))
+        else:
+            for addr, chunk in runs:
+                self.ser.write(self._write_packet(addr, chunk))
+                self._read_response(b'w')
+        if self.shadow is not None:
+            self.shadow.update(address, data)
+
+    def call(self, address, clobbers=None):
+        self.ser.write(self._call_packet(address))
+        self._read_response(b'b')
+        if self.shadow is not None:
+            self.shadow.invalidate(clobbers)
+
+    def invalidate(self, ranges=None):
+        if self.shadow is not None:
+            self.shadow.invalidate(ranges)
+
+    def trace(self, breakpoints):
+        '''Run the code in the trace context (TRACE_CONTEXT) until it
+        reaches one of the 1 or 2 addresses in <breakpoints>.  Returns
+        the address reached and the CRC-16/XMODEM of the context and of
+        the watched ranges after it stopped.'''
+        if not 1 <= len(breakpoints) <= 2:
+            raise Exception("Need 1 or 2 breakpoints: %r" % (breakpoints,))
+        self.ser.write(self._trace_packet(breakpoints))
+        data = self._read_response(b't', 4)
+        if self.shadow is not None:
+            self.shadow.invalidate()  # the code may have written anywhere
+        return data[0] + (data[1] << 8), (data[2] << 8) | data[3]
+
+    def execute(self, address, code, read_address, read_length, clobbers=None):
+        if self.shadow is not None and not self.shadow.changes(address, code):
+            send = []  # code is already in memory
+        else:
+            send = code
+        self.ser.write(self._execute_packet(address, send, read_address, read_length))
+        data = self._read_response(b'x', read_length)
+        if self.shadow is not None:
+            self.shadow.update(address, code)
+            self.shadow.invalidate(clobbers)
+            self.shadow.update(read_address, data)
+        return data
+
+    def execute_many(self, address, codes, read_address, read_length, clobbers=None):
+        pipeline = SerialPipeline(self)
+        futures = collections.deque()
+        for code in codes:
+            futures.append(pipeline.execute(address, code, read_address, read_length, clobbers))
+            while futures and futures[0].done():
+                yield futures.popleft().result()
+        pipeline.flush()
+        while futures:
+            yield futures.popleft().result()
+
+    def sweep(self, address, code, patches, cases, read_address, read_length, clobbers=None):
+        '''Runs of cases where the last two values count up like nested
+        loops are run on the chip with the S command, which streams back
+        only the bytes read.  Other cases are pipelined with X.'''
+        cases = list(cases)
+        code = bytearray(code)
+        pending = []  # cases to run with execute_many()
+        for start, stop, rows, columns in _sweep_blocks(cases):
+            if stop - start < self.SWEEP_MIN_CASES:
+                pending.extend(cases[start:stop])
+                continue
+            if pending:
+                for data in BaseDebugger.sweep(self, address, code, patches, pending,
+                                               read_address, read_length, clobbers):
+                    yield data
+                pending = []
+            for data in self._sweep_block(address, code, patches, cases[start],
+                                          rows, columns, read_address, read_length,
+                                          clobbers):
+                yield data
+        for data in BaseDebugger.sweep(self, address, code, patches, pending,
+                                       read_address, read_length, clobbers):
+            yield data
+
+    def _sweep_block(self, address, code, patches, first, rows, columns,
+                     read_address, read_length, clobbers):
+        for patch, value in zip(patches, first):
+            code[patch - address] = value
+        outer = -2 if len(patches) > 1 else -1  # one row if only one patch
+        if len(code) > 0xff:
+            self.write(address, code)
+            send = []
+        elif self.shadow is not None and not self.shadow.changes(address, code):
+            send = []  # code is already in memory
+        else:
+            send = code
+        self.ser.write(self._sweep_packet(address, send,
+                                          patches[outer], first[outer], rows,
+                                          patches[-1], first[-1], columns,
+                                          read_address, read_length))
+        if self.shadow is not None:
+            self.shadow.update(address, code)
+            self.shadow.invalidate(clobbers)
+            self.shadow.invalidate([ range(p, p + 1) for p in patches[outer:] ])
+
+        data = self.ser.read(1)
+        if data != b's':
+            raise Exception("unexpected response: %r" % data)
+        checksum = 0
+        for i in range(rows * columns):
+            data = bytearray(self.ser.read(read_length))
+            if len(data) != read_length:
+                raise Exception("too short: %r" % data)
+            checksum += sum(data)
+            if i == rows * columns - 1:
+                # before the last yield, which a zip() may not go past
+                self._read_sweep_tail(checksum)
+            yield data
+
+    def _read_sweep_tail(self, checksum):
+        data = bytearray(self.ser.read(3))
+        if len(data) != 3:
+            raise Exception("too short: %r" % data)
+        if data[0] + (data[1] << 8) != checksum & 0xFFFF:
+            raise Exception("bad checksum")
+        self._check_prompt(bytes(data[2:]))
+
+    def _fetch(self, address, length):
+        '''Read up to 64K with the F command.  Blocks with a bad CRC
+        are fetched again on their own.'''
+        data = bytearray(length)
+        bad = self._fetch_blocks(data, address, 0, length)
+        for attempt in range(self.BULK_RETRIES):
+            if not bad:
+                break
+            retry, bad = bad, []
+            for offset in retry:
+                size = min(BULK_BLOCK, length - offset)
+                bad.extend(self._fetch_blocks(data, address, offset, size))
+        if bad:
+            raise Exception("bad CRC")
+        return data
+
+    def _fetch_blocks(self, data, address, offset, length):
+        '''Fetch <length> bytes from <address> + <offset> into <data> at
+        <offset>.  Returns the offsets of the blocks with a bad CRC.'''
+        self.ser.write(self._fetch_packet((address + offset) & 0xFFFF, length))
+        response = self.ser.read(1)
+        if response != b'f':
+            raise Exception("unexpected response: %r" % response)
+        bad = []
+        for start in range(offset, offset + length, BULK_BLOCK):
+            size = min(BULK_BLOCK, offset + length - start)
+            block = bytearray(self.ser.read(size + 2))
+            if len(block) != size + 2:
+                # bytes were lost, the rest of the stream is out of step
+                bad.extend(range(start, offset + length, BULK_BLOCK))
+                self._resync()
+                return bad
+            if crc_xmodem(block[:size]) != (block[size] << 8) | block[size + 1]:
+                bad.append(start)
+            else:
+                data[start:start + size] = block[:size]
+        self._check_prompt(self.ser.read(1))
+        return bad
+
+    def _resync(self):
+        '''Get back in step after bytes of a response were lost.  The
+        rest of the response is drained until a read times out, so none
+        of its bytes can be taken for the prompt.  Then the prompt is
+        asked for, and everything the firmware sends is drained again:
+        it is in step if the last byte is the prompt.'''
+        self._drain()
+        for attempt in range(self.RESYNC_TRIES):
+            self.ser.write(b'\n')
+            if self._drain().endswith(b'>'):
+                return
+        raise Exception("no prompt after %d tries" % self.RESYNC_TRIES)
+
+    def _drain(self):
+        '''Read until a read times out.  Returns the bytes read.'''
+        data = bytearray()
+        while True:
+            chunk = self.ser.read(BULK_BLOCK)
+            data += chunk
+            if len(chunk) < BULK_BLOCK:
+                return data
+
+    def _put(self, address, data):
+        '''Write up to 64K with the P command.  Each block is sent again
+        until the firmware acknowledges a good CRC.'''
+        self.ser.write(self._put_packet(address, len(data)))
+        response = self.ser.read(1)
+        if response != b'p':
+            raise Exception("unexpected response: %r" % response)
+        for start in range(0, len(data), BULK_BLOCK):
+            block = bytearray(data[start:start + BULK_BLOCK])
+            crc = crc_xmodem(block)
+            block.extend([crc >> 8, crc & 0xFF])
+            for attempt in range(self.BULK_RETRIES + 1):
+                self.ser.write(block)
+                response = self.ser.read(1)
+                if response == b'k':
+                    break
+                if response != b'n':
+                    raise Exception("unexpected response: %r" % response)
+            else:
+                raise Exception("bad CRC")
+        self._check_prompt(self.ser.read(1))
+
+    def _read_response(self, response, length=0):
+        """Read a response packet: the <response> byte, <length> bytes
+        of data, and the prompt.  Returns the data."""
+        data = bytearray(self.ser.read(2 + length))
+        return self._parse_response(data, response, length)
+
+
+class SerialPipeline(object):
+    '''Keeps several commands in flight on a SerialDebugger.  Packets
+    are sent back to back, without waiting for the previous response,
+    as long as the commands queued behind the one being answered fit in
+    the receive FIFO of the debugger firmware.  Each method returns a
+    Future that is resolved as its response arrives.
+
+    If the debugger has a shadow memory, it is updated as commands are
+    queued.  Reads it can answer resolve at once and only the changed
+    bytes of code are sent.
+
+    If the FIFO overflows anyway, e.g. because <rx_fifo_size> is too
+    large, the response of the command in flight raises an exception.'''
+
+    def __init__(self, debugger, rx_fifo_size=RX_FIFO_SIZE):
+        self.debug = debugger
+        self.ser = debugger.ser
+        self.shadow = debugger.shadow
+        self.rx_fifo_size = rx_fifo_size
+        self._queued = collections.deque()     # not sent yet
+        self._in_flight = collections.deque()  # sent, awaiting response
+
+    def read(self, address, length):
+        if self.shadow is not None:
+            data = self.shadow.lookup(address, length)
+            if data is not None:
+                return _resolved(data)
+        return self._submit(self.debug._read_packet(address, length), b'r', length)
+
+    def write(self, address, data):
+        if self.shadow is None:
+            runs = [(address, data)]
+        else:
+            runs = self.shadow.changes(address, data)
+            self.shadow.update(address, data)
+        future = _resolved(None)
+        for addr, chunk in runs:
+            future = self._submit(self.debug._write_packet(addr, chunk), b'w', 0)
+        return future
+
+    def call(self, address, clobbers=None):
+        future = self._submit(self.debug._call_packet(address), b'b', 0)
+        if self.shadow is not None:
+            self.shadow.invalidate(clobbers)
+        return future
+
+    def execute(self, address, code, read_address, read_length, clobbers=None):
+        send = code
+        if self.shadow is not None:
+            runs = self.shadow.changes(address, code)
+            # writing only the changed bytes costs a W packet per run
+            if sum([ 4 + len(chunk) for _, chunk in runs ]) < len(code):
+                for addr, chunk in runs:
+                    self._submit(self.debug._write_packet(addr, chunk), b'w', 0)
+                send = []  # code is already in memory
+            self.shadow.update(address, code)
+        packet = self.debug._execute_packet(address, send, read_address, read_length)
+        future = self._submit(packet, b'x', read_length)
+        if self.shadow is not None:
+            self.shadow.invalidate(clobbers)
+        return future
+
+    def flush(self):
+        '''Send all queued commands and wait for all of their responses'''
+        while self._queued or self._in_flight:
+            self._send_ready()
+            self._receive()
+
+    def _submit(self, packet, response, length):
+        future = Future()
+        self._queued.append((packet, response, length, future))
+        self._send_ready()
+        while self._queued:  # FIFO is full, wait for room
+            self._receive()
+            self._send_ready()
+        return future
+
+    def _send_ready(self):
+        '''Send queued packets while they fit in the receive FIFO.  The
+        oldest command in flight is consumed by the firmware as it
+        arrives; everything behind it is buffered.'''
+        while self._queued:
+            packet = self._queued[0][0]
+            if self._in_flight:
+                buffered = sum([ len(p) for p, _, _, _ in self._in_flight ])
+                buffered -= len(self._in_flight[0][0])
+                if buffered + len(packet) > self.rx_fifo_size:
+                    return
+            self.ser.write(packet)
+            self._in_flight.append(self._queued.popleft())
+
+    def _receive(self):
+        '''Wait for the response to the oldest command in flight'''
+        if not self._in_flight:
+            return
+        packet, response, length, future = self._in_flight.popleft()
+        try:
+            data = self.debug._read_response(response, length)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        if response in (b'r', b'x'):
+            future.set_result(data)
+        else:
+            future.set_result(None)
+
+
+def _sweep_blocks(cases):
+    '''Split <cases> into blocks that the S command can run.  In a block
+    the leading values are fixed, the next to last value counts up once
+    per row and the last value counts up within each row.  Yields
+    (start, stop, rows, columns) with <start> and <stop> indexing
+    <cases>.  Any single case is a block of one row and one column.'''
+    i = 0
+    while i < len(cases):
+        first = cases[i]
+        columns = 1
+        while (columns < 0x100 and i + columns < len(cases)
+               and cases[i + columns][:-1] == first[:-1]
+               and cases[i + columns][-1] == first[-1] + columns):
+            columns += 1
+        rows = 1
+        while len(first) > 1 and rows < 0x100:
+            row = i + rows * columns
+            if row + columns > len(cases):
+                break
+            for column in range(columns):
+                case = cases[row + column]
+                if (case[:-2] != first[:-2] or case[-2] != first[-2] + rows
+                        or case[-1] != first[-1] + column):
+                    break
+            else:
+                rows += 1
+                continue
+            break
+        yield i, i + rows * columns, rows, columns
+        i += rows * columns
+
+
+def _resolved(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ShadowMemory(object):
+    '''Host-side copy of target memory.  Bytes the host has written or
+    read are known until they are invalidated, except for <volatile>
+    ranges, which are never known.'''
+    MERGE_GAP = 6  # a new W packet costs 4 bytes + 2 bytes of response
+
+    def __init__(self, volatile=(), size=0x10000):
+        self.data = bytearray(size)
+        self.valid = bytearray(size)
+        self._cacheable = bytearray([1]) * size
+        for r in volatile:
+            self._cacheable[r.start:r.stop] = bytearray(len(r))
+
+    def update(self, address, data):
+        '''Record that memory at <address> now holds <data>'''
+        end = min(address + len(data), len(self.data))
+        self.data[address:end] = data[:end - address]
+        self.valid[address:end] = self._cacheable[address:end]
+
+    def lookup(self, address, length):
+        '''Return the bytes at <address> if all of them are known,
+        otherwise None'''
+        end = address + length
+        if end > len(self.data) or self.valid.find(0, address, end) != -1:
+            return None
+        return self.data[address:end]
+
+    def invalidate(self, ranges=None):
+        '''Forget the bytes in <ranges>, or all bytes if None'''
+        if ranges is None:
+            ranges = (range(len(self.data)),)
+        for r in ranges:
+            self.valid[r.start:r.stop] = bytearray(len(r))
+
+    def changes(self, address, data):
+        '''Return a list of (address, bytes) runs of <data> that are
+        not already known to be in memory at <address>.  Runs separated
+        by only a few known bytes are merged and no run is longer than
+        the 255 bytes a W packet can carry.'''
+        runs = []
+        start = last = None
+        for i, value in enumerate(data):
+            addr = address + i
+            if addr < len(self.data) and self.valid[addr] and self.data[addr] == value:
+                continue
+            if start is not None and (i - last) <= self.MERGE_GAP and (i - start) < 0xff:
+                last = i
+            else:
+                if start is not None:
+                    runs.append((address + start, bytearray(data[start:last + 1])))
+                start = last = i
+        if start is not None:
+            runs.append((address + start, bytearray(data[start:last + 1])))
+        return runs
+
+
+def crc_xmodem(data):
+    '''CRC-16/XMODEM of <data>, as computed by crc_update in debugger.asm'''
+    return binascii.crc_hqx(bytes(data), 0)
+
+def brgc0_for_baudrate(baudrate, fx=FX):
+    '''Return the BRGC0 value for the closest rate to <baudrate>.  The
+    UART runs at fx / (2 ** (n + 1) * (k + 16)) where BRGC0 is n << 4 | k
+    with n = 1..7 and k = 0..14.'''
+    best_error = best_brgc0 = None
+    for n in range(1, 8):
+        for k in range(15):
+            actual = fx / float(2 ** (n + 1) * (k + 16))
+            error = abs(actual - baudrate) / baudrate
+            if best_error is None or error < best_error:
+                best_error, best_brgc0 = error, (n << 4) | k
+    if best_error > 0.02:
+        raise Exception("Baud rate not possible: %d" % baudrate)
+    return best_brgc0
+
+def find_serial_ports():
+    '''Names of the serial ports that may have a board: the ones in
+    FTDI_DEVICE (separated by commas) or all except Bluetooth ports'''
+    names = os.environ.get('FTDI_DEVICE')
+    if names is not None:
+        return names.split(',')
+    from serial.tools.list_ports import comports
+    return [ x.device for x in comports() if 'Bluetooth' not in x.device ]
+
+def make_serial(name=None):
     if name is None:
-        from serial.tools.list_ports import comports
-        candidates = [ x.device for x in comports() if 'Bluetooth' not in x.device ]
+        candidates = find_serial_ports()
         if not candidates:
             raise Exception("No serial port found")
         name = candidates[0]
     return serial.Serial(port=name, baudrate=38400, timeout=2)
 
-def make_serial_debugger(ser=None):
+def make_serial_debugger(ser=None, shadow=None):
+    '''Return a SerialDebugger on <ser>, by default the port
+    make_serial() picks.  It reads the chip unless <shadow> is True, or
+    is None and FTDI_SHADOW is set to 1: then it has a shadow memory
+    that answers reads of memory the host wrote, so code that checks
+    what it wrote (like memtest.run()) must invalidate() it before
+    reading it back.'''
     if ser is None:
         ser = make_serial()
-    debug = SerialDebugger(ser)
+    if shadow is None:
+        shadow = os.environ.get('FTDI_SHADOW') == '1'
+    debug = SerialDebugger(ser, shadow=shadow)
+    baudrate = os.environ.get('FTDI_BAUDRATE')
+    if baudrate is not None and not debug.set_baudrate(int(baudrate)):
+        sys.stderr.write("Baud rate %s failed, using %d\n" % (baudrate, ser.baudrate))
     return debug
 
+def make_serial_debuggers():
+    '''Return a debugger for each serial port that answers with the
+    prompt of the debugger firmware'''
+    debuggers = []
+    for name in find_serial_ports():
+        try:
+            ser = make_serial(name)
+        except serial.SerialException:
+            continue
+        if _answers_prompt(ser):
+            debuggers.append(make_serial_debugger(ser))
+        else:
+            ser.close()
+    if not debuggers:
+        raise Exception("No debugger found")
+    return debuggers
+
+def _answers_prompt(ser, attempts=16):
+    ser.flushInput()
+    ser.write(b'\n')
+    for i in range(attempts):
+        data = ser.read(1)
+        if data == b'>':
+            return True
+        if not data:
+            return False
+    return False
+
 def make_emulator_debugger(proc=None):
     if proc is None:
         proc = Processor()
@@ -131,4 +886,24 @@ def make_debugger_from_argv(argv=None):
         factory = make_emulator_debugger
     else:
         factory = make_serial_debugger
-    return factory()
+    return _memoized([factory()], argv)[0]
+
+def make_debuggers_from_argv(argv=None):
+    '''Like make_debugger_from_argv() but with all boards found'''
+    if argv is None:
+        argv = sys.argv
+    if 'emulator' in argv:
+        return _memoized([make_emulator_debugger()], argv)
+    return _memoized(make_serial_debuggers(), argv)
+
+def _memoized(debuggers, argv):
+    '''Put a MemoDebugger in front of each of <debuggers> if the
+    SNIPPET_CACHE environment variable names a cache file'''
+    filename = os.environ.get('SNIPPET_CACHE')
+    if filename is None:
+        return debuggers
+    if 'emulator' in argv:
+        cache = SnippetCache(filename, 'emulator', emulator_version())
+    else:
+        cache = SnippetCache(filename, 'serial')
+    return [ MemoDebugger(debug, cache) for debug in debuggers ]
@@ -11,9 +11,70 @@ ixs = 0xfff4            ;Internal expansion RAM size switching register
 wdtm = 0xfff9           ;Watchdog timer mode register
 pcc = 0xfffb            ;Processor clock control register
 
+;RAM used by the firmware.  Test programs use 0xFE00-0xFE09 for their
+;results and the stack is at 0xFE1F and below.  Test programs must not
+;use the command scratch area while a command that needs it is running.
+;Code stepped with the T command must also leave its context alone.
+;The receive FIFO only holds data while a pipelined client has commands
+;queued behind the one being answered.  It holds 63 bytes; if more arrive,
+;the firmware sends "!" instead of the next prompt, see loop.
+fifo_overflow = 0xfe7d  ;Receive FIFO: nonzero if bytes were lost
+fifo_head = 0xfe7e      ;Receive FIFO: index of the next byte to get
+fifo_tail = 0xfe7f      ;Receive FIFO: index of the next byte to put
+fifo_lo = 0x80          ;Receive FIFO: data at 0xFE80-0xFEBF (64 bytes)
+fifo_hi = 0xfe
+fifo_mask = 0x3f
+exec_addr_lo = 0xfed0   ;X command: address to read after the call (low)
+exec_addr_hi = 0xfed1   ;X command: address to read after the call (high)
+exec_len = 0xfed2       ;X command: number of bytes to read after the call
+                        ;S command: also uses exec_addr_lo/hi and exec_len
+sweep_inner_count = 0xfed3  ;S command: values of the inner byte per row
+sweep_code_lo = 0xfed4      ;S command: address of the code to call (low)
+sweep_code_hi = 0xfed5      ;S command: address of the code to call (high)
+sweep_outer_lo = 0xfed6     ;S command: address of the outer byte (low)
+sweep_outer_hi = 0xfed7     ;S command: address of the outer byte (high)
+sweep_inner_lo = 0xfed8     ;S command: address of the inner byte (low)
+sweep_inner_hi = 0xfed9     ;S command: address of the inner byte (high)
+sweep_sum_lo = 0xfeda       ;S command: checksum of the bytes sent (low)
+sweep_sum_hi = 0xfedb       ;S command: checksum of the bytes sent (high)
+sweep_outer_left = 0xfedc   ;S command: rows left to run
+sweep_inner_start = 0xfedd  ;S command: first value of the inner byte
+sweep_inner_left = 0xfede   ;S command: values of the inner byte left in row
+bulk_crc_lo = 0xfed4        ;F,P commands: CRC of the block so far (low)
+bulk_crc_hi = 0xfed5        ;F,P commands: CRC of the block so far (high)
+bulk_left_lo = 0xfed6       ;F,P commands: bytes in the last partial block
+bulk_left_hi = 0xfed7       ;F,P commands: full blocks left (0 = 256)
+bulk_block = 0xfed8         ;F,P commands: bytes left in the block
+bulk_count = 0xfed9         ;P command: length of the block
+trace_pc_lo = 0xfec0        ;T command: context of the code being stepped,
+trace_pc_hi = 0xfec1        ;  kept between commands: PC,
+trace_sp_lo = 0xfec2        ;  SP,
+trace_sp_hi = 0xfec3
+trace_psw = 0xfec4          ;  PSW (0xFEC5 is spare),
+trace_ax = 0xfec6           ;  register bank 0,
+trace_bc = 0xfec8
+trace_de = 0xfeca
+trace_hl = 0xfecc
+trace_watch_lo = 0xfece     ;  address of the table of watched ranges
+trace_watch_hi = 0xfecf
+trace_bp0_lo = 0xfed0       ;T command: address of the first breakpoint (low)
+trace_bp0_hi = 0xfed1       ;T command: address of the first breakpoint (high)
+trace_bp1_lo = 0xfed2       ;T command: address of the second breakpoint (low)
+trace_bp1_hi = 0xfed3       ;T command: address of the second breakpoint (high)
+                            ;T command: also uses bulk_crc_lo/hi
+trace_bp0_byte = 0xfed6     ;T command: code under the first breakpoint
+trace_bp1_byte = 0xfed7     ;T command: code under the second breakpoint
+trace_ranges = 0xfed8       ;T command: watched ranges left to hash
+trace_left = 0xfed9         ;T command: bytes left to hash in the range
+
     nop                 ;These two nops are also the reset vector
     nop
+    br start            ;Skip the rest of the vector table
+
+    .org 0x3e
+    .dw trace_trap      ;BRK vector, see cmd_trace
 
+start:
     di                  ;Disable interrupts
     mov pcc,#0          ;Processor clock = full speed
     mov wdtm,#0         ;Watchdog disabled
@@ -23,11 +84,23 @@ pcc = 0xfffb            ;Processor clock control register
     mov pm2,#0b11011111 ;PM25=output (TxD0), all others input
     mov asim0,#0        ;Disable UART
     mov brgc0,#0x1b     ;Set baud rate to 38400 bps
+    mov a,#0            ;Receive FIFO is empty
+    mov !fifo_head,a
+    mov !fifo_tail,a
+    mov !fifo_overflow,a
     mov if0h,#0
     mov asim0,#0xca     ;Enable UART for tx & rx and 8-N-1
 
 loop:
+    mov a,!fifo_overflow
+    cmp a,#0
+    bz loop_prompt
+    call fifo_flush     ;the commands queued in the FIFO are incomplete
+    mov a,#'!           ;send "!" = receive FIFO overflowed, instead of
+    br loop_send        ;  the prompt
+loop_prompt:
     mov a,#'>           ;send ">" prompt
+loop_send:
     call uart_put
 
     call uart_get       ;get command byte
@@ -46,10 +119,46 @@ check_w:
 
 check_b:
     cmp a,#'B           ;branch (call)
-    bnz other
+    bnz check_x
     call cmd_call
     br loop
 
+check_x:
+    cmp a,#'X           ;execute (write, call, read)
+    bnz check_s
+    call cmd_exec       ;does not return here, see cmd_exec_done
+    br loop
+
+check_s:
+    cmp a,#'S           ;sweep (call many times, patching the code)
+    bnz check_u
+    call cmd_sweep      ;does not return here, see cmd_sweep
+    br loop
+
+check_u:
+    cmp a,#'U           ;baud rate
+    bnz check_f
+    call cmd_baud
+    br loop
+
+check_f:
+    cmp a,#'F           ;fetch (bulk read)
+    bnz check_p
+    call cmd_fetch
+    br loop
+
+check_p:
+    cmp a,#'P           ;put (bulk write)
+    bnz check_t
+    call cmd_put
+    br loop
+
+check_t:
+    cmp a,#'T           ;trace (run code until a breakpoint)
+    bnz other
+    call cmd_trace      ;does not return here, see trace_trap
+    br loop
+
 other:
     br loop             ;do it again
 
@@ -63,19 +172,11 @@ cmd_read:
 
   call uart_get         ;get length to read
   mov b,a               ;b = length to read
-  mov c,#0xff           ;c = index for read pointer
 
   mov a,#'r             ;send "r" = response to read
   call uart_put
 
-cmd_read_loop:
-  dec b
-  inc c
-  mov a,[hl+c]          ;read byte from memory
-  call uart_put         ;send it
-  mov a,b
-  cmp a,#0
-  bnz cmd_read_loop
+  call send_bytes       ;send the bytes
   ret
 
 cmd_write:
@@ -86,16 +187,7 @@ cmd_write:
 
   call uart_get         ;get length to write
   mov b,a               ;b = length to write
-  mov c,#0xff           ;c = index for write pointer
-
-cmd_write_loop:
-  dec b
-  inc c
-  call uart_get         ;get value to write
-  mov [hl+c],a          ;write it from memory
-  mov a,b
-  cmp a,#0
-  bnz cmd_write_loop
+  call recv_bytes       ;receive the bytes and write them
 
   mov a,#'w             ;send "w" = response to write
   call uart_put
@@ -113,11 +205,575 @@ cmd_call:
   movw ax,hl            ;move address to AX
   br ax                 ;branch to it (it must do the RET)
 
+cmd_exec:
+;Write code to memory, call it, then read memory
+;Reads from UART: 2 bytes for code address, 1 byte for code length,
+;                 code bytes (none if length=0, the code is already
+;                 in memory), 2 bytes for read address, 1 byte for
+;                 read length
+;Writes to UART: "x", then the bytes read after the code returns
+  call uart_get_hl      ;get code address into HL
+
+  call uart_get         ;get length of code
+  cmp a,#0
+  bz cmd_exec_params    ;length 0 = no code to write
+  mov b,a               ;b = length to write
+  call recv_bytes       ;receive the code and write it
+
+cmd_exec_params:
+  call uart_get         ;get address to read after the call
+  mov !exec_addr_lo,a
+  call uart_get
+  mov !exec_addr_hi,a
+  call uart_get         ;get length to read after the call
+  mov !exec_len,a
+
+  mov a,#'x             ;send "x" = response to execute
+  call uart_put
+
+  pop ax                ;discard return address to main loop
+  movw ax,#cmd_exec_done
+  push ax               ;code returns to cmd_exec_done instead
+  movw ax,hl            ;move code address to AX
+  br ax                 ;branch to it (SP is the same as for "B")
+
+cmd_exec_done:
+  movw ax,!exec_addr_lo ;AX = address to read
+  movw hl,ax
+  mov a,!exec_len       ;b = length to read
+  mov b,a
+  call send_bytes       ;send the bytes
+  br loop               ;returns to main loop
+
+cmd_sweep:
+;Call code in memory once for each combination of two bytes patched into
+;it, reading memory after each call.  The outer byte counts up once per
+;row and the inner byte counts up within each row, like two nested loops.
+;Reads from UART: 2 bytes for code address, 1 byte for code length,
+;                 code bytes (none if length=0, the code is already
+;                 in memory), 2 bytes for outer byte address, 1 byte
+;                 for its first value, 1 byte for the number of rows
+;                 (0 = 256), 2 bytes for inner byte address, 1 byte for
+;                 its first value, 1 byte for the number of values per
+;                 row (0 = 256), 2 bytes for read address, 1 byte for
+;                 read length
+;Writes to UART: "s", the bytes read after each call, then the 16-bit
+;                sum of all of those bytes (low byte first)
+;The code is called with the same SP as for "B" and "X".
+  call uart_get_hl      ;get code address into HL
+  movw ax,hl
+  movw sweep_code_lo,ax
+
+  call uart_get         ;get length of code
+  cmp a,#0
+  bz cmd_sweep_params   ;length 0 = no code to write
+  mov b,a               ;b = length to write
+  call recv_bytes       ;receive the code and write it
+
+cmd_sweep_params:
+  call uart_get_hl      ;get address of the outer byte into HL
+  movw ax,hl
+  movw sweep_outer_lo,ax
+  call uart_get         ;get first value of the outer byte
+  mov [hl],a            ;patch it into the code
+  call uart_get         ;get number of rows
+  mov sweep_outer_left,a
+
+  call uart_get_hl      ;get address of the inner byte
+  movw ax,hl
+  movw sweep_inner_lo,ax
+  call uart_get         ;get first value of the inner byte
+  mov sweep_inner_start,a
+  call uart_get         ;get number of values per row
+  mov sweep_inner_count,a
+
+  call uart_get         ;get address to read after each call
+  mov exec_addr_lo,a
+  call uart_get
+  mov exec_addr_hi,a
+  call uart_get         ;get length to read after each call
+  mov exec_len,a
+
+  movw ax,#0            ;checksum = 0
+  movw sweep_sum_lo,ax
+
+  mov a,#'s             ;send "s" = response to sweep
+  call uart_put
+
+  pop ax                ;discard return address to main loop, so the
+                        ;code runs at the same SP as for "B" and "X"
+
+cmd_sweep_row:
+  movw ax,sweep_inner_lo  ;patch first value of the inner byte
+  movw hl,ax
+  mov a,sweep_inner_start
+  mov [hl],a
+  mov a,sweep_inner_count ;reset values left in the row
+  mov sweep_inner_left,a
+
+cmd_sweep_case:
+  call cmd_sweep_call   ;call the code
+
+  movw ax,exec_addr_lo  ;HL = address to read
+  movw hl,ax
+  mov a,exec_len        ;b = length to read
+  mov b,a
+  mov c,#0xff           ;c = index for read pointer
+
+cmd_sweep_send:
+  dec b
+  inc c
+  mov a,[hl+c]          ;read byte from memory
+  mov x,a               ;uart_put does not clobber X
+  call uart_put         ;send it
+  mov a,x               ;add it to the checksum
+  add a,sweep_sum_lo
+  mov sweep_sum_lo,a
+  bnc cmd_sweep_sent
+  inc sweep_sum_hi
+cmd_sweep_sent:
+  mov a,b
+  cmp a,#0
+  bnz cmd_sweep_send
+
+  movw ax,sweep_inner_lo  ;next value of the inner byte
+  movw hl,ax
+  mov a,[hl]
+  inc a
+  mov [hl],a
+  dbnz sweep_inner_left,cmd_sweep_case
+
+  movw ax,sweep_outer_lo  ;next value of the outer byte
+  movw hl,ax
+  mov a,[hl]
+  inc a
+  mov [hl],a
+  dbnz sweep_outer_left,cmd_sweep_row
+
+  mov a,sweep_sum_lo    ;send the checksum
+  call uart_put
+  mov a,sweep_sum_hi
+  call uart_put
+  br loop               ;returns to main loop
+
+cmd_sweep_call:
+  movw ax,sweep_code_lo ;AX = code address
+  br ax                 ;branch to it, its RET returns to cmd_sweep
+
+cmd_baud:
+;Change the baud rate
+;Reads from UART: 1 byte for the new BRGC0 value, then at the new rate
+;                 the check bytes 0x55 0xAA 0x00 0xFF, one at a time
+;Writes to UART: "u" at the old rate, then each check byte as an echo
+;If a check byte is wrong or does not arrive within about 0.5 s, the old
+;rate is restored.  The prompt that follows is sent at the rate in use.
+;The new rate is kept until reset.
+  call uart_get         ;get new BRGC0 value
+  mov x,a               ;X = new BRGC0 value
+  mov a,brgc0           ;A = old BRGC0 value
+  push ax               ;save both
+
+  mov a,#'u             ;send "u" = response to baud rate
+  call uart_put         ;returns once it has been sent
+
+  pop ax
+  push ax
+  xch a,x               ;A = new BRGC0 value
+  call set_baud
+  mov c,#0              ;c = index of check byte
+
+cmd_baud_check:
+  call uart_get_timeout ;get check byte
+  bc cmd_baud_fail      ;nothing received
+  mov b,a               ;b = byte received
+  movw hl,#baud_check
+  mov a,[hl+c]          ;A = byte expected
+  cmp a,b
+  bnz cmd_baud_fail     ;wrong byte received
+  call uart_put         ;echo it
+  inc c
+  mov a,c
+  cmp a,#4
+  bnz cmd_baud_check
+  pop ax                ;new rate works, discard old BRGC0 value
+  ret
+
+cmd_baud_fail:
+  pop ax                ;A = old BRGC0 value
+  call set_baud
+  ret
+
+baud_check:
+  .db 0x55, 0xaa, 0x00, 0xff
+
+cmd_fetch:
+;Read up to 64K of memory in blocks of 256 bytes
+;Reads from UART: 2 bytes for address, 2 bytes for length (0 = 65536)
+;Writes to UART: "f", then for each block the bytes read followed by
+;                their CRC-16/XMODEM (high byte first).  The last block
+;                is shorter if the length is not a multiple of 256.
+  call uart_get_hl      ;get address to read into HL
+  call bulk_get_length
+
+  mov a,#'f             ;send "f" = response to fetch
+  call uart_put
+
+  call bulk_full_blocks
+  bnz cmd_fetch_last    ;no full blocks
+cmd_fetch_full:
+  mov bulk_block,#0     ;256 bytes
+  call fetch_block
+  dbnz bulk_left_hi,cmd_fetch_full
+cmd_fetch_last:
+  mov a,bulk_left_lo
+  cmp a,#0
+  bz cmd_fetch_done     ;no partial block
+  mov bulk_block,a
+  call fetch_block
+cmd_fetch_done:
+  ret
+
+cmd_put:
+;Write up to 64K of memory in blocks of 256 bytes
+;Reads from UART: 2 bytes for address, 2 bytes for length (0 = 65536),
+;                 then for each block the bytes to write followed by
+;                 their CRC-16/XMODEM (high byte first).  The last block
+;                 is shorter if the length is not a multiple of 256.
+;Writes to UART: "p", then after each block "k" if its CRC is good or
+;                "n" if it is not or the block stalled for about 0.5 s.
+;                A block answered with "n" must be sent again.
+  call uart_get_hl      ;get address to write into HL
+  call bulk_get_length
+
+  mov a,#'p             ;send "p" = response to put
+  call uart_put
+
+  call bulk_full_blocks
+  bnz cmd_put_last      ;no full blocks
+cmd_put_full:
+  mov bulk_block,#0     ;256 bytes
+  call put_block
+  dbnz bulk_left_hi,cmd_put_full
+cmd_put_last:
+  mov a,bulk_left_lo
+  cmp a,#0
+  bz cmd_put_done       ;no partial block
+  mov bulk_block,a
+  call put_block
+cmd_put_done:
+  ret
+
+cmd_trace:
+;Run the code in the trace context until it reaches a breakpoint, so the
+;host can step it one instruction at a time.  The code must be in RAM.
+;Reads from UART: 1 byte for the number of breakpoints (1 or 2), then 2
+;                 bytes for the address of each
+;Writes to UART: "t" once a breakpoint is reached, 2 bytes for its
+;                address, then the CRC-16/XMODEM (high byte first) of
+;                trace_pc_lo..trace_hl+1 and of the watched ranges
+;A BRK is written over the code at each breakpoint and put back when it
+;is reached.  The code runs on its own stack: the 3 bytes below its SP
+;are written with the RETI frame that starts it and then with the BRK
+;frame that stops it.  The host writes the context before the first
+;step, and the table of watched ranges at trace_watch_lo/hi: 1 byte for
+;the number of ranges, then 2 bytes for the address and 1 byte for the
+;length (0 = 256) of each.
+  call uart_get         ;get number of breakpoints
+  mov b,a               ;b = number of breakpoints
+  call uart_get_hl      ;get address of the first breakpoint
+  movw ax,hl
+  movw trace_bp0_lo,ax
+  movw trace_bp1_lo,ax  ;the second is the same if there is only one
+  dec b
+  bz cmd_trace_patch
+  call uart_get_hl      ;get address of the second breakpoint
+  movw ax,hl
+  movw trace_bp1_lo,ax
+
+cmd_trace_patch:
+  movw ax,trace_bp0_lo  ;save the code under the first breakpoint
+  movw hl,ax
+  mov a,[hl]
+  mov trace_bp0_byte,a
+  mov a,#0xbf           ;write BRK over it
+  mov [hl],a
+  movw ax,trace_bp1_lo  ;same for the second, after the first in case
+  movw hl,ax            ;they are the same
+  mov a,[hl]
+  mov trace_bp1_byte,a
+  mov a,#0xbf
+  mov [hl],a
+
+  movw ax,trace_sp_lo   ;HL = RETI frame below the SP of the code
+  subw ax,#3
+  movw hl,ax
+  mov a,trace_pc_lo     ;PC low
+  mov [hl],a
+  mov a,trace_pc_hi     ;PC high
+  mov [hl+1],a
+  mov a,trace_psw       ;PSW
+  mov [hl+2],a
+  movw ax,hl
+  movw sp,ax            ;SP = the RETI frame
+
+  movw ax,trace_hl      ;restore register bank 0
+  movw hl,ax
+  movw ax,trace_de
+  movw de,ax
+  movw ax,trace_bc
+  movw bc,ax
+  movw ax,trace_ax
+  reti                  ;run the code, with PC and PSW from the frame
+
+trace_trap:
+;BRK vector.  Saves the context of the code stepped by cmd_trace, puts
+;the code under the breakpoints back and answers the T command.
+  sel rb0               ;the code may have selected another bank
+  movw trace_ax,ax      ;save register bank 0
+  movw ax,bc
+  movw trace_bc,ax
+  movw ax,de
+  movw trace_de,ax
+  movw ax,hl
+  movw trace_hl,ax
+
+  movw ax,sp            ;HL = BRK frame: PC low, PC high, PSW
+  movw hl,ax
+  addw ax,#3            ;SP of the code
+  movw trace_sp_lo,ax
+  mov a,[hl+2]          ;PSW of the code
+  mov trace_psw,a
+  mov a,[hl]            ;AX = address after the BRK
+  mov x,a
+  mov a,[hl+1]
+  subw ax,#1            ;address of the breakpoint
+  movw trace_pc_lo,ax
+  movw sp,#0xfe1f       ;back on the stack of the firmware
+
+  movw ax,trace_bp1_lo  ;put the code back, second breakpoint first
+  movw hl,ax
+  mov a,trace_bp1_byte
+  mov [hl],a
+  movw ax,trace_bp0_lo
+  movw hl,ax
+  mov a,trace_bp0_byte
+  mov [hl],a
+
+  movw ax,#0            ;CRC = 0
+  movw bulk_crc_lo,ax
+  movw hl,#trace_pc_lo  ;CRC of the context
+  mov trace_left,#14
+  call trace_crc
+  movw ax,trace_watch_lo  ;HL = table of watched ranges
+  movw hl,ax
+  mov a,[hl]            ;number of ranges
+  incw hl
+  cmp a,#0
+  bz trace_trap_send    ;no ranges
+  mov trace_ranges,a
+trace_trap_range:
+  mov a,[hl+2]          ;length of the range
+  mov trace_left,a
+  mov a,[hl]            ;DE = address of the range
+  mov e,a
+  mov a,[hl+1]
+  mov d,a
+  incw hl               ;HL = next entry
+  incw hl
+  incw hl
+  push hl
+  movw ax,de
+  movw hl,ax
+  call trace_crc        ;CRC of the range
+  pop hl
+  dbnz trace_ranges,trace_trap_range
+
+trace_trap_send:
+  mov a,#'t             ;send "t" = response to trace
+  call uart_put
+  mov a,trace_pc_lo     ;send the address of the breakpoint
+  call uart_put
+  mov a,trace_pc_hi
+  call uart_put
+  mov a,bulk_crc_hi     ;send the CRC
+  call uart_put
+  mov a,bulk_crc_lo
+  call uart_put
+  br loop               ;returns to main loop
+
+;Memory routines ============================================================
+
+send_bytes:
+;Send bytes from memory to the UART
+;HL = address, B = length (0 = 256)
+  mov c,#0xff           ;c = index for read pointer
+
+send_bytes_loop:
+  dec b
+  inc c
+  mov a,[hl+c]          ;read byte from memory
+  call uart_put         ;send it
+  mov a,b
+  cmp a,#0
+  bnz send_bytes_loop
+  ret
+
+recv_bytes:
+;Receive bytes from the UART and write them to memory
+;HL = address, B = length (0 = 256)
+  mov c,#0xff           ;c = index for write pointer
+
+recv_bytes_loop:
+  dec b
+  inc c
+  call uart_get         ;get value to write
+  mov [hl+c],a          ;write it to memory
+  mov a,b
+  cmp a,#0
+  bnz recv_bytes_loop
+  ret
+
+bulk_get_length:
+;Read the 16-bit length of a bulk transfer from the UART into
+;bulk_left_hi (full blocks) and bulk_left_lo (bytes in the last block)
+  call uart_get
+  mov bulk_left_lo,a
+  call uart_get
+  mov bulk_left_hi,a
+  ret
+
+bulk_full_blocks:
+;Returns Z=1 if the bulk transfer has full blocks.  A length of 0 is
+;65536 bytes, which is 256 full blocks (bulk_left_hi=0 for dbnz).
+  mov a,bulk_left_hi
+  cmp a,#0
+  bnz bulk_full_blocks_yes
+  mov a,bulk_left_lo
+  cmp a,#0
+  ret                   ;Z=1 if length is 0
+bulk_full_blocks_yes:
+  mov a,#0              ;Z=1
+  cmp a,#0
+  ret
+
+fetch_block:
+;Send a block of memory followed by its CRC
+;HL = address, bulk_block = length (0 = 256).  Advances HL.
+  movw ax,#0            ;CRC = 0
+  movw bulk_crc_lo,ax
+fetch_block_loop:
+  mov a,[hl]            ;read byte from memory
+  call crc_update
+  mov a,[hl]
+  call uart_put         ;send it
+  incw hl
+  dbnz bulk_block,fetch_block_loop
+  mov a,bulk_crc_hi     ;send the CRC
+  call uart_put
+  mov a,bulk_crc_lo
+  call uart_put
+  ret
+
+put_block:
+;Receive a block followed by its CRC and write it to memory, until it
+;is received with a good CRC
+;HL = address, bulk_block = length (0 = 256).  Advances HL.
+  mov a,bulk_block      ;save length for retries
+  mov bulk_count,a
+  push hl               ;save address for retries
+put_block_retry:
+  pop hl
+  push hl
+  mov a,bulk_count
+  mov bulk_block,a
+  movw ax,#0            ;CRC = 0
+  movw bulk_crc_lo,ax
+put_block_loop:
+  call uart_get_timeout ;get byte to write
+  bc put_block_bad      ;stalled
+  mov [hl],a            ;write it to memory
+  call crc_update
+  incw hl
+  dbnz bulk_block,put_block_loop
+  call uart_get_timeout ;get CRC high
+  bc put_block_bad
+  call crc_update
+  call uart_get_timeout ;get CRC low
+  bc put_block_bad
+  call crc_update
+  movw ax,bulk_crc_lo   ;CRC of the data and its CRC is 0 if good
+  cmpw ax,#0
+  bnz put_block_bad
+  mov a,#'k             ;send "k" = block is good
+  call uart_put
+  pop ax                ;discard saved address
+  ret
+put_block_bad:
+  mov a,#'n             ;send "n" = send the block again
+  call uart_put
+  br put_block_retry
+
+crc_update:
+;Update the CRC-16/XMODEM in bulk_crc_lo/hi with the byte in A
+;Clobbers A, X
+  push bc
+  xor a,bulk_crc_hi     ;B = CRC high ^ byte
+  mov b,a
+  mov a,bulk_crc_lo     ;C = CRC low
+  mov c,a
+  mov x,#8              ;X = bits left
+crc_update_bit:
+  mov a,c               ;BC = BC << 1, CY = bit shifted out
+  add a,c
+  mov c,a
+  mov a,b
+  rolc a,1
+  mov b,a
+  bnc crc_update_next
+  mov a,b               ;BC = BC ^ 0x1021
+  xor a,#0x10
+  mov b,a
+  mov a,c
+  xor a,#0x21
+  mov c,a
+crc_update_next:
+  dec x
+  bnz crc_update_bit
+  mov a,b
+  mov bulk_crc_hi,a
+  mov a,c
+  mov bulk_crc_lo,a
+  pop bc
+  ret
+
+trace_crc:
+;Update the CRC in bulk_crc_lo/hi with memory
+;HL = address, trace_left = length (0 = 256).  Advances HL.
+  mov a,[hl]
+  call crc_update
+  incw hl
+  dbnz trace_left,trace_crc
+  ret
+
 ;UART routines ==============================================================
 
 uart_get:
-;Read a byte from the UART
+;Read a byte from the receive FIFO, or from the UART if the FIFO is empty
 ;Blocks until one has been received
+;Clobbers D, E
+  mov a,!fifo_head
+  cmp a,!fifo_tail
+  bz uart_get_wait          ;FIFO is empty
+  add a,#fifo_lo            ;DE = address of FIFO head
+  mov e,a
+  mov d,#fifo_hi
+  mov a,!fifo_head          ;Advance the FIFO head
+  inc a
+  and a,#fifo_mask
+  mov !fifo_head,a
+  mov a,[de]                ;A = byte received
+  ret
+
 uart_get_wait:
   bf if0h.2, uart_get_wait  ;Wait until IF0H.2=1 (receive complete)
   mov a,rxb0_txs0           ;A = byte received
@@ -126,11 +782,86 @@ uart_get_wait:
 
 uart_put:
 ;Write a byte to the UART
-;Blocks until it has been sent
+;Blocks until it has been sent.  Bytes received while waiting are put
+;in the receive FIFO so a pipelined client can send the next command
+;while this one is still being answered.  Bytes that do not fit are
+;dropped and fifo_overflow is set.
+;Clobbers A, D, E
     mov rxb0_txs0,a
 uart_put_wait:
-    bf if0h.3, uart_put_wait   ;Wait until IF0H.3=1 (transmit complete)
-    clr1 if0h.3                ;Clear transmit complete interrupt flag
+    bf if0h.2, uart_put_sent    ;Skip if nothing has been received
+    mov a,!fifo_tail            ;A = index after the FIFO tail
+    inc a
+    and a,#fifo_mask
+    cmp a,!fifo_head
+    bz uart_put_overflow        ;FIFO is full
+    mov a,!fifo_tail            ;DE = address of FIFO tail
+    add a,#fifo_lo
+    mov e,a
+    mov d,#fifo_hi
+    mov a,rxb0_txs0             ;A = byte received
+    clr1 if0h.2                 ;Clear receive complete interrupt flag
+    mov [de],a                  ;Put it in the FIFO
+    mov a,!fifo_tail            ;Advance the FIFO tail
+    inc a
+    and a,#fifo_mask
+    mov !fifo_tail,a
+uart_put_sent:
+    bf if0h.3, uart_put_wait    ;Wait until IF0H.3=1 (transmit complete)
+    clr1 if0h.3                 ;Clear transmit complete interrupt flag
+    ret
+uart_put_overflow:
+    mov a,rxb0_txs0             ;Discard the byte received
+    clr1 if0h.2                 ;Clear receive complete interrupt flag
+    mov a,#1                    ;Remember that bytes were lost
+    mov !fifo_overflow,a
+    br uart_put_sent
+
+fifo_flush:
+;Discard everything received until nothing arrives for about 0.5 s,
+;which empties the receive FIFO, then clear the overflow flag
+;Clobbers A, D, E
+    call uart_get_timeout
+    bnc fifo_flush
+    mov a,#0
+    mov !fifo_overflow,a
+    ret
+
+uart_get_timeout:
+;Read a byte from the receive FIFO, or from the UART if the FIFO is empty
+;Gives up if none arrives within about 0.5 s and returns CY=1
+;Clobbers D, E
+    mov a,!fifo_head
+    cmp a,!fifo_tail
+    bz uart_get_timeout_uart    ;FIFO is empty
+    call uart_get               ;A = byte from the FIFO
+    clr1 cy
+    ret
+uart_get_timeout_uart:
+    push hl
+    movw hl,#0                  ;HL = polls left (0 = 65536)
+uart_get_timeout_wait:
+    bt if0h.2, uart_get_timeout_got
+    decw hl
+    mov a,h
+    or a,l
+    bnz uart_get_timeout_wait
+    pop hl
+    set1 cy                     ;Nothing received
+    ret
+uart_get_timeout_got:
+    pop hl
+    mov a,rxb0_txs0             ;A = byte received
+    clr1 if0h.2                 ;Clear receive complete interrupt flag
+    clr1 cy
+    ret
+
+set_baud:
+;Set BRGC0 to A.  The UART must be idle.
+    mov asim0,#0                ;Disable UART
+    mov brgc0,a
+    mov asim0,#0xca             ;Enable UART for tx & rx and 8-N-1
+    clr1 if0h.2                 ;Discard anything received meanwhile
     ret
 
 uart_get_hl:
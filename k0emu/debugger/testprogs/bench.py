@@ -0,0 +1,40 @@
+'''
+Measure the round trip latency and throughput of a debugger.
+
+Usage: python bench.py [emulator]
+
+Set FTDI_DEVICE to the port of a board, or to the port printed by
+k0board to measure the serial path without hardware.  Set FTDI_BAUDRATE
+to switch the board to another baud rate (e.g. 57600) first.
+'''
+import time
+from k0emu.debug import make_debugger_from_argv
+
+def measure(debug, name, func, count, nbytes=0):
+    start = time.time()
+    for i in range(count):
+        debug.invalidate()  # time the link, not the shadow memory
+        func()
+    elapsed = time.time() - start
+    line = "%-12s %8.3f ms/op %10.1f ops/s" % (name, elapsed * 1000 / count, count / elapsed)
+    if nbytes:
+        line += " %10.1f bytes/s" % (nbytes * count / elapsed)
+    print(line)
+
+def main(debug, count=200):
+    code = [0xaf] # ret
+    debug.write(0xf000, code)
+    measure(debug, "call", lambda: debug.call(0xf000), count)
+    measure(debug, "read 1", lambda: debug.read(0xfe00, 1), count, 1)
+    measure(debug, "read 255", lambda: debug.read(0xfb00, 255), count // 10, 255)
+    measure(debug, "read 4096", lambda: debug.read(0xf000, 4096), count // 100, 4096)
+    measure(debug, "write 1", lambda: debug.write(0xfe00, [0x55]), count, 1)
+    measure(debug, "write 255", lambda: debug.write(0xfb00, [0x55] * 255), count // 10, 255)
+    code = [0xa1, 0, 0x9e, 0x00, 0xfe, 0xaf] # mov a,#<a>; mov 0xfe00,a; ret
+    cases = [ (a,) for a in range(256) ]
+    sweep = lambda: list(debug.sweep(0xf000, code, (0xf001,), cases, 0xfe00, 1))
+    measure(debug, "sweep 256", sweep, count // 10, 256)
+
+if __name__ == '__main__':
+    debug = make_debugger_from_argv()
+    main(debug)
@@ -0,0 +1,71 @@
+'''
+Convert fixture reports between the text format and the packed binary
+format of k0emu.results.
+
+Usage: python convert.py <report.txt|report.bin> ...
+
+Each .txt file is converted to a .bin file next to it and each .bin file
+to a .txt file.  The fixture is found by the name of the file, e.g.
+results/serial/test_add.txt uses fixtures/test_add.py.  An existing
+output file is not overwritten.
+'''
+import os
+import sys
+from k0emu.fixture import is_shardable, load_fixture
+from k0emu.results import parse_report, read_results, write_results
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+def load_fixture_for(filename):
+    '''Load the fixture that wrote the report <filename>'''
+    name = os.path.basename(filename).split('.')[0]
+    mod = load_fixture(os.path.join(here, 'fixtures', name + '.py'))
+    if not is_shardable(mod):
+        raise Exception("%s has no cases(), only a text report" % name)
+    return name, mod
+
+def read_report_text(filename):
+    '''Return the text of the report in <filename>, which may be text or
+    binary'''
+    if not filename.endswith('.bin'):
+        with open(filename) as f:
+            return f.read()
+    name, mod = load_fixture_for(filename)
+    with open(filename, 'rb') as f:
+        results = read_results(f, list(mod.cases()))
+    return results.render(mod.report)
+
+def convert(filename):
+    '''Convert <filename> to the other format and return the name of the
+    new file'''
+    name, mod = load_fixture_for(filename)
+    base, ext = os.path.splitext(filename)
+    outfilename = base + ('.txt' if ext == '.bin' else '.bin')
+    if os.path.exists(outfilename):
+        raise Exception("%s exists" % outfilename)
+    if ext == '.bin':
+        text = read_report_text(filename)
+        with open(outfilename, 'w') as f:
+            f.write(text)
+    else:
+        with open(filename) as f:
+            lines = f.read().splitlines(True)
+        results = parse_report(name, list(mod.cases()), lines, mod.report)
+        if results.render(mod.report) != ''.join(lines):
+            raise Exception("%s does not render back to the same text" % filename)
+        with open(outfilename, 'wb') as f:
+            write_results(f, results)
+    return outfilename
+
+def main():
+    exitcode = 0
+    for filename in sys.argv[1:]:
+        try:
+            print("%s -> %s" % (filename, convert(filename)))
+        except Exception as exc:
+            exitcode = 1
+            print("%s: ERROR: %s" % (filename, exc))
+    sys.exit(exitcode)
+
+if __name__ == '__main__':
+    main()
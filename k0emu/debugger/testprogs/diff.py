@@ -1,33 +1,160 @@
+'''
+Compare the reports in results/serial with those in results/emulator.
+
+Usage: python diff.py [-a] [fixture ...]
+
+Reports may be text or binary (see convert.py).  Both reports of a
+fixture are streamed side by side.  For each input that differs, the
+expected (serial) and actual (emulator) outputs are printed, up to
+MAX_CASES per fixture unless -a is given.  Then the differences are
+summed up by the output bit that differs, e.g. "PSW(OUT) AC  512".
+Fixtures are compared in parallel, one process per core.
+'''
+import collections
+import itertools
 import os
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from k0emu.fixture import is_shardable, load_fixture
+from k0emu.processor import Flags
+from k0emu.results import LineParser, iter_results
+
+here = os.path.abspath(os.path.dirname(__file__))
+MAX_CASES = 20
+NO_LINE = '(no line)\n'
+PSW_BITS = dict([ (getattr(Flags, name), name) for name in
+                  ('CY', 'ISP', 'UNUSED', 'RBS0', 'AC', 'RBS1', 'Z', 'IE') ])
+
+def find_report(directory, name):
+    '''Return the filename of the text or binary report <name> in
+    <directory>, or None if there is neither'''
+    for ext in ('.txt', '.bin'):
+        filename = os.path.join(directory, name + ext)
+        if os.path.exists(filename):
+            return filename
+    return None
+
+def iter_lines(filename, mod, cases):
+    '''Yield the lines of the report in <filename>, rendering them with
+    the fixture's report() if the report is binary'''
+    if filename.endswith('.bin'):
+        for case, output in zip(cases, iter_results(filename, cases)):
+            yield mod.report(case, output)
+    else:
+        with open(filename) as f:
+            for line in f:
+                yield line
+
+def field_names(parser, line):
+    '''Return a name for each output byte, taken from the text before
+    the part of <line> that the byte produces, e.g. "PSW(OUT)"'''
+    if parser.spans is None:
+        return [ 'OUT' ] * parser.width
+    names = []
+    for start, stop, values in parser.spans:
+        match = re.search(r'([\w()]+)=$', line[:start])
+        names.append(match.group(1) if match else 'OUT')
+    for i, name in enumerate(names):
+        if names.count(name) > 1:  # e.g. both bytes of AX(OUT)
+            names[i] = "%s[%d]" % (name, i)
+    return names
+
+def bit_name(field, bit):
+    if field.startswith('PSW'):
+        return "%s %s" % (field, PSW_BITS[1 << bit])
+    return "%s bit %d" % (field, bit)
+
+def compare(name, show_all=False):
+    '''Compare the reports of fixture <name>.  Returns (result, text)
+    where result is 'ok', 'DIFFERENT' or 'MISSING' and text is the
+    listing of the differences.'''
+    s_filename = find_report(os.path.join(here, 'results', 'serial'), name)
+    e_filename = find_report(os.path.join(here, 'results', 'emulator'), name)
+    if e_filename is None:
+        return 'MISSING', ''
+
+    same_format = os.path.splitext(s_filename)[1] == os.path.splitext(e_filename)[1]
+    if same_format and _same_contents(s_filename, e_filename):
+        return 'ok', ''
+    mod = load_fixture(os.path.join(here, 'fixtures', name + '.py'))
+    if not is_shardable(mod):
+        return 'DIFFERENT', ''
+    cases = list(mod.cases())
+
+    listing = []
+    bits = collections.Counter()
+    count = 0
+    parser = None
+    s_lines = iter_lines(s_filename, mod, cases)
+    e_lines = iter_lines(e_filename, mod, cases)
+    lines = itertools.zip_longest(s_lines, e_lines, fillvalue=NO_LINE)
+    for case, (s_line, e_line) in itertools.zip_longest(cases, lines):
+        if s_line == e_line:
+            continue
+        count += 1
+        if count <= MAX_CASES or show_all:
+            listing.append("  %r\n    expected: %s\n    actual:   %s" % (
+                case, s_line.rstrip('\n'), e_line.rstrip('\n')))
+        if case is None:
+            bits['extra line'] += 1
+            continue
+        if NO_LINE in (s_line, e_line):
+            bits['missing line'] += 1
+            continue
+        try:
+            if parser is None:
+                parser = LineParser(case, mod.report)
+            expected = parser.parse(case, s_line)
+            actual = parser.parse(case, e_line)
+        except Exception:
+            bits['unparsable line'] += 1
+            continue
+        if parser.scalar:
+            expected, actual = [expected], [actual]
+        names = field_names(parser, s_line)
+        for field, e, a in zip(names, expected, actual):
+            for bit in range(8):
+                if (e ^ a) & (1 << bit):
+                    bits[bit_name(field, bit)] += 1
+
+    if count == 0:
+        return 'ok', ''
+    if count > MAX_CASES and not show_all:
+        listing.append("  ... %d more" % (count - MAX_CASES))
+    listing.append("  %d of %d inputs differ" % (count, len(cases)))
+    for bit, n in sorted(bits.items(), key=lambda item: -item[1]):
+        listing.append("    %-20s %d" % (bit, n))
+    return 'DIFFERENT', '\n'.join(listing) + '\n'
+
+def _same_contents(filename1, filename2, chunk_size=1 << 20):
+    with open(filename1, 'rb') as f1, open(filename2, 'rb') as f2:
+        while True:
+            chunk1 = f1.read(chunk_size)
+            chunk2 = f2.read(chunk_size)
+            if chunk1 != chunk2:
+                return False
+            if not chunk1:
+                return True
 
 def main():
-    serial_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'results/serial'))
-    emulator_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'results/emulator'))
+    show_all = '-a' in sys.argv
+    only = [ arg for arg in sys.argv[1:] if not arg.startswith('-') ]
+    serial_dir = os.path.join(here, 'results', 'serial')
+    names = sorted(set([ os.path.splitext(f)[0] for f in os.listdir(serial_dir)
+                         if f.endswith(('.txt', '.bin')) ]))
+    names = [ name for name in names if not only or name in only ]
 
-    serial_filenames = [ f for f in sorted(os.listdir(serial_dir)) if f.endswith('.txt') ]
     exitcode = 0
-    for basename in serial_filenames:
-        s_filename = os.path.join(serial_dir, basename)
-        e_filename = os.path.join(emulator_dir, basename)
-
-        if os.path.exists(e_filename):
-            with open(s_filename) as f:
-                s_contents = f.read()
-            with open(e_filename) as f:
-                e_contents = f.read()
-
-            if s_contents == e_contents:
-                result = 'ok'
-            else:
+    with ProcessPoolExecutor() as executor:
+        futures = [ executor.submit(compare, name, show_all) for name in names ]
+        for name, future in zip(names, futures):
+            result, listing = future.result()
+            if result != 'ok':
                 exitcode = 1
-                result = 'DIFFERENT'
-
-        else:
-            exitcode = 1
-            result = 'MISSING'
-
-        print("%s: %s" % (basename, result))
+            basename = os.path.basename(find_report(serial_dir, name))
+            print("%s: %s" % (basename, result))
+            sys.stdout.write(listing)
     sys.exit(exitcode)
 
 if __name__ == '__main__':
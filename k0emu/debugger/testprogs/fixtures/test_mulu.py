@@ -1,32 +1,12 @@
-import sys
-from k0emu.debug import make_debugger_from_argv
+from k0emu.spec import InstructionSpec
 
-def test(debug, outfile):
-    for a in range(256):
-        for x in range(256):
-            code = [
-                0x11, 0x1e, 0,      # mov psw,#0
-                0xa1, a,            # mov a,#<a>
-                0xa0, x,            # mov x,#<x>
-                0x31, 0x88,         # mulu x
-                0x9e, 0x06, 0xfe,   # mov 0xfe06,a
-                0x60,               # mov a,x
-                0x9e, 0x07, 0xfe,   # mov 0xfe07,a
-                0xf0, 0x1e,         # mov a,psw
-                0x9e, 0x08, 0xfe,   # mov 0xfe08,a
-                0xaf                # ret
-            ]
-            debug.write(0xf000, code)
-            debug.call(0xf000)
-            a_out, x_out, psw_out = debug.read(0xfe06, length=3)
+spec = InstructionSpec(
+    [0x31, 0x88],  # mulu x
+    inputs=[('A', range(256)), ('X', range(256))],
+    outputs=['A', 'X', 'PSW'],
+    fixed={'PSW': 0})
 
-            fmt = "A(IN)=%02x, X(IN)=%02x -> A(OUT)=%02x, X(OUT)=%02x, PSW(OUT)=%02x\n"
-            outfile.write(fmt % (a, x, a_out, x_out, psw_out))
-            outfile.flush()
-
-def main():
-    debug = make_debugger_from_argv()
-    test(debug, sys.stdout)
+cases, run, report, test, main = spec.fixture()
 
 if __name__ == '__main__':
     main()
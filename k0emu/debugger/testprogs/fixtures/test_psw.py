@@ -1,23 +1,33 @@
 import sys
 from k0emu.debug import make_debugger_from_argv
+from k0emu.fixture import write_report
 
-def test(debug, outfile):
-    for psw in range(0x80):
-        code = [
-            0x11, 0x1e, psw,    # mov psw,#<psw>
-            0xf0, 0x1e,         # mov a,psw
-            0x9e, 0x00, 0xfe,   # mov 0xfe00,a
-            0xf0, 0x1e,         # mov a,0xff1e
-            0x9e, 0x01, 0xfe,   # mov 0xfe01,a
-            0xaf,               # ret
-        ]
-        debug.write(0xf000, code)
-        debug.call(0xf000)
-        psw, ff1e = debug.read(0xfe00, length=2)
+def code(psw):
+    return [
+        0x11, 0x1e, psw,    # mov psw,#<psw>
+        0xf0, 0x1e,         # mov a,psw
+        0x9e, 0x00, 0xfe,   # mov 0xfe00,a
+        0xf0, 0x1e,         # mov a,0xff1e
+        0x9e, 0x01, 0xfe,   # mov 0xfe01,a
+        0xaf,               # ret
+    ]
+
+def cases():
+    return [ (psw,) for psw in range(0x80) ]
+
+def run(debug, cases):
+    codes = ( code(*case) for case in cases )
+    return debug.execute_many(0xf000, codes, 0xfe00, read_length=2,
+                              clobbers=[range(0xfe00, 0xfe0a)])
 
-        fmt = "PSW(OUT)=%02x, FF1E(OUT)=%02x\n"
-        outfile.write(fmt % (psw, ff1e))
-        outfile.flush()
+def report(case, output):
+    psw, ff1e = output
+    fmt = "PSW(OUT)=%02x, FF1E(OUT)=%02x\n"
+    return fmt % (psw, ff1e)
+
+def test(debug, outfile):
+    all_cases = cases()
+    write_report(outfile, all_cases, run(debug, all_cases), report)
 
 def main():
     debug = make_debugger_from_argv()
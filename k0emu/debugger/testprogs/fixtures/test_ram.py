@@ -1,7 +1,9 @@
 import sys
+from k0emu import memtest
 from k0emu.debug import make_debugger_from_argv
+from k0emu.fixture import write_report
 
-def test(debug, outfile):
+def cases():
     address_ranges = (
         # F000-F7FF Internal expansion RAM area (2KB)
         range(0xf000, 0xf800),
@@ -16,20 +18,17 @@ def test(debug, outfile):
         range(0xfe20, 0xfee0),
     )
 
-    for address_range in address_ranges:
-        for pat in (0x55, 0xAA):
-            for address in address_range:
-                debug.write(address, [pat])
-                pat_out = debug.read(address, length=1)[0]
+    return memtest.cases(address_ranges, [memtest.solid(0x55), memtest.solid(0xAA)])
+
+def run(debug, cases):
+    return memtest.run(debug, cases)
 
-                if pat_out == pat:
-                    msg = 'OK'
-                else:
-                    msg = "DIFFERENT"
+def report(case, output):
+    return memtest.report(case, output)
 
-                fmt = "%04x: IN=%02x -> OUT=%02x (%s)\n"
-                outfile.write(fmt % (address, pat, pat_out, msg))
-                outfile.flush()
+def test(debug, outfile):
+    all_cases = cases()
+    write_report(outfile, all_cases, run(debug, all_cases), report)
 
 def main():
     debug = make_debugger_from_argv()
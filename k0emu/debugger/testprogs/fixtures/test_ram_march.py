@@ -0,0 +1,41 @@
+'''
+March-style passes over the RAM with patterns that vary by address:
+walking ones and zeros, and the address folded into a byte and its
+complement.  The reserved area and the memory used by the debugger
+firmware are skipped (see test_ram.py).
+'''
+import sys
+from k0emu import memtest
+from k0emu.debug import make_debugger_from_argv
+from k0emu.fixture import write_report
+
+def cases():
+    address_ranges = (
+        range(0xf000, 0xf800),
+        range(0xfb00, 0xfe00),
+        range(0xfe20, 0xfee0),
+    )
+    patterns = (
+        memtest.walking_ones,
+        memtest.complement(memtest.walking_ones),
+        memtest.address_in_address,
+        memtest.complement(memtest.address_in_address),
+    )
+    return memtest.cases(address_ranges, patterns)
+
+def run(debug, cases):
+    return memtest.run(debug, cases)
+
+def report(case, output):
+    return memtest.report(case, output)
+
+def test(debug, outfile):
+    all_cases = cases()
+    write_report(outfile, all_cases, run(debug, all_cases), report)
+
+def main():
+    debug = make_debugger_from_argv()
+    test(debug, sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -13,10 +13,8 @@ def test(debug, outfile):
             0x61, 0xd0,         # sel rb0
             0xaf,               # ret
         ]
-        debug.write(0xf000, code)
         debug.write(0xfee0, [0]*24)
-        debug.call(0xf000)
-        registers = debug.read(0xfee0, length=24)
+        registers = debug.execute(0xf000, code, 0xfee0, read_length=24)
         dump = ', '.join([ '%02x' % r for r in registers])
         outfile.write('SEL RB%d FEE0: %s\n' % (bank, dump))
         outfile.flush()
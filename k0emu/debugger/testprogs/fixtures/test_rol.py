@@ -1,29 +1,12 @@
-import sys
-from k0emu.debug import make_debugger_from_argv
+from k0emu.spec import InstructionSpec
 
-def test(debug, outfile):
-    for psw in (0, 1):
-        for a in range(256):
-            code = [
-                0x11, 0x1e, psw,     # mov psw,#<psw>
-                0xA1, a,             # mov a,#<a>
-                0x26,                # rol a,1
-                0x9E, 0x00, 0xFE,    # mov 0xfe00,a
-                0xF0, 0x1E,          # mov a,psw
-                0x9E, 0x01, 0xFE,    # mov 0xfe01,a
-                0xAF,                # ret
-            ]
-            debug.write(0xf000, code)
-            debug.call(0xf000)
-            a_out, psw_out = debug.read(0xfe00, length=2)
+spec = InstructionSpec(
+    [0x26],  # rol a,1
+    inputs=[('PSW', (0, 1)), ('A', range(256))],
+    outputs=['A', 'PSW'],
+    report_inputs=['A', 'PSW'])
 
-            fmt = "A(IN)=%02x, PSW(IN)=%02x -> A(OUT)=%02x, PSW(OUT)=%02x\n"
-            outfile.write(fmt % (a, psw, a_out, psw_out))
-            outfile.flush()
-
-def main():
-    debug = make_debugger_from_argv()
-    test(debug, sys.stdout)
+cases, run, report, test, main = spec.fixture()
 
 if __name__ == '__main__':
     main()
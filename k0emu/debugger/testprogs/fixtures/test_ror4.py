@@ -1,25 +1,34 @@
 import sys
 from k0emu.debug import make_debugger_from_argv
+from k0emu.fixture import write_report
 
-def test(debug, outfile):
-    for a in range(256):
-        for mem in range(256):
-            code = [
-                0x16, 0x00, 0xfe,   # movw hl,#0xfe00
-                0xa1, mem,          # mov a,#<mem>
-                0x97,               # mov [hl],a
-                0xa1, a,            # mov a,#<a>
-                0x31, 0x90,         # ror4 [hl]
-                0x9e, 0x01, 0xfe,   # mov 0xfe01,a
-                0xaf                # ret
-            ]
-            debug.write(0xf000, code)
-            debug.call(0xf000)
-            mem_out, a_out = debug.read(0xfe00, length=2)
+def code(a, mem):
+    return [
+        0x16, 0x00, 0xfe,   # movw hl,#0xfe00
+        0xa1, mem,          # mov a,#<mem>
+        0x97,               # mov [hl],a
+        0xa1, a,            # mov a,#<a>
+        0x31, 0x90,         # ror4 [hl]
+        0x9e, 0x01, 0xfe,   # mov 0xfe01,a
+        0xaf                # ret
+    ]
+
+def cases():
+    return [ (a, mem) for a in range(256) for mem in range(256) ]
+
+def run(debug, cases):
+    patches = (0xf007, 0xf004)  # <a>, <mem>
+    return debug.sweep(0xf000, code(*cases[0]), patches, cases,
+                       0xfe00, read_length=2, clobbers=[range(0xfe00, 0xfe0a)])
 
-            fmt = "A(IN)=%02x, MEM(IN)=%02x -> A(OUT)=%02x, MEM(OUT)=%02x\n"
-            outfile.write(fmt % (a, mem, a_out, mem_out))
-            outfile.flush()
+def report(case, output):
+    (a, mem), (mem_out, a_out) = case, output
+    fmt = "A(IN)=%02x, MEM(IN)=%02x -> A(OUT)=%02x, MEM(OUT)=%02x\n"
+    return fmt % (a, mem, a_out, mem_out)
+
+def test(debug, outfile):
+    all_cases = cases()
+    write_report(outfile, all_cases, run(debug, all_cases), report)
 
 def main():
     debug = make_debugger_from_argv()
@@ -16,10 +16,8 @@ def test(debug, outfile):
         0x03, 0x02, 0xfe,   # movw 0xfe02,ax
         0xaf                # ret
     ]
-    debug.write(0xf000, code)
-    debug.call(0xf000)
+    sp_low, sp_high, ff1c_low, ff1c_high = debug.execute(0xf000, code, 0xfe00, read_length=4)
 
-    sp_low, sp_high, ff1c_low, ff1c_high = debug.read(0xfe00, length=4)
     sp = (sp_high << 8) + sp_low
     ff1c = (ff1c_high << 8) + ff1c_low
 
@@ -0,0 +1,75 @@
+'''
+Query the fixture reports through an SQLite database (k0emu.resultsdb).
+
+Usage:
+    python query.py ingest
+    python query.py lookup <fixture>[,<fixture>...] <name>=<hex> ...
+    python query.py differ <fixture> <name> [<bit>|<hex mask>]
+    python query.py sql "<statement>"
+
+ingest reads the reports in results/serial and results/emulator into
+results/results.sqlite3.  Only new or changed reports are read.  The
+other commands ingest first, then for example:
+
+    python query.py lookup test_adjba,test_adjbs A_in=99 PSW_in=11
+    python query.py differ test_add PSW_out AC
+'''
+import os
+import sys
+from convert import read_report_text
+from diff import PSW_BITS, find_report
+from k0emu.resultsdb import ResultsDatabase
+
+here = os.path.abspath(os.path.dirname(__file__))
+SOURCES = ('serial', 'emulator')
+PSW_MASKS = dict([ (name, mask) for mask, name in PSW_BITS.items() ])
+
+def ingest(db):
+    for path in db.forget_missing():
+        print("Removed %s" % path)
+    for source in SOURCES:
+        directory = os.path.join(here, 'results', source)
+        names = sorted(set([ os.path.splitext(f)[0] for f in os.listdir(directory)
+                             if f.endswith(('.txt', '.bin')) ]))
+        for name in names:
+            path = find_report(directory, name)
+            read_lines = lambda: read_report_text(path).splitlines(True)
+            if db.ingest(path, name, source, read_lines):
+                print("Ingested %s" % os.path.relpath(path, here))
+
+def parse_mask(text):
+    if text in PSW_MASKS:
+        return PSW_MASKS[text]
+    return int(text, 16)
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    db = ResultsDatabase(os.path.join(here, 'results', 'results.sqlite3'))
+    try:
+        ingest(db)
+        command, args = argv[1], argv[2:]
+        if command == 'lookup':
+            values = dict([ (arg.split('=')[0], int(arg.split('=')[1], 16))
+                            for arg in args[1:] ])
+            for fixture, source, line, text in db.lookup(args[0].split(','), **values):
+                print("%s %-8s %6d: %s" % (fixture, source, line, text))
+        elif command == 'differ':
+            mask = parse_mask(args[2]) if len(args) > 2 else 0xff
+            rows = db.differ(args[0], args[1], mask)
+            for line, inputs, expected, actual in rows:
+                print("%6d: %s: serial %02x, emulator %02x" % (line, inputs, expected, actual))
+            print("%d lines differ" % len(rows))
+        elif command == 'sql':
+            for row in db.query(args[0]):
+                print(' | '.join([ str(value) for value in row ]))
+        elif command != 'ingest':
+            print(__doc__)
+            return 1
+    finally:
+        db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
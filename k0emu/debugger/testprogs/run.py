@@ -1,38 +1,110 @@
 import os
 import sys
-import importlib.util
-from k0emu.debug import make_debugger_from_argv
+from concurrent.futures import ProcessPoolExecutor
+from k0emu.debug import make_debuggers_from_argv
+from k0emu.fixture import (CHECKPOINT_SUFFIX, ShardScheduler, is_shardable,
+                           load_fixture, resume_report, submit_fixture)
+from k0emu.resultcache import ResultCache
 
-def main(debug):
-    here = os.path.abspath(os.path.join(os.path.dirname(__file__), 'fixtures'))
-    for filename in sorted(os.listdir(here)):
+here = os.path.abspath(os.path.dirname(__file__))
+
+def list_fixtures(what):
+    '''Yield (filename, fullname, outfilename) for each fixture and its
+    report for <what>'''
+    fixtures_dir = os.path.join(here, 'fixtures')
+    for filename in sorted(os.listdir(fixtures_dir)):
         if not filename.startswith('test_') or not filename.endswith('.py'):
             continue
-        fullname = os.path.join(here, filename)
+        fullname = os.path.join(fixtures_dir, filename)
 
         basename = os.path.basename(filename).split('.')[0] + '.txt'
-        if 'emulator' in sys.argv:
-            what = 'emulator'
-        else:
-            what = 'serial'
-        outfilename = os.path.abspath(os.path.join(here, '..', 'results', what, basename))
+        outfilename = os.path.join(here, 'results', what, basename)
+        yield filename, fullname, outfilename
 
-        if os.path.exists(outfilename):
+def find_fixtures(what):
+    '''Yield (filename, fullname, outfilename) for each fixture whose
+    report for <what> does not exist yet or is incomplete'''
+    for filename, fullname, outfilename in list_fixtures(what):
+        if os.path.exists(outfilename + CHECKPOINT_SUFFIX):
+            print("Resuming %s on %s" % (filename, what))
+            yield filename, fullname, outfilename
+        elif os.path.exists(outfilename):
             print("Skipping %s on %s (report exists)" % (filename, what))
         else:
-            print("Running %s on %s" % (filename, what))
-            with open(outfilename, 'w') as outfile:
-                spec = importlib.util.spec_from_file_location("module.name", fullname)
-                mod = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(mod)
-                try:
-                    mod.test(debug, outfile)
-                except Exception as exc:
-                    msg = "ERROR: %r\n" % exc
-                    print(msg)
-                    outfile.close()
-                    os.remove(outfilename)
+            yield filename, fullname, outfilename
+
+def write_report(outfilename, func):
+    '''Write the report with func(outfile), removing it on error.
+    Returns True if the report was written.'''
+    with open(outfilename, 'w') as outfile:
+        try:
+            func(outfile)
+        except Exception as exc:
+            msg = "ERROR: %r\n" % exc
+            print(msg)
+            outfile.close()
+            os.remove(outfilename)
+            return False
+    return True
+
+def resume(outfilename, mod, scheduler):
+    '''Write the report with the scheduler, keeping it on error so the
+    next run can resume it'''
+    def run(outfile, start, stop, progress):
+        scheduler.run(mod, outfile, start, stop, progress)
+    try:
+        resume_report(outfilename, list(mod.cases()), run)
+    except Exception as exc:
+        msg = "ERROR: %r\n" % exc
+        print(msg)
+
+def main(debuggers):
+    scheduler = ShardScheduler(debuggers)
+    for filename, fullname, outfilename in find_fixtures('serial'):
+        print("Running %s on %s" % (filename, 'serial'))
+        mod = load_fixture(fullname)
+        if is_shardable(mod):
+            resume(outfilename, mod, scheduler)
+        else:
+            write_report(outfilename, lambda outfile: scheduler.run(mod, outfile))
+
+    for debug, exc in scheduler.failures:
+        print("Dropped a debugger after ERROR: %r" % exc)
+
+def main_emulator(max_workers=None):
+    '''Run the fixtures on emulators in a pool of processes, one per
+    core by default.  All fixtures are submitted at once so the shards
+    of the next fixtures run while the reports of the first are written.
+    A report is kept until the fixture or the k0emu code it ran changes
+    (see k0emu.resultcache).'''
+    cache = ResultCache(os.path.join(here, 'results', 'emulator', 'manifest.json'))
+    with ProcessPoolExecutor(max_workers) as executor:
+        submitted = []
+        for filename, fullname, outfilename in list_fixtures('emulator'):
+            name = filename.split('.')[0]
+            if os.path.exists(outfilename) and cache.is_current(name, fullname):
+                print("Skipping %s on %s (up to date)" % (filename, 'emulator'))
+                continue
+            cache.forget(name)
+            futures = submit_fixture(executor, fullname, trace=True)
+            submitted.append((filename, fullname, outfilename, futures))
+
+        for filename, fullname, outfilename, futures in submitted:
+            print("Running %s on %s" % (filename, 'emulator'))
+            traces = []
+            def write(outfile):
+                for future in futures:
+                    text, seconds, functions = future.result()
+                    outfile.write(text)
+                    traces.append((seconds, functions))
+            if write_report(outfilename, write):
+                seconds = sum([ s for s, _ in traces ])
+                functions = sorted(set([ f for _, fs in traces for f in fs ]))
+                cache.record(filename.split('.')[0], fullname, functions, seconds)
 
 if __name__ == '__main__':
-    debug = make_debugger_from_argv()
-    main(debug)
+    if 'emulator' in sys.argv:
+        main_emulator()
+    else:
+        debuggers = make_debuggers_from_argv()
+        main(debuggers)
@@ -0,0 +1,310 @@
+'''
+Helpers for the test programs in k0emu/debugger/testprogs/fixtures.
+
+A fixture that can be split up defines three functions:
+
+    cases()             returns the list of inputs, one for each report line
+    run(debug, cases)   runs <cases> in order and yields one output for each
+    report(case, output)  returns the report line for a case and its output
+
+Since each case is independent, the scheduler can run slices of the list
+on several debuggers at once and still write the same report.  Fixtures
+that only define test(debug, outfile) are run whole on one debugger.
+
+For the same reason an interrupted run can be resumed.  While a report
+is written, a checkpoint file next to it records how many cases are
+complete; resume_report() keeps those lines and continues after them.
+
+Fixtures that test one instruction declare it with an InstructionSpec
+(see k0emu.spec), which makes these functions.
+'''
+import importlib.util
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+from k0emu.debug import make_emulator_debugger
+
+SHARD_SIZE = 0x1000  # cases; a multiple of 256 keeps sweeps rectangular
+CHECKPOINT_SUFFIX = '.checkpoint'
+SEAM_CASES = 16     # cases rerun on each side of a resume point
+
+
+def write_report(outfile, cases, outputs, report):
+    '''Write the report line for each case and its output to <outfile>'''
+    for case, output in zip(cases, outputs):
+        outfile.write(report(case, output))
+        outfile.flush()
+
+def resume_report(outfilename, cases, run):
+    '''Write the report for <cases> to <outfilename>.  run(outfile, start,
+    stop, progress) must write the report lines of cases[start:stop] and,
+    if <progress> is not None, call progress(count) when the lines of the
+    first <count> of those cases are complete.
+
+    If the checkpoint of an earlier run that was interrupted exists, the
+    complete lines of that run are kept and this run continues after the
+    last case it completed.  When all cases are done, the cases around
+    each resume point are run again and must give the same lines as the
+    report, then the checkpoint is removed.'''
+    checkpoint = Checkpoint(outfilename + CHECKPOINT_SUFFIX)
+    if checkpoint.exists() and os.path.exists(outfilename):
+        checkpoint.load()
+        if checkpoint.count and checkpoint.case != list(cases[checkpoint.count - 1]):
+            raise Exception("Checkpoint %s does not match the cases of the fixture" %
+                            checkpoint.filename)
+        _truncate_lines(outfilename, checkpoint.count)
+        if 0 < checkpoint.count < len(cases):
+            checkpoint.seams.append(checkpoint.count)
+    else:
+        open(outfilename, 'w').close()
+    checkpoint.save()
+
+    start = checkpoint.count
+    def progress(count):
+        checkpoint.count = start + count
+        checkpoint.case = list(cases[checkpoint.count - 1])
+        checkpoint.save()
+    with open(outfilename, 'a') as outfile:
+        run(outfile, start, len(cases), progress)
+
+    try:
+        verify_report(outfilename, cases, checkpoint.seams, run)
+    except Exception:
+        os.remove(outfilename)  # start over next time
+        raise
+    finally:
+        checkpoint.remove()
+
+def verify_report(outfilename, cases, seams, run):
+    '''Check that the report in <outfilename> has a line for each case
+    and that the lines around each resume point in <seams> are the same
+    when those cases are run again by run() (see resume_report())'''
+    with open(outfilename) as f:
+        lines = f.readlines()
+    if len(lines) != len(cases):
+        raise Exception("Report %s has %d lines for %d cases" % (
+            outfilename, len(lines), len(cases)))
+    for seam in seams:
+        start = max(0, seam - SEAM_CASES)
+        stop = min(len(cases), seam + SEAM_CASES)
+        outfile = io.StringIO()
+        run(outfile, start, stop, None)
+        if outfile.getvalue() != ''.join(lines[start:stop]):
+            raise Exception("Report %s differs from a rerun of cases %d-%d" % (
+                outfilename, start, stop - 1))
+
+def _truncate_lines(filename, count):
+    '''Truncate <filename> after its first <count> lines'''
+    with open(filename, 'rb+') as f:
+        data = f.read()
+        offset = 0
+        for i in range(count):
+            offset = data.find(b'\n', offset) + 1
+            if offset == 0:
+                raise Exception("Report %s has fewer than %d lines" % (filename, count))
+        f.truncate(offset)
+
+def is_shardable(module):
+    return all([ hasattr(module, name) for name in ('cases', 'run', 'report') ])
+
+def load_fixture(filename):
+    '''Load the fixture module from <filename>'''
+    spec = importlib.util.spec_from_file_location("module.name", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def submit_fixture(executor, filename, shard_size=SHARD_SIZE, trace=False):
+    '''Submit the fixture in <filename> to a ProcessPoolExecutor to run
+    on emulators, split into shards if it can be.  Returns a list of
+    futures whose results, concatenated, are the report.  With <trace>,
+    each result is instead (report text, seconds, names of the k0emu
+    functions called), see k0emu.resultcache.'''
+    module = load_fixture(filename)
+    run = _run_traced_shard if trace else _run_shard
+    if not is_shardable(module):
+        return [executor.submit(run, filename, None, None)]
+    count = len(module.cases())
+    return [ executor.submit(run, filename, start, start + shard_size)
+             for start in range(0, count, shard_size) ]
+
+# each process of the pool keeps its emulator and the fixtures it loaded
+_process_debug = None
+_process_fixtures = {}
+_process_setup = []         # functions called to make _process_debug
+
+def _run_shard(filename, start, stop):
+    '''Run cases [start:stop] of the fixture in <filename>, or all of
+    it if <start> is None, and return the report text'''
+    global _process_debug
+    if _process_debug is None:
+        _process_debug = make_emulator_debugger()
+    if filename not in _process_fixtures:
+        module = load_fixture(filename)
+        cases = list(module.cases()) if is_shardable(module) else None
+        _process_fixtures[filename] = (module, cases)
+    module, cases = _process_fixtures[filename]
+    outfile = io.StringIO()
+    if start is None:
+        module.test(_process_debug, outfile)
+    else:
+        shard = cases[start:stop]
+        write_report(outfile, shard, module.run(_process_debug, shard), module.report)
+    return outfile.getvalue()
+
+def _run_traced_shard(filename, start, stop):
+    '''Like _run_shard(), but returns (report text, seconds, names of
+    functions called).  Every shard is traced, since cases in other
+    shards may reach functions the first one does not; the functions
+    that made the emulator of the process are traced once and added to
+    the names of each shard.'''
+    global _process_debug, _process_setup
+    from k0emu.resultcache import trace_calls
+    started = time.time()
+    if _process_debug is None:
+        _process_debug, _process_setup = trace_calls(make_emulator_debugger)
+    text, functions = trace_calls(_run_shard, filename, start, stop)
+    functions = sorted(set(functions + _process_setup))
+    return text, time.time() - started, functions
+
+
+class Checkpoint(object):
+    '''Progress of a report being written: the number of cases whose
+    lines are complete, the last of those cases, and the case numbers
+    where interrupted runs were resumed.  Saved as JSON in <filename>.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.case = None
+        self.seams = []
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        with open(self.filename) as f:
+            state = json.load(f)
+        self.count = state['count']
+        self.case = state['case']
+        self.seams = state['seams']
+
+    def save(self):
+        state = {'count': self.count, 'case': self.case, 'seams': self.seams}
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp, self.filename)  # never leave half a checkpoint
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.filename)
+
+
+class ShardScheduler(object):
+    '''Runs fixtures on several debuggers at once.  The cases of a fixture
+    are split into shards that the debuggers take from a queue, so a fast
+    board takes more of them.  If a debugger fails, its shard goes back
+    on the queue for the others and the debugger is not used again.  The
+    report is written in case order as the shards complete.'''
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, debuggers, shard_size=SHARD_SIZE):
+        self.debuggers = list(debuggers)
+        self.shard_size = shard_size
+        self.failures = []  # (debugger, exception) for each failed debugger
+
+    def run(self, module, outfile, start=0, stop=None, progress=None):
+        '''Run the fixture <module> and write its report to <outfile>.
+        Only cases[start:stop] are run if the fixture can be split up;
+        progress(count) is called as the lines of each shard are written
+        (see resume_report()).'''
+        if not self.debuggers:
+            raise Exception("No debuggers left")
+        if not is_shardable(module):
+            module.test(self.debuggers[0], outfile)
+            return
+
+        cases = list(module.cases())[start:stop]
+        shards = [ cases[start:start + self.shard_size]
+                   for start in range(0, len(cases), self.shard_size) ]
+        run = _ShardRun(module, shards, len(self.debuggers), self.POLL_INTERVAL)
+        threads = []
+        for debug in self.debuggers:
+            thread = threading.Thread(target=run.work, args=(debug,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            count = 0
+            for shard, outputs in zip(shards, run.outputs_in_order()):
+                write_report(outfile, shard, outputs, module.report)
+                count += len(shard)
+                if progress is not None:
+                    progress(count)
+        finally:
+            run.stop()
+            for thread in threads:
+                thread.join()
+            for debug, exc in run.failures:
+                self.debuggers.remove(debug)
+                self.failures.append((debug, exc))
+
+
+class _ShardRun(object):
+    '''State shared by the threads running the shards of one fixture'''
+
+    def __init__(self, module, shards, workers, poll_interval):
+        self.module = module
+        self.shards = shards
+        self.poll_interval = poll_interval
+        self.pending = queue.Queue()
+        for index in range(len(shards)):
+            self.pending.put(index)
+        self.outputs = {}
+        self.failures = []
+        self.workers = workers  # threads still running
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def work(self, debug):
+        '''Run shards on <debug> until all of them are done'''
+        try:
+            while not self.stopped:
+                try:
+                    index = self.pending.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+                try:
+                    outputs = list(self.module.run(debug, self.shards[index]))
+                except Exception as exc:
+                    self.pending.put(index)  # for another debugger
+                    with self.condition:
+                        self.failures.append((debug, exc))
+                    return
+                with self.condition:
+                    self.outputs[index] = outputs
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.workers -= 1
+                self.condition.notify_all()
+
+    def outputs_in_order(self):
+        '''Yield the outputs of each shard in order, waiting for them'''
+        for index in range(len(self.shards)):
+            with self.condition:
+                while index not in self.outputs:
+                    if self.workers == 0:
+                        raise Exception("All debuggers failed: %r" % (
+                            [ exc for _, exc in self.failures ],))
+                    self.condition.wait()
+                outputs = self.outputs.pop(index)
+            yield outputs
+
+    def stop(self):
+        self.stopped = True
@@ -0,0 +1,230 @@
+'''
+Usage: k0fuzz [<cases> [<seed> [<candidate>]]]
+
+Runs random instruction streams on the emulator from random states and
+checks what must hold after every instruction, whatever it computed:
+
+- it raised no exception other than NotImplementedError (or one of the
+  UNDEFINED_OPERANDS)
+- the PC is still an address (an int in 0x0000-0xFFFF)
+- bit 2 of the PSW is still 0
+- the reserved memory at 0xF800-0xFAFF is unchanged
+
+A case is made from its seed alone: all 64K of memory (so the registers,
+PSW, SP and every operand) are random, and INSTRUCTIONS instructions
+made from the opcodes in the opcode maps of Processor, with random
+operand bytes, are written at CODE_ADDRESS.  One Processor is reset to
+the state of each case by copying its memory, which is much quicker
+than making a new one.  A case ends when the PC is not at one of its
+instructions (after the last one, or on a branch elsewhere, where the
+bytes may not be a valid instruction), after MAX_STEPS instructions if
+it loops, or when an instruction is undefined.
+
+If <candidate> (one of crosscheck.CANDIDATES) is given, the cases are
+run on it instead, and also on Processor as the reference, and the
+first instruction whose effects differ is reported.  The number of cases run per second is printed, and appended
+to the file named by the FUZZ_LOG environment variable if it is set, so
+the throughput of the fuzzer can be followed over time:
+
+    $ FUZZ_LOG=fuzz.log k0fuzz 100000 1 batch
+'''
+import os
+import random
+import sys
+import time
+from k0dasm.disassemble import IllegalInstructionError, disassemble
+from k0emu.crosscheck import CANDIDATES, CrossCheck
+from k0emu.processor import Processor
+
+PREFIXES = (0x31, 0x61, 0x71)
+
+# messages of the exceptions Processor raises on purpose for operands the
+# hardware does not allow, e.g. ROR4 [HL] with HL in the SFR area.  They
+# end a case like NotImplementedError.
+UNDEFINED_OPERANDS = ('does not allow', 'must be an even address')
+
+
+class Failure(object):
+    '''A check that failed in the case made from <seed>, at the
+    instruction number <count> (from 1) at <address>'''
+
+    def __init__(self, seed, count, address, message):
+        self.seed = seed
+        self.count = count
+        self.address = address
+        self.message = message
+
+    def __str__(self):
+        return "seed %d, instruction %d at %04x: %s" % (
+            self.seed, self.count, self.address, self.message)
+
+
+class FuzzReport(object):
+    def __init__(self):
+        self.cases = 0
+        self.undefined = 0  # cases ended by NotImplementedError or UNDEFINED_OPERANDS
+        self.failures = []
+        self.seconds = 0.0
+
+    def cases_per_second(self):
+        if self.seconds == 0:
+            return 0.0
+        return self.cases / self.seconds
+
+    def __str__(self):
+        return "%d cases in %.1f s (%.0f cases/s), %d undefined, %d failures" % (
+            self.cases, self.seconds, self.cases_per_second(),
+            self.undefined, len(self.failures))
+
+
+class Fuzzer(object):
+    '''Runs random cases on <proc>, and on <reference> too if it is
+    given'''
+    CODE_ADDRESS = 0xf000
+    INSTRUCTIONS = 8    # per case
+    MAX_STEPS = 256     # per case, the code may loop
+
+    def __init__(self, proc=None, reference=None, instructions=INSTRUCTIONS):
+        if proc is None:
+            proc = Processor()
+        self.proc = proc
+        self.reference = reference
+        self.instructions = instructions
+        self.opcodes = opcodes(proc)
+
+    def case(self, seed):
+        '''Return the memory of the case made from <seed> and the
+        addresses of the instructions of its code, which is at
+        CODE_ADDRESS'''
+        rng = random.Random(seed)
+        memory = bytearray(rng.getrandbits(0x80000).to_bytes(0x10000, 'little'))
+        address = self.CODE_ADDRESS
+        addresses = set()
+        for i in range(self.instructions):
+            code = self._instruction(rng, memory, address)
+            memory[address:address + len(code)] = code
+            addresses.add(address)
+            address += len(code)
+        return memory, addresses
+
+    def _instruction(self, rng, memory, address):
+        '''Return the bytes of a random instruction, written at
+        <address> in <memory> to decode it'''
+        while True:
+            code = bytearray(rng.choice(self.opcodes))
+            code.extend([ rng.randrange(0x100) for i in range(4 - len(code)) ])
+            memory[address:address + len(code)] = code
+            try:
+                instruction = disassemble(memory, address)
+            except IllegalInstructionError:
+                continue  # e.g. a word operand at an odd address
+            return code[:len(instruction.all_bytes)]
+
+    def run_case(self, seed, report):
+        '''Run the case made from <seed> and add it to <report>'''
+        memory, addresses = self.case(seed)
+        failure, steps = self._check(seed, memory, addresses)
+        report.cases += 1
+        if steps < 0:
+            report.undefined += 1
+            steps = -steps
+        if failure is None and self.reference is not None and steps > 0:
+            failure = self._compare(seed, memory, steps)
+        if failure is not None:
+            report.failures.append(failure)
+
+    def _check(self, seed, memory, addresses):
+        '''Run the case in <memory> on the processor, checking after
+        each instruction, until the PC is not one of the <addresses> of
+        its instructions or MAX_STEPS instructions have run.
+        Returns a Failure or None, and the number of instructions run,
+        negated if the next one is undefined.'''
+        proc = self.proc
+        proc.memory[:] = memory
+        proc.pc = self.CODE_ADDRESS
+        reserved = proc.memory[proc.RESERVED_RANGE.start:proc.RESERVED_RANGE.stop]
+        count = 0
+        while proc.pc in addresses and count < self.MAX_STEPS:
+            address = proc.pc
+            try:
+                proc.step()
+            except NotImplementedError:
+                return None, -count
+            except Exception as exc:
+                if any([ text in str(exc) for text in UNDEFINED_OPERANDS ]):
+                    return None, -count
+                return Failure(seed, count + 1, address, "raised %r" % exc), count
+            count += 1
+            message = _invariant_broken(proc, reserved)
+            if message is not None:
+                return Failure(seed, count, address, message), count
+        return None, count
+
+    def _compare(self, seed, memory, steps):
+        '''Run <steps> instructions of the case in <memory> on the
+        reference and the processor in lockstep.  Returns a Failure for
+        the first instruction whose effects differ, or None.'''
+        self.reference.memory[:] = memory
+        self.reference.pc = self.CODE_ADDRESS
+        check = CrossCheck(self.reference, self.proc, interval=steps)
+        mismatch = check.run(steps)
+        if mismatch is None:
+            return None
+        lines = str(mismatch).splitlines()
+        return Failure(seed, mismatch.count, mismatch.address,
+                       "differs from the reference: " + '; '.join(lines[1:]))
+
+    def run(self, cases, seed=0):
+        '''Run the cases made from the <cases> seeds starting at <seed>.
+        Returns a FuzzReport.'''
+        report = FuzzReport()
+        start = time.time()
+        for case_seed in range(seed, seed + cases):
+            self.run_case(case_seed, report)
+        report.seconds = time.time() - start
+        return report
+
+
+def opcodes(proc):
+    '''Return the opcode bytes (1 or 2 with a prefix) of the instructions
+    in the opcode maps of <proc>'''
+    maps = [ (prefix, getattr(proc, '_opcode_map_prefix_0x%02x' % prefix))
+             for prefix in PREFIXES ]
+    result = [ [opcode] for opcode in sorted(proc._opcode_map_unprefixed)
+               if opcode not in PREFIXES ]
+    for prefix, opcode_map in maps:
+        result.extend([ [prefix, opcode] for opcode in sorted(opcode_map) ])
+    return result
+
+def _invariant_broken(proc, reserved):
+    '''Return why the state of <proc> is impossible, or None'''
+    pc = proc.pc
+    if not isinstance(pc, int) or not 0 <= pc <= 0xFFFF:
+        return "PC is %r" % (pc,)
+    if proc.memory[proc.PSW_ADDRESS] & 0b00000100:
+        return "PSW bit 2 is set: %02x" % proc.memory[proc.PSW_ADDRESS]
+    r = proc.RESERVED_RANGE
+    if proc.memory[r.start:r.stop] != reserved:
+        return "reserved memory at %04x-%04x changed" % (r.start, r.stop - 1)
+    return None
+
+
+def main():
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    proc = reference = None
+    if len(sys.argv) > 3:
+        proc, reference = CANDIDATES[sys.argv[3]](), Processor()
+    report = Fuzzer(proc, reference).run(cases, seed)
+    for failure in report.failures:
+        print(failure)
+    print(report)
+    filename = os.environ.get('FUZZ_LOG')
+    if filename is not None:
+        with open(filename, 'a') as f:
+            f.write("%s seed=%d %s\n" % (time.strftime('%Y-%m-%dT%H:%M:%S'), seed, report))
+    if report.failures:
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
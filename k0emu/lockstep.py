@@ -0,0 +1,210 @@
+'''
+Usage: k0lockstep <code.bin> <address> [<start>-<stop> ...]
+
+Runs code on the board and on the emulator in lockstep, one instruction
+at a time, and stops at the first instruction whose effects differ.
+
+The board steps the code with the T command of the debugger firmware.
+The host puts a BRK at each address the instruction may continue at
+(where the emulator went and the next instruction) and the firmware runs
+the code until it reaches one.  It then answers with the address it
+stopped at and a CRC of the registers, PSW, SP and the watched ranges,
+so each step costs a few bytes on the serial link instead of a dump of
+the state.  The same CRC is computed over the emulator.  Only when the
+two differ is the state of the board read back, to report what differs.
+
+The code must be in RAM on the board, since BRKs are written over it,
+and must leave alone the memory the firmware uses (TRACE_CONTEXT, the
+command scratch area, the stack of the firmware and the table of watched
+ranges).  An instruction that branches into itself (e.g. "dbnz b,$")
+can't be stepped.  The code to test is loaded at <address> on both
+sides and run from there, watching the register banks 1-3 and the
+ranges given (hex, stop excluded), e.g.:
+
+    $ FTDI_DEVICE=/dev/pts/3 k0lockstep routine.bin f000 f400-f800
+'''
+import sys
+from k0dasm.disassemble import disassemble
+from k0emu.debug import (TRACE_CONTEXT, TRACE_HASHED, crc_xmodem,
+                         make_serial_debugger)
+from k0emu.processor import Processor
+
+# registers of banks 3-2-1, bank 0 is in the context
+REGISTER_BANKS = range(0xfee0, 0xfef8)
+
+# default address of the table of watched ranges on the board
+WATCH_TABLE_ADDRESS = 0xfe20
+
+# name, offset in the context, size in bytes
+CONTEXT_FIELDS = [('PC', 0, 2), ('SP', 2, 2), ('PSW', 4, 1)] + [
+    (name, 6 + i, 1) for i, name in enumerate('XACBEDLH') ]
+
+
+class LockstepError(Exception):
+    pass
+
+
+class Divergence(object):
+    '''The first instruction whose effects differ on the board and on
+    the emulator.  <differences> lists (name, board value, emulator
+    value) for each register and each watched byte that differs.'''
+
+    def __init__(self, step, address, code, differences):
+        self.step = step
+        self.address = address
+        self.code = code
+        self.differences = differences
+
+    def __str__(self):
+        hexcode = ' '.join([ "%02x" % b for b in self.code ])
+        memory = bytearray(0x10000)
+        memory[self.address:self.address + len(self.code)] = self.code
+        lines = ["Step %d: %04x: %s  %s" % (self.step, self.address, hexcode,
+                                           disassemble(memory, self.address))]
+        for name, board, emulator in self.differences:
+            width = 4 if name in ('PC', 'SP') else 2
+            lines.append("  %s: board=%0*x emulator=%0*x" % (
+                name, width, board, width, emulator))
+        return '\n'.join(lines) + '\n'
+
+
+class Lockstep(object):
+    '''Steps code on the board behind the SerialDebugger <debug> and on
+    <proc> together.  Memory outside the context must already be the
+    same on both, see load().  <watch> lists the ranges of memory that
+    are compared after each step besides the registers.'''
+
+    def __init__(self, debug, proc, watch=(REGISTER_BANKS,),
+                 table_address=WATCH_TABLE_ADDRESS):
+        self.debug = debug
+        self.proc = proc
+        self.watch = list(watch)
+        self.table_address = table_address
+        self.steps = 0
+
+    def load(self, address, data):
+        '''Write <data> at <address> on the board and on the emulator'''
+        self.debug.write(address, data)
+        self.proc.write_memory_bytes(address, data)
+
+    def start(self):
+        '''Copy the registers, PSW, SP and PC of the emulator to the
+        board and tell the firmware which ranges to hash'''
+        table = bytearray([len(self.watch)])
+        for r in self.watch:
+            if not 0 < len(r) <= 0x100:
+                raise LockstepError("Watched ranges are 1-256 bytes: %r" % r)
+            table.extend([r.start & 0xff, r.start >> 8, len(r) & 0xff])
+        self.debug.write(self.table_address, table)
+        context = self._context()
+        context.extend([self.table_address & 0xff, self.table_address >> 8])
+        self.debug.write(TRACE_CONTEXT, context)
+
+    def step(self):
+        '''Step one instruction on both sides.  Returns a Divergence if
+        its effects differ, otherwise None.'''
+        proc = self.proc
+        address = proc.pc
+        instruction = disassemble(proc.memory, address)
+        code = bytearray(instruction.all_bytes)
+        fallthrough = (address + len(code)) & 0xFFFF
+
+        self._write_frame(address)     # RETI that starts the code
+        proc.step()
+        self._write_frame((proc.pc + 1) & 0xFFFF)  # BRK that stops it
+        self.steps += 1
+
+        breakpoints = sorted(set([proc.pc, fallthrough]))
+        for breakpoint in breakpoints:
+            if (breakpoint - address) & 0xFFFF < len(code):
+                raise LockstepError("%04x: %s branches into itself" % (address, instruction))
+        stop, crc = self.debug.trace(breakpoints)
+        if stop == proc.pc and crc == crc_xmodem(self._hashed()):
+            return None
+        return Divergence(self.steps, address, code, self._differences())
+
+    def run(self, max_steps=None, stop_address=None):
+        '''Step until the first Divergence, which is returned, or until
+        <max_steps> steps or the PC is <stop_address>, which return None'''
+        count = 0
+        while count != max_steps and self.proc.pc != stop_address:
+            divergence = self.step()
+            if divergence is not None:
+                return divergence
+            count += 1
+        return None
+
+    def _context(self):
+        '''The context of the emulator as the firmware saves it'''
+        proc = self.proc
+        pc, sp = proc.pc, proc.read_sp()
+        context = bytearray([pc & 0xff, pc >> 8, sp & 0xff, sp >> 8, proc.read_psw(), 0])
+        context.extend(proc.read_memory_bytes(proc.REGISTERS_BASE_ADDRESS, 8))
+        return context
+
+    def _hashed(self):
+        '''The bytes the firmware hashes, from the emulator'''
+        data = self._context()[:TRACE_HASHED]
+        for r in self.watch:
+            data.extend(self.proc.read_memory_bytes(r.start, len(r)))
+        return data
+
+    def _write_frame(self, pc):
+        '''Write the 3 bytes below SP like the firmware does with the
+        RETI and BRK frames on the board: PC low, PC high, PSW'''
+        proc = self.proc
+        sp = proc.read_sp()
+        frame = [pc & 0xff, pc >> 8, proc.read_psw()]
+        for i, value in enumerate(frame):
+            proc.write_memory((sp - 3 + i) & 0xFFFF, value)
+
+    def _differences(self):
+        board = self.debug.read(TRACE_CONTEXT, TRACE_HASHED)
+        emulator = self._context()
+        differences = []
+        for name, offset, size in CONTEXT_FIELDS:
+            values = [ data[offset] + (data[offset + 1] << 8 if size == 2 else 0)
+                       for data in (board, emulator) ]
+            if values[0] != values[1]:
+                differences.append((name, values[0], values[1]))
+        for r in self.watch:
+            board = self.debug.read(r.start, len(r))
+            emulator = self.proc.read_memory_bytes(r.start, len(r))
+            for i in range(len(r)):
+                if board[i] != emulator[i]:
+                    differences.append(("%04x" % (r.start + i), board[i], emulator[i]))
+        return differences
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        code = bytearray(f.read())
+    address = int(sys.argv[2], 16)
+    watch = [REGISTER_BANKS]
+    for arg in sys.argv[3:]:
+        start, stop = [ int(x, 16) for x in arg.split('-') ]
+        watch.extend([ range(s, min(s + 0x100, stop)) for s in range(start, stop, 0x100) ])
+
+    proc = Processor()
+    proc.write_sp(0xfe1f)
+    proc.pc = address
+    lockstep = Lockstep(make_serial_debugger(), proc, watch)
+    lockstep.load(address, code)
+    for r in watch:
+        lockstep.load(r.start, proc.read_memory_bytes(r.start, len(r)))
+    lockstep.start()
+    try:
+        divergence = lockstep.run()
+    except KeyboardInterrupt:
+        divergence = None
+    if divergence is None:
+        print("No divergence in %d steps" % lockstep.steps)
+    else:
+        sys.stdout.write(str(divergence))
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
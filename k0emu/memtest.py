@@ -0,0 +1,77 @@
+'''
+RAM tests for the fixtures, run with bulk transfers.
+
+A case is (address, pattern byte) and its output is the byte read back.
+run() writes each run of cases at consecutive addresses with one bulk
+write and reads the run back with one bulk read, so testing a range
+with a pattern takes a few packets instead of a round trip per byte.
+On the emulator the write and read are copies of the memory buffer.
+
+Cases are made from address ranges and patterns, one pass over each
+range per pattern, like the elements of a march test:
+
+    cases([range(0xf000, 0xf800)], [solid(0x55), solid(0xaa), walking_ones])
+
+Addresses in the VOLATILE_RANGES of the debugger (e.g. the receive FIFO
+of the firmware) are still written and read one byte at a time, since a
+bulk transfer into them would overwrite the packet being received.  The
+reserved memory is volatile too, but writes to it are ignored, so it is
+tested with bulk transfers like RAM.
+'''
+from k0emu.processor import Processor
+
+def solid(value):
+    '''Pattern of <value> at every address'''
+    return lambda address: value
+
+def walking_ones(address):
+    '''Pattern of one bit set, moving up one bit per address'''
+    return 1 << (address & 7)
+
+def address_in_address(address):
+    '''Pattern of the address folded into a byte, so that two addresses
+    aliasing the same cell read back differently'''
+    return (address ^ (address >> 8)) & 0xff
+
+def complement(pattern):
+    '''Pattern of the complement of <pattern>'''
+    return lambda address: pattern(address) ^ 0xff
+
+def cases(address_ranges, patterns):
+    return [ (address, pattern(address)) for address_range in address_ranges
+                                         for pattern in patterns
+                                         for address in address_range ]
+
+def run(debug, cases):
+    '''Write the pattern of each case and yield the byte read back'''
+    cases = list(cases)
+    volatile = [ r for r in getattr(debug, 'VOLATILE_RANGES', ())
+                 if r != Processor.RESERVED_RANGE ]
+    for start, stop in _runs(cases, volatile):
+        address = cases[start][0]
+        data = bytearray([ pattern for _, pattern in cases[start:stop] ])
+        debug.write(address, data)
+        debug.invalidate([range(address, address + len(data))])
+        for value in debug.read(address, len(data)):
+            yield value
+
+def _runs(cases, volatile):
+    '''Yield (start, stop) of the runs of <cases> at consecutive
+    addresses.  Cases at <volatile> addresses are runs of their own.'''
+    is_volatile = lambda address: any([ address in r for r in volatile ])
+    start = 0
+    for i in range(1, len(cases) + 1):
+        if (i == len(cases) or cases[i][0] != cases[i - 1][0] + 1
+                or is_volatile(cases[i][0]) or is_volatile(cases[i - 1][0])):
+            yield start, i
+            start = i
+
+def report(case, output):
+    (address, pat), pat_out = case, output
+    if pat_out == pat:
+        msg = 'OK'
+    else:
+        msg = "DIFFERENT"
+
+    fmt = "%04x: IN=%02x -> OUT=%02x (%s)\n"
+    return fmt % (address, pat, pat_out, msg)
@@ -1,12 +1,17 @@
 import itertools
 
+class InstructionBudgetExceeded(Exception):
+    '''Raised by Processor.run() when the code runs too long'''
+
+
 class Processor(object):
     RESET_VECTOR_ADDRESS = 0x0000
     BRK_VECTOR_ADDRESS = 0x003F
     REGISTERS_BASE_ADDRESS = 0xFEF8
     SP_ADDRESS = 0xFF1C
     PSW_ADDRESS = 0xFF1E
-    RESERVED_ADDRESSES = set(range(0xF800, 0xFB00))
+    RESERVED_RANGE = range(0xF800, 0xFB00)
+    RESERVED_ADDRESSES = set(RESERVED_RANGE)
 
     def __init__(self):
         self.memory = Memory(0x10000)
@@ -28,6 +33,21 @@ class Processor(object):
         handler(opcode)
         self.inst_count += 1
 
+    def run(self, stop_address, max_instructions=None):
+        '''Step until the PC is <stop_address>.  Raises
+        InstructionBudgetExceeded if that takes more than
+        <max_instructions>.  Returns the number of instructions run.'''
+        step = self.step
+        count = 0
+        while self.pc != stop_address:
+            if count == max_instructions:
+                raise InstructionBudgetExceeded(
+                    "No stop at %04x after %d instructions, PC=%04x" % (
+                        stop_address, count, self.pc))
+            step()
+            count += 1
+        return count
+
     def interrupt(self, isr_address):
         self._push(self.read_psw())
         self.write_psw(self.read_psw() & ~Flags.IE)
@@ -2414,6 +2434,15 @@ class Processor(object):
 
     # Stack
 
+    def push(self, value):
+        """Push a byte onto the stack, e.g. the PSW of an interrupt"""
+        self._push(value)
+
+    def push_word(self, value):
+        """Push a word onto the stack, e.g. the return address of a
+        call made from outside the code"""
+        self._push_word(value)
+
     def _push(self, value):
         """Push a byte onto the stack"""
         # TODO add test for wrap-around behavior
@@ -2537,9 +2566,39 @@ class Processor(object):
 
         self.memory[address] = value
 
+    def read_memory_bytes(self, address, length):
+        '''Read <length> bytes starting at <address> like read_memory()
+        does one at a time, wrapping around at 0xFFFF'''
+        stop = address + length
+        if stop <= self.RESERVED_RANGE.start or self.RESERVED_RANGE.stop <= address < stop <= 0x10000:
+            return self.memory[address:stop]
+        data = bytearray()
+        for start, stop in _spans(address, length):
+            chunk = self.memory[start:stop]
+            reserved = _overlap(start, stop, self.RESERVED_RANGE)
+            if reserved:
+                chunk[reserved.start - start:reserved.stop - start] = b'\x08' * len(reserved)
+            data += chunk
+        return data
+
     def write_memory_bytes(self, address, data):
-        for address, value in enumerate(data, address):
-            self.write_memory(address, value)
+        '''Write <data> starting at <address> like write_memory() does
+        one byte at a time, wrapping around at 0xFFFF'''
+        data = bytearray(data)
+        stop = address + len(data)
+        if stop <= self.RESERVED_RANGE.start or self.RESERVED_RANGE.stop <= address < stop <= 0x10000:
+            self.memory[address:stop] = data
+            return
+        offset = 0
+        for start, stop in _spans(address, len(data)):
+            chunk = data[offset:offset + stop - start]
+            reserved = _overlap(start, stop, self.RESERVED_RANGE)
+            if reserved:
+                self.memory[start:reserved.start] = chunk[:reserved.start - start]
+                self.memory[reserved.stop:stop] = chunk[reserved.stop - start:]
+            else:
+                self.memory[start:stop] = chunk
+            offset += stop - start
 
     def read_memory_word(self, address):
         low = self.read_memory(address)
@@ -2547,6 +2606,29 @@ class Processor(object):
         return (high << 8) + low
 
 
+def load_rom(proc, rom):
+    '''Write the bytes of <rom> to the memory of <proc> at 0 and reset
+    it.  The RAM from 0xFB00 up is zeroed so runs start the same.'''
+    proc.write_memory_bytes(0, rom)
+    proc.reset()
+    for address in range(0xfb00, 0x10000):
+        proc.memory[address] = 0
+
+def _spans(address, length):
+    '''Return the (start, stop) of the pieces of <length> bytes starting
+    at <address>, split where they wrap around at 0xFFFF'''
+    spans = []
+    while length > 0:
+        stop = min(address + length, 0x10000)
+        spans.append((address, stop))
+        length -= stop - address
+        address = 0
+    return spans
+
+def _overlap(start, stop, addresses):
+    '''Return the range of <addresses> between <start> and <stop>'''
+    return range(max(start, addresses.start), min(stop, addresses.stop))
+
 def _sfr(low):
     sfr = 0xff00 + low
     return sfr
@@ -2651,6 +2733,14 @@ class RegisterTrace:
 
 class Memory(bytearray):
     def __setitem__(self, address, value):
-        if address == Processor.PSW_ADDRESS:
+        if isinstance(address, slice):
+            addresses = range(*address.indices(len(self)))
+            if len(value) != len(addresses):
+                raise Exception("Memory slice of %d bytes assigned %d bytes" % (
+                    len(addresses), len(value)))
+            if Processor.PSW_ADDRESS in addresses:
+                value = bytearray(value)
+                value[addresses.index(Processor.PSW_ADDRESS)] &= 0b11111011
+        elif address == Processor.PSW_ADDRESS:
             value = value & 0b11111011  # psw bit 2 always stuck off
         super().__setitem__(address, value)
@@ -0,0 +1,149 @@
+'''
+Cache of the reports of fixtures run on the emulator.
+
+While a fixture runs, the functions of k0emu that it calls are traced.
+A manifest next to the reports records, for each fixture, the hash of
+the fixture source, the hash of the source of each function it called,
+the hash of the rest of each module those functions are in (class
+attributes, tables, constants) and how long the run took.  A report is
+stale when any of those hashes changes, so a change to one handler of
+Processor only re-runs the fixtures that executed it.
+'''
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sys
+
+PACKAGE = 'k0emu.'
+
+
+def trace_calls(func, *args):
+    '''Call func(*args) and return (result, names) where names are the
+    "module:qualified name" of the k0emu functions it called'''
+    codes = set()
+    def profile(frame, event, arg):
+        if event == 'call':
+            codes.add(frame.f_code)
+    sys.setprofile(profile)
+    try:
+        result = func(*args)
+    finally:
+        sys.setprofile(None)
+    index = _code_index()
+    return result, sorted(set([ index[code] for code in codes if code in index ]))
+
+def _code_index():
+    '''Return {code object: "module:qualified name"} for the functions
+    and methods of the k0emu modules that are loaded'''
+    index = {}
+    for modname, module in list(sys.modules.items()):
+        if not _is_traced_module(modname, module):
+            continue
+        for name, qualname, func in _functions(module):
+            index[func.__code__] = "%s:%s" % (modname, qualname)
+    return index
+
+def _is_traced_module(modname, module):
+    return (module is not None and modname.startswith(PACKAGE)
+            and not modname.startswith(PACKAGE + 'tests'))
+
+def _functions(module):
+    '''Yield (name, qualified name, function) for each function and
+    method defined in <module>'''
+    for name, value in sorted(vars(module).items()):
+        if getattr(value, '__module__', None) != module.__name__:
+            continue
+        if inspect.isfunction(value):
+            yield name, name, value
+        elif inspect.isclass(value):
+            for attr, member in sorted(vars(value).items()):
+                member = getattr(member, '__func__', member)  # static/classmethod
+                if inspect.isfunction(member):
+                    yield attr, "%s.%s" % (name, attr), member
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def function_hash(name):
+    '''Hash of the source of the function "module:qualified name", or
+    None if it no longer exists'''
+    modname, qualname = name.split(':')
+    try:
+        value = importlib.import_module(modname)
+        for attr in qualname.split('.'):
+            value = vars(value)[attr]
+    except (ImportError, KeyError):
+        return None
+    value = getattr(value, '__func__', value)
+    return _sha256(inspect.getsource(value))
+
+def module_hash(modname):
+    '''Hash of the source of module <modname> without its functions and
+    methods, which are hashed one by one'''
+    module = importlib.import_module(modname)
+    lines = list(inspect.getsourcelines(module)[0])  # not linecache's list
+    for name, qualname, func in _functions(module):
+        source, start = inspect.getsourcelines(func)
+        for i in range(start - 1, start - 1 + len(source)):
+            lines[i] = ''
+    return _sha256(''.join([ line for line in lines if line.strip() ]))
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ResultCache(object):
+    '''Manifest of the emulator reports, saved as JSON in <filename>'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+        self._hashes = {}   # memo of function_hash() and module_hash()
+
+    def is_current(self, name, fixture_filename):
+        '''Return True if the report of fixture <name> was made by the
+        source in <fixture_filename> and the same k0emu code'''
+        entry = self.entries.get(name)
+        if entry is None or entry['fixture'] != file_hash(fixture_filename):
+            return False
+        for function, digest in entry['functions'].items():
+            if self._hash(function_hash, function) != digest:
+                return False
+        for modname, digest in entry['modules'].items():
+            if self._hash(module_hash, modname) != digest:
+                return False
+        return True
+
+    def record(self, name, fixture_filename, functions, seconds):
+        '''Record that the report of fixture <name> was made by the
+        source in <fixture_filename>, calling the k0emu <functions>, in
+        <seconds> of run time'''
+        modules = sorted(set([ function.split(':')[0] for function in functions ]))
+        self.entries[name] = {
+            'fixture': file_hash(fixture_filename),
+            'functions': dict([ (f, self._hash(function_hash, f)) for f in functions ]),
+            'modules': dict([ (m, self._hash(module_hash, m)) for m in modules ]),
+            'seconds': round(seconds, 3),
+        }
+        self.save()
+
+    def forget(self, name):
+        if self.entries.pop(name, None) is not None:
+            self.save()
+
+    def save(self):
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp, self.filename)
+
+    def _hash(self, func, name):
+        if name not in self._hashes:
+            self._hashes[name] = func(name)
+        return self._hashes[name]
@@ -0,0 +1,191 @@
+'''
+Packed binary results of the fixtures in k0emu/debugger/testprogs.
+
+The text reports in results/*/ have one formatted line per case.  A
+binary results file has a header naming the fixture and its inputs,
+followed by one fixed-width record of output bytes per case, in the
+order of the fixture's cases().  The text report is rendered from it
+with the fixture's own report(), so it is identical to the reference
+.txt file, which stays the reference:
+
+    magic        4 bytes  b'K0RS'
+    name length  1 byte
+    name         utf-8, e.g. "test_add"
+    flags        1 byte   bit 0 set: each output is an int, not bytes
+    width        1 byte   bytes in each record
+    inputs       1 byte   values in each case tuple
+    count        4 bytes  number of cases (little endian)
+    cases crc    4 bytes  CRC-32 of the case tuples (little endian)
+    records      count * width bytes
+'''
+import mmap
+import struct
+import zlib
+
+MAGIC = b'K0RS'
+SCALAR = 0x01   # flag: outputs are ints (one byte) instead of bytes
+_COUNTS = struct.Struct('<BBBII')  # flags, width, inputs, count, crc
+
+
+class Results(object):
+    '''The outputs of a fixture for all of its cases'''
+
+    def __init__(self, name, cases, outputs, scalar=False):
+        self.name = name
+        self.cases = cases
+        self.outputs = outputs
+        self.scalar = scalar
+
+    def render(self, report):
+        '''Return the text report using the fixture's report()'''
+        return ''.join([ report(case, output)
+                         for case, output in zip(self.cases, self.outputs) ])
+
+
+def cases_crc(cases):
+    '''CRC-32 of a list of case tuples'''
+    values = [ value for case in cases for value in case ]
+    return zlib.crc32(struct.pack('<%dI' % len(values), *values)) & 0xffffffff
+
+def write_results(outfile, results):
+    '''Write <results> to the binary file object <outfile>'''
+    name = results.name.encode('utf-8')
+    width = 1 if results.scalar else len(results.outputs[0]) if results.outputs else 0
+    inputs = len(results.cases[0]) if results.cases else 0
+    flags = SCALAR if results.scalar else 0
+    outfile.write(MAGIC + bytearray([len(name)]) + name)
+    outfile.write(_COUNTS.pack(flags, width, inputs, len(results.cases),
+                               cases_crc(results.cases)))
+    records = bytearray()
+    for output in results.outputs:
+        record = bytearray([output]) if results.scalar else bytearray(output)
+        if len(record) != width:
+            raise Exception("Output %r is not %d bytes" % (output, width))
+        records.extend(record)
+    outfile.write(records)
+
+def read_results(infile, cases):
+    '''Read results from the binary file object <infile>.  <cases> are
+    the cases of the fixture, which must be those the file was written
+    for.'''
+    data = infile.read()
+    name, scalar, width, offset = _read_header(data, cases)
+    outputs = list(_records(data, scalar, width, offset, len(cases)))
+    return Results(name, cases, outputs, scalar)
+
+def iter_results(filename, cases):
+    '''Yield the output for each case from the binary results file
+    <filename>, which is memory-mapped instead of read'''
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        name, scalar, width, offset = _read_header(data, cases)
+        for output in _records(data, scalar, width, offset, len(cases)):
+            yield output
+    finally:
+        data.close()
+
+def _read_header(data, cases):
+    '''Check the header of the results in <data> against <cases> and
+    return (name, scalar, width, offset of the first record)'''
+    if data[:4] != MAGIC:
+        raise Exception("Not a binary results file")
+    offset = 5 + data[4]
+    name = data[5:offset].decode('utf-8')
+    flags, width, inputs, count, crc = _COUNTS.unpack_from(data, offset)
+    offset += _COUNTS.size
+    if count != len(cases) or crc != cases_crc(cases):
+        raise Exception("Results of %s are not for the cases of the fixture" % name)
+    if len(data) != offset + count * width:
+        raise Exception("Results of %s are truncated" % name)
+    return name, bool(flags & SCALAR), width, offset
+
+def _records(data, scalar, width, offset, count):
+    for start in range(offset, offset + count * width, width):
+        record = bytearray(data[start:start + width])
+        yield record[0] if scalar else record
+
+def parse_report(name, cases, lines, report):
+    '''Return the Results of a text report, given the fixture's cases
+    and report().  Each output is found by asking report() which part of
+    the line each output byte produces; a line that report() does not
+    render identically from the parsed output raises.'''
+    if len(lines) != len(cases):
+        raise Exception("Report has %d lines for %d cases" % (len(lines), len(cases)))
+    if not cases:
+        return Results(name, cases, [])
+    parser = LineParser(cases[0], report)
+    outputs = [ parser.parse(case, line) for case, line in zip(cases, lines) ]
+    return Results(name, cases, outputs, parser.scalar)
+
+def _output_shape(case, report):
+    '''Return (scalar, width) of the outputs report() accepts'''
+    shapes = [(True, 1)] + [ (False, width) for width in range(1, 9) ]
+    for scalar, width in shapes:
+        try:
+            report(case, 0 if scalar else bytearray(width))
+            return scalar, width
+        except (TypeError, ValueError, IndexError):
+            pass    # e.g. too few bytes for the outputs of an InstructionSpec
+    raise Exception("Can't tell what outputs report() takes")
+
+
+class LineParser(object):
+    '''Finds the output that report() turns into a line.  The span of
+    the line each output byte produces and the text for each of its
+    values are learned from one case and reused for the others.
+    <case> is any case, used to find the shape of the outputs.'''
+
+    def __init__(self, case, report):
+        self.report = report
+        self.scalar, self.width = _output_shape(case, report)
+        self.spans = None   # (start, stop, {text: value}) for each byte
+        self.learnable = True
+
+    def parse(self, case, line):
+        if self.spans is not None:
+            output = self._lookup(line)
+            if output is not None and self.report(case, output) == line:
+                return output
+        if self.learnable:
+            self.spans = self._learn(case)
+            self.learnable = self.spans is not None
+        if self.spans is not None:
+            output = self._lookup(line)
+            if output is not None and self.report(case, output) == line:
+                return output
+        if self.scalar:
+            for value in range(0x100):
+                if self.report(case, value) == line:
+                    return value
+        raise Exception("No output of %r gives the line %r" % (case, line))
+
+    def _lookup(self, line):
+        output = bytearray()
+        for start, stop, values in self.spans:
+            value = values.get(line[start:stop])
+            if value is None:
+                return None
+            output.append(value)
+        return output[0] if self.scalar else output
+
+    def _learn(self, case):
+        spans = []
+        for i in range(self.width):
+            lines = []
+            for value in range(0x100):
+                output = bytearray(self.width)
+                output[i] = value
+                lines.append(self.report(case, output[0] if self.scalar else output))
+            if len(set([ len(line) for line in lines ])) != 1:
+                return None
+            changed = [ pos for pos in range(len(lines[0]))
+                        if len(set([ line[pos] for line in lines ])) > 1 ]
+            if not changed:
+                return None
+            start, stop = changed[0], changed[-1] + 1
+            values = dict([ (line[start:stop], value) for value, line in enumerate(lines) ])
+            if len(values) != 0x100:
+                return None
+            spans.append((start, stop, values))
+        return spans
@@ -0,0 +1,251 @@
+'''
+SQLite database of the fixture reports in k0emu/debugger/testprogs/results.
+
+Each line of a report is split into the values it shows, named after
+the report text with the direction as suffix: "A(IN)=99, PSW(IN)=11 ->
+A(OUT)=ff, PSW(OUT)=11" gives A_in, PSW_in, A_out and PSW_out.  The
+address of a test_ram line is ADDR_in.  A line is stored as its layout,
+the text with each value replaced by a format like "%02x", and its
+values packed like the records of k0emu.results, little endian in as
+many bytes as their digits need.  Values are decoded when queried.
+Tables:
+
+    files    id, path, sha256, fixture, source of each report ingested
+    layouts  id, template, names: a line without its values and the
+             names of the values (comma separated)
+    lines    file, line, layout, packed values of each line
+
+The source is the directory of the report ("serial" or "emulator").
+Lines of the same fixture and number are for the same case in every
+source, so they line up the hardware with the emulator.  Reports are
+only read again when their SHA-256 changes.
+'''
+import hashlib
+import os
+import re
+import sqlite3
+
+SCHEMA_VERSION = 2  # databases of another version are made again
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    sha256 TEXT NOT NULL,
+    fixture TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS layouts (
+    id INTEGER PRIMARY KEY,
+    template TEXT UNIQUE NOT NULL,
+    names TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    file INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    layout INTEGER NOT NULL,
+    fields BLOB NOT NULL,
+    PRIMARY KEY (file, line)
+) WITHOUT ROWID;
+'''
+
+TABLES = ('files', 'names', 'layouts', 'lines', 'fields')  # of every version
+
+FIELD = re.compile(r'(?:(\w+)\()?\b(IN|OUT)\)?=([0-9a-fA-F]+)\b')
+ADDRESS = re.compile(r'^([0-9a-fA-F]{4}): ')
+FORMAT = re.compile(r'%(?:%|0(\d+)[xX])')
+
+
+def parse_line(text):
+    '''Return (inputs, [(name, value), ...]) for a report line'''
+    inputs = text.split('->')[0].strip() if '->' in text else ''
+    fields = [ (name, int(text[start:stop], 16))
+               for start, stop, name in _fields(text) ]
+    return inputs, fields
+
+def pack_line(text):
+    '''Return (template, names, packed values) for a report line'''
+    template, names, packed = [], [], bytearray()
+    last = 0
+    for start, stop, name in _fields(text):
+        digits = text[start:stop]
+        template.append(text[last:start].replace('%', '%%'))
+        template.append('%%0%d%s' % (len(digits), 'x' if digits == digits.lower() else 'X'))
+        names.append(name)
+        packed.extend(int(digits, 16).to_bytes((len(digits) + 1) // 2, 'little'))
+        last = stop
+    template.append(text[last:].replace('%', '%%'))
+    return ''.join(template), names, bytes(packed)
+
+def _fields(text):
+    '''Return (start, stop, name) of the digits of each value on a
+    report line'''
+    fields = []
+    match = ADDRESS.match(text)
+    if match:
+        fields.append((match.start(1), match.end(1), 'ADDR_in'))
+    for match in FIELD.finditer(text):
+        name = "%s_%s" % (match.group(1) or 'VALUE', match.group(2).lower())
+        fields.append((match.start(3), match.end(3), name))
+    return fields
+
+
+class Layout(object):
+    '''The <template> of lines with the values <names>, see pack_line()'''
+
+    def __init__(self, template, names):
+        self.template = template
+        self.names = names
+        self.offsets = {}   # name: (offset, width) of its packed value
+        offset = 0
+        for name, match in zip(names, [ m for m in FORMAT.finditer(template)
+                                        if m.group(1) ]):
+            width = (int(match.group(1)) + 1) // 2
+            self.offsets[name] = (offset, width)
+            offset += width
+
+    def value(self, fields, name):
+        '''Return the value <name> in the packed <fields>'''
+        offset, width = self.offsets[name]
+        return int.from_bytes(bytes(fields[offset:offset + width]), 'little')
+
+    def text(self, fields):
+        '''Return the line with the packed <fields>'''
+        return self.template % tuple([ self.value(fields, name) for name in self.names ])
+
+def file_sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultsDatabase(object):
+    '''Reports of fixtures in an SQLite database at <filename>'''
+
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(filename)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            with self.conn:
+                for table in TABLES:
+                    self.conn.execute("DROP TABLE IF EXISTS %s" % table)
+            self.conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.conn.executescript(SCHEMA)
+        self._layouts = {}      # id: Layout
+        self._layout_ids = {}   # template: id
+        for id, template, names in self.conn.execute(
+                "SELECT id, template, names FROM layouts"):
+            self._layouts[id] = Layout(template, names.split(',') if names else [])
+            self._layout_ids[template] = id
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, path, fixture, source, read_lines):
+        '''Add the report at <path> unless it is in the database with
+        the same hash.  read_lines() returns its lines.  Returns True if
+        the report was (re)ingested.'''
+        sha256 = file_sha256(path)
+        row = self.conn.execute("SELECT sha256 FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if row is not None and row[0] == sha256:
+            return False
+        with self.conn:
+            self._delete("fixture = ? AND source = ?", (fixture, source))
+            self._delete("path = ?", (path,))
+            cursor = self.conn.execute(
+                "INSERT INTO files (path, sha256, fixture, source) VALUES (?, ?, ?, ?)",
+                (path, sha256, fixture, source))
+            file = cursor.lastrowid
+            lines = []
+            for number, text in enumerate(read_lines()):
+                template, names, fields = pack_line(text.rstrip('\n'))
+                lines.append((file, number, self._layout_id(template, names), fields))
+            self.conn.executemany("INSERT INTO lines VALUES (?, ?, ?, ?)", lines)
+        return True
+
+    def forget_missing(self):
+        '''Remove the reports whose files no longer exist.  Returns their
+        paths.'''
+        paths = [ row[0] for row in self.conn.execute("SELECT path FROM files") ]
+        missing = [ path for path in paths if not os.path.exists(path) ]
+        with self.conn:
+            for path in missing:
+                self._delete("path = ?", (path,))
+        return missing
+
+    def _delete(self, where, params):
+        ids = [ row[0] for row in
+                self.conn.execute("SELECT id FROM files WHERE " + where, params) ]
+        for file in ids:
+            self.conn.execute("DELETE FROM lines WHERE file = ?", (file,))
+            self.conn.execute("DELETE FROM files WHERE id = ?", (file,))
+
+    def _layout_id(self, template, names):
+        if template not in self._layout_ids:
+            cursor = self.conn.execute("INSERT INTO layouts (template, names) VALUES (?, ?)",
+                                       (template, ','.join(names)))
+            self._layout_ids[template] = cursor.lastrowid
+            self._layouts[cursor.lastrowid] = Layout(template, names)
+        return self._layout_ids[template]
+
+    def _layouts_with(self, names):
+        '''Return the ids of the layouts that have all the values <names>'''
+        return [ id for id, layout in self._layouts.items()
+                 if all([ name in layout.offsets for name in names ]) ]
+
+    def _file_ids(self, fixtures, source=None):
+        sql = "SELECT id FROM files WHERE fixture IN (%s)" % ', '.join(['?'] * len(fixtures))
+        params = list(fixtures)
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        return [ row[0] for row in self.conn.execute(sql, params) ]
+
+    def lookup(self, fixtures, **values):
+        '''Return (fixture, source, line, text) of the lines of <fixtures>
+        showing all the values given as keywords, e.g. A_in=0x99'''
+        if not values:
+            raise Exception("No values to look up")
+        layouts = self._layouts_with(values)
+        files = self._file_ids(fixtures)
+        sql = ("SELECT f.fixture, f.source, l.line, l.layout, l.fields FROM lines l"
+               " JOIN files f ON f.id = l.file"
+               " WHERE l.file IN (%s) AND l.layout IN (%s)"
+               " ORDER BY f.fixture, l.line, f.source" % (
+                   ', '.join(['?'] * len(files)), ', '.join(['?'] * len(layouts))))
+        rows = []
+        for fixture, source, line, layout, fields in self.conn.execute(sql, files + layouts):
+            layout = self._layouts[layout]
+            if all([ layout.value(fields, name) == value for name, value in values.items() ]):
+                rows.append((fixture, source, line, layout.text(fields)))
+        return rows
+
+    def differ(self, fixture, name, mask=0xff, expected='serial', actual='emulator'):
+        '''Return (line, inputs, expected value, actual value) for each
+        line of <fixture> where the bits in <mask> of the value <name>
+        differ between the <expected> and <actual> sources'''
+        files = [ self._file_ids([fixture], source) for source in (expected, actual) ]
+        layouts = self._layouts_with([name])
+        if not (files[0] and files[1]) or not layouts:
+            raise Exception("No %s in both the %s and %s reports of %s" % (
+                name, expected, actual, fixture))
+        sql = ("SELECT e.line, e.layout, e.fields, a.layout, a.fields FROM lines e"
+               " JOIN lines a ON a.file = ? AND a.line = e.line"
+               " WHERE e.file = ? ORDER BY e.line")
+        rows = []
+        for line, e_layout, e_fields, a_layout, a_fields in self.conn.execute(
+                sql, (files[1][0], files[0][0])):
+            if e_layout not in layouts or a_layout not in layouts:
+                continue
+            e_layout, a_layout = self._layouts[e_layout], self._layouts[a_layout]
+            e_value = e_layout.value(e_fields, name)
+            a_value = a_layout.value(a_fields, name)
+            if (e_value ^ a_value) & mask:
+                inputs, _ = parse_line(e_layout.text(e_fields))
+                rows.append((line, inputs, e_value, a_value))
+        return rows
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
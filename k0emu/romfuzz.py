@@ -0,0 +1,279 @@
+'''
+Usage: k0romfuzz <rom.bin> <entry> <buffer> <corpus> [<workers> [<executions>]]
+
+Fuzzes a handler in a ROM, e.g. the parser of the commands the firmware
+receives over the UART, guided by the edges of the code it covers.
+
+The ROM is loaded like k0emu does and run from reset until the PC first
+reaches <entry> (hex), so the RAM holds what the firmware set up before
+it.  That state is the snapshot every input starts from.  The emulator
+has no UART, so an input is written to RAM where the firmware would
+find the bytes it received: at <buffer>, given as <start>-<stop> (hex,
+stop excluded, which bounds the length of the inputs) and optionally
+followed by ",<count>", the address of a byte that is set to the length
+of the input, e.g. the write index of the receive queue.  The handler is
+then called at <entry> and runs until it returns, or until INSTRUCTIONS
+instructions have run (a hang).
+
+An edge is a branch instruction (bc, bnz, bt, dbnz, br, call, ret...)
+and the address it went to, so a conditional branch taken and not taken
+are two edges.  Inputs that cover a new edge are kept in the <corpus>
+directory, one file per input named by its SHA-1, and are mutated to
+make new inputs.  Inputs that raise an exception in the emulator are
+kept in <corpus>/crashes.  Files put in the corpus directory by hand are
+used as seeds.
+
+<workers> processes (default 1) fuzz <executions> inputs each (default
+100000).  They share the corpus directory: each reads the inputs the
+others added every SYNC_INTERVAL executions.  For example:
+
+    $ k0romfuzz rom.bin 1234 fe80-fec0,fe7f corpus 4 1000000
+'''
+import hashlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+from k0dasm.disassemble import FlowTypes, IllegalInstructionError, disassemble
+from k0emu.processor import InstructionBudgetExceeded, Processor, load_rom
+
+# values that often matter to parsers, besides random bytes
+INTERESTING = (0x00, 0x01, 0x0a, 0x0d, 0x20, 0x7f, 0x80, 0xff)
+
+
+class CoverageReport(object):
+    def __init__(self):
+        self.executions = 0
+        self.hangs = 0
+        self.crashes = 0    # new crashes, kept in <corpus>/crashes
+        self.edges = 0      # covered at the end
+        self.corpus = 0     # inputs in the corpus at the end
+        self.seconds = 0.0
+
+    def executions_per_second(self):
+        if self.seconds == 0:
+            return 0.0
+        return self.executions / self.seconds
+
+    def __str__(self):
+        return ("%d executions in %.1f s (%.0f/s), %d edges, %d inputs, "
+                "%d crashes, %d hangs" % (
+                    self.executions, self.seconds, self.executions_per_second(),
+                    self.edges, self.corpus, self.crashes, self.hangs))
+
+
+class RomFuzzer(object):
+    '''Fuzzes the handler at <entry> of the code in <proc>, whose state
+    is the snapshot every input starts from.  Inputs are written at
+    <buffer> (a range) and their length at <count_address> if it is
+    given.  The corpus is kept in the directory <directory>.'''
+    RETURN_ADDRESS = 0xFFFF     # sentinel pushed before the call, like EmulatorDebugger
+    INSTRUCTIONS = 100000       # per execution, so a hang ends
+    SYNC_INTERVAL = 1000        # executions between reads of the corpus directory
+
+    def __init__(self, proc, entry, buffer, directory, count_address=None):
+        self.proc = proc
+        self.buffer = buffer
+        self.count_address = count_address
+        self.directory = directory
+        self.crash_directory = os.path.join(directory, 'crashes')
+        for path in (directory, self.crash_directory):
+            os.makedirs(path, exist_ok=True)  # other workers may make it too
+
+        proc.push_word(self.RETURN_ADDRESS)
+        proc.pc = entry
+        self.snapshot = (bytes(proc.memory), proc.pc)
+
+        self.coverage = set()   # edges covered by the corpus
+        self.corpus = []        # inputs
+        self.names = set()      # files of the corpus directory already read
+        self.crashes = set()    # messages of the exceptions already kept
+        self._branches = {}     # address: whether the instruction there is a branch
+
+    def execute(self, data):
+        '''Run the handler on the input <data> from the snapshot.
+        Returns the set of edges it covered and the exception it raised
+        (InstructionBudgetExceeded if it hung) or None.'''
+        proc = self.proc
+        memory, pc = self.snapshot
+        proc.memory[:] = memory
+        proc.pc = pc
+        proc.write_memory_bytes(self.buffer.start, data)
+        if self.count_address is not None:
+            proc.write_memory(self.count_address, len(data))
+
+        edges = set()
+        branches = self._branches
+        step = proc.step
+        try:
+            for i in range(self.INSTRUCTIONS):
+                address = proc.pc
+                if address == self.RETURN_ADDRESS:
+                    return edges, None
+                step()
+                branch = branches.get(address)
+                if branch is None:
+                    branch = branches[address] = _is_branch(proc.memory, address)
+                if branch:
+                    edges.add((address << 16) | proc.pc)
+        except Exception as exc:
+            return edges, exc
+        return edges, InstructionBudgetExceeded(
+            "Handler did not return after %d instructions, PC=%04x" % (
+                self.INSTRUCTIONS, proc.pc))
+
+    def add(self, data, report):
+        '''Execute the input <data> and keep it if it covers a new edge,
+        or in the crashes if it raised a new exception'''
+        edges, error = self.execute(data)
+        report.executions += 1
+        if isinstance(error, InstructionBudgetExceeded):
+            report.hangs += 1
+        elif error is not None:
+            message = "%s: %s" % (type(error).__name__, error)
+            if message not in self.crashes:
+                self.crashes.add(message)
+                report.crashes += 1
+                _save(self.crash_directory, data)
+            return
+        if not edges <= self.coverage:
+            self.coverage |= edges
+            self.corpus.append(data)
+            self.names.add(_save(self.directory, data))
+
+    def sync(self):
+        '''Read the inputs that are new in the corpus directory, added
+        by other workers or by hand, and keep those that cover a new
+        edge'''
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name in self.names or name.startswith('.') or not os.path.isfile(path):
+                continue
+            self.names.add(name)
+            with open(path, 'rb') as f:
+                data = f.read()[:len(self.buffer)]
+            edges, error = self.execute(data)
+            if error is None and not edges <= self.coverage:
+                self.coverage |= edges
+                self.corpus.append(data)
+
+    def fuzz(self, executions, seed=0):
+        '''Execute <executions> mutated inputs.  Returns a
+        CoverageReport.'''
+        rng = random.Random(seed)
+        report = CoverageReport()
+        start = time.time()
+        self.sync()
+        if not self.corpus:
+            self.add(bytes(), report)
+        if not self.corpus:
+            self.corpus.append(bytes())     # crashed, but something to mutate
+        for i in range(executions):
+            if i % self.SYNC_INTERVAL == self.SYNC_INTERVAL - 1:
+                self.sync()
+            data = mutate(rng, rng.choice(self.corpus), len(self.buffer), self.corpus)
+            self.add(data, report)
+        report.seconds = time.time() - start
+        report.edges = len(self.coverage)
+        report.corpus = len(self.corpus)
+        return report
+
+
+def make_fuzzer(rom, entry, buffer, directory, count_address=None,
+                boot_instructions=10000000):
+    '''Load the ROM in the file <rom>, run it from reset to <entry> and
+    return a RomFuzzer of the handler there'''
+    proc = Processor()
+    with open(rom, 'rb') as f:
+        load_rom(proc, bytearray(f.read()))
+    proc.run(entry, boot_instructions)
+    return RomFuzzer(proc, entry, buffer, directory, count_address)
+
+def mutate(rng, data, max_length, corpus=()):
+    '''Return a copy of <data> with a few random changes, at most
+    <max_length> bytes long.  Other inputs of the <corpus> may be
+    spliced in.'''
+    data = bytearray(data)
+    for i in range(rng.randint(1, 4)):
+        kind = rng.randrange(6)
+        if kind == 0 and data:
+            data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+        elif kind == 1 and data:
+            data[rng.randrange(len(data))] = rng.randrange(0x100)
+        elif kind == 2 and data:
+            data[rng.randrange(len(data))] = rng.choice(INTERESTING)
+        elif kind == 3 and data:
+            del data[rng.randrange(len(data))]
+        elif kind == 4 and corpus:
+            other = rng.choice(corpus)
+            data = data[:rng.randint(0, len(data))] + other[rng.randint(0, len(other)):]
+        else:
+            data.insert(rng.randint(0, len(data)), rng.randrange(0x100))
+    return bytes(data[:max_length])
+
+def run_workers(options, workers, executions):
+    '''Run <workers> processes, each fuzzing <executions> inputs with
+    the RomFuzzer that make_fuzzer(**<options>) returns and a seed of
+    its own.  Returns their CoverageReports.'''
+    jobs = [ (options, executions, seed) for seed in range(workers) ]
+    if workers == 1:
+        return [ _work(jobs[0]) ]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_work, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def _work(job):
+    options, executions, seed = job
+    return make_fuzzer(**options).fuzz(executions, seed)
+
+def _is_branch(memory, address):
+    try:
+        instruction = disassemble(memory, address)
+    except IllegalInstructionError:
+        return False
+    return instruction.flow_type != FlowTypes.Continue
+
+def _save(directory, data):
+    '''Write <data> to <directory> in a file named by its SHA-1, which
+    appears at once so other workers never read it half written.
+    Returns the name.'''
+    name = hashlib.sha1(data).hexdigest()
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        temporary = os.path.join(directory, '.%s.%d' % (name, os.getpid()))
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.rename(temporary, path)
+    return name
+
+
+def main():
+    if len(sys.argv) < 5:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    spec = sys.argv[3].split(',')
+    start, stop = [ int(x, 16) for x in spec[0].split('-') ]
+    options = {
+        'rom': sys.argv[1],
+        'entry': int(sys.argv[2], 16),
+        'buffer': range(start, stop),
+        'directory': sys.argv[4],
+        'count_address': int(spec[1], 16) if len(spec) > 1 else None,
+    }
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+    executions = int(sys.argv[6]) if len(sys.argv) > 6 else 100000
+
+    for seed, report in enumerate(run_workers(options, workers, executions)):
+        print("worker %d: %s" % (seed, report))
+    fuzzer = make_fuzzer(**options)
+    fuzzer.sync()
+    print("corpus: %d edges, %d inputs, %d crashes" % (
+        len(fuzzer.coverage), len(fuzzer.corpus),
+        len(os.listdir(fuzzer.crash_directory))))
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ Usage: k0emu <rom.bin>
 import sys
 
 from k0dasm.disassemble import disassemble
-from k0emu.processor import Processor
+from k0emu.processor import Processor, load_rom
 
 def main():
     proc = Processor()
@@ -13,11 +13,7 @@ def main():
     if len(sys.argv) > 1:
         filename = sys.argv[1]
         with open(filename, 'rb') as f:
-            rom = bytearray(f.read())
-        proc.write_memory_bytes(0, rom)
-        proc.reset()
-        for address in range(0xfb00, 0x10000):
-            proc.memory[address] = 0
+            load_rom(proc, bytearray(f.read()))
     else:
         sys.stderr.write(__doc__)
         sys.exit(1)
@@ -0,0 +1,126 @@
+'''
+Cache of the bytes read after running snippets, in an SQLite file.
+
+An entry is keyed by the SHA-1 of the snippet: its address, its code
+with the inputs patched in, the address and length read after it, and
+the memory written and code called since the snippet before it.
+The snippets of the fixtures set every input they depend on (the
+registers, PSW, memory operands) in their own code or in the memory
+written just before, so the same bytes always give the same output on
+the same implementation.
+
+Entries are kept per source.  The hardware never changes, so entries
+of the "serial" source are kept forever.  Entries of the "emulator"
+source are dropped when the source of the emulator (emulator_version())
+is not the same as when they were recorded.
+'''
+import hashlib
+import importlib
+import sqlite3
+import struct
+import threading
+from k0emu.resultcache import file_hash
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snippets (
+    source INTEGER NOT NULL,
+    key BLOB NOT NULL,
+    output BLOB NOT NULL,
+    PRIMARY KEY (source, key)
+) WITHOUT ROWID;
+'''
+
+EMULATOR_MODULES = ('k0emu.processor', 'k0emu.batch', 'k0emu.debug')
+
+def emulator_version():
+    '''Hash of the source of the modules that execute code on the
+    emulator'''
+    sha = hashlib.sha256()
+    for modname in EMULATOR_MODULES:
+        module = importlib.import_module(modname)
+        sha.update(file_hash(module.__file__).encode('ascii'))
+    return sha.hexdigest()
+
+def snippet_key(address, code, read_address, read_length, state=b''):
+    '''Key of a snippet.  <state> is what the host did to the target
+    since the last snippet (see MemoDebugger), empty if nothing.'''
+    header = struct.pack('<HHH', address, read_address, read_length)
+    return hashlib.sha1(header + bytes(bytearray(code)) + bytes(state)).digest()
+
+
+class SnippetCache(object):
+    '''Outputs of snippets run on <source>, saved in <filename>.  Entries
+    recorded with another <version> of the source are dropped.'''
+    COMMIT_EVERY = 0x1000  # entries
+    QUERY_KEYS = 500       # per SELECT, SQLite allows 999 parameters
+
+    def __init__(self, filename, source, version=''):
+        self.filename = filename
+        self.lock = threading.Lock()  # one cache is shared by the shard threads
+        self.conn = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            row = self.conn.execute("SELECT id, version FROM sources WHERE name = ?",
+                                    (source,)).fetchone()
+            if row is None:
+                cursor = self.conn.execute(
+                    "INSERT INTO sources (name, version) VALUES (?, ?)", (source, version))
+                self.source = cursor.lastrowid
+            else:
+                self.source = row[0]
+                if row[1] != version:
+                    self.conn.execute("DELETE FROM snippets WHERE source = ?", (self.source,))
+                    self.conn.execute("UPDATE sources SET version = ? WHERE id = ?",
+                                      (version, self.source))
+        self.pending = []
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        '''Return the output recorded for <key> or None'''
+        with self.lock:
+            row = self.conn.execute("SELECT output FROM snippets WHERE source = ? AND key = ?",
+                                    (self.source, key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return bytearray(row[0])
+
+    def get_many(self, keys):
+        '''Return the output recorded for each of <keys> or None'''
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), self.QUERY_KEYS):
+                chunk = keys[start:start + self.QUERY_KEYS]
+                sql = ("SELECT key, output FROM snippets WHERE source = ? AND key IN (%s)" %
+                       ', '.join(['?'] * len(chunk)))
+                found.update(self.conn.execute(sql, [self.source] + chunk))
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return [ bytearray(found[key]) if key in found else None for key in keys ]
+
+    def put(self, key, output):
+        with self.lock:
+            self.pending.append((self.source, key, bytes(bytearray(output))))
+            if len(self.pending) >= self.COMMIT_EVERY:
+                self._commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def _commit(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO snippets VALUES (?, ?, ?)",
+                                      self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,169 @@
+'''
+Fixtures that test one instruction, declared instead of hand-assembled.
+
+An InstructionSpec names the bytes of the instruction, the registers
+it takes as inputs with the values to try, and the registers it leaves
+as outputs.  The snippet it generates sets the inputs, runs the
+instruction, stores the outputs at 0xFE00.. and returns:
+
+    spec = InstructionSpec([0x61, 0x08],  # add a,x
+                           inputs=[('PSW', (0, 1)), ('A', range(256)), ('X', range(256))],
+                           outputs=['A', 'PSW'])
+    cases, run, report, test, main = spec.fixture()
+
+The cases are every combination of the input values, the first input
+varying slowest, unless a list of cases is given.  Every input is
+patched into the snippet, so run() hands all of them to debug.sweep(),
+which runs them the fastest way the debugger can: all at once on the
+emulator, with the S command on the chip, or pipelined X commands.
+
+Inputs and outputs are the 8-bit registers (A, X, ...), the register
+pairs (AX, BC, ...) and PSW.  A byte of the instruction given as a
+name is an operand input of that name, e.g. [0x0d, 'IMM'] for
+add a,#imm.  PSW is set first since it selects the register bank.
+'''
+import itertools
+import sys
+from k0emu.debug import make_debugger_from_argv
+from k0emu.fixture import write_report
+from k0emu.processor import RegisterPairs, Registers
+
+BYTES = dict([ (name, getattr(Registers, name)) for name in 'XACBEDLH' ])
+WORDS = dict([ (name, getattr(RegisterPairs, name)) for name in ('AX', 'BC', 'DE', 'HL') ])
+
+
+class InstructionSpec(object):
+    ADDRESS = 0xf000
+    OUTPUT_ADDRESS = 0xfe00
+    CLOBBERS = [range(0xfe00, 0xfe0a)]
+
+    def __init__(self, instruction, inputs, outputs, fixed=None, cases=None,
+                 report_inputs=None):
+        '''<instruction> is a list of bytes and operand names.  <inputs>
+        lists (name, values) or, if <cases> is given, only the names.
+        <fixed> maps the names of more inputs to the one value they
+        always have.  The report shows <report_inputs> (by default all
+        inputs) then <outputs>, in order.'''
+        self.instruction = list(instruction)
+        self.input_names = [ i if isinstance(i, str) else i[0] for i in inputs ]
+        self.values = None if cases is not None else [ list(i[1]) for i in inputs ]
+        self.fixed = dict(fixed or {})
+        self._cases = None if cases is None else [ tuple(case) for case in cases ]
+        self.outputs = list(outputs)
+        self.report_inputs = list(report_inputs or self.input_names)
+        self.code, self.patches = self._assemble()
+        self.read_length = sum([ self._width(name) for name in self.outputs ])
+        if self.OUTPUT_ADDRESS + self.read_length > self.CLOBBERS[0].stop:
+            raise Exception("Outputs %r do not fit in %r" % (self.outputs, self.CLOBBERS[0]))
+
+    def _width(self, name):
+        return 2 if name in WORDS else 1
+
+    def _assemble(self):
+        '''Return the code of the snippet and, for each input, the
+        addresses of its bytes in the code (high byte first for words)'''
+        operands = [ b for b in self.instruction if isinstance(b, str) ]
+        for name in self.input_names + list(self.fixed):
+            if name not in BYTES and name not in WORDS and name != 'PSW' and name not in operands:
+                raise Exception("Unknown input %r" % name)
+        for name in self.outputs:
+            if name not in BYTES and name not in WORDS and name != 'PSW':
+                raise Exception("Unknown output %r" % name)
+        if len(operands) != len(set(operands)):
+            raise Exception("Operand names must be used once: %r" % self.instruction)
+
+        code = []
+        positions = {}  # name -> [offsets of the bytes to patch]
+        names = [ n for n in list(self.fixed) + self.input_names if n not in operands ]
+        names.sort(key=lambda name: name != 'PSW')
+        for name in names:
+            value = self.fixed.get(name, 0)
+            if name == 'PSW':
+                code.extend([0x11, 0x1e])                   # mov psw,#<psw>
+            elif name in BYTES:
+                code.append(0xa0 + BYTES[name])             # mov r,#<byte>
+            else:
+                code.append(0x10 + 2 * WORDS[name])         # movw rp,#<word>
+            positions[name] = list(range(len(code), len(code) + self._width(name)))
+            if self._width(name) == 2:
+                code.extend([value & 0xff, value >> 8])
+                positions[name].reverse()
+            else:
+                code.append(value)
+
+        for byte in self.instruction:
+            if isinstance(byte, str):
+                positions[byte] = [len(code)]
+                byte = self.fixed.get(byte, 0)
+            code.append(byte)
+
+        slots = {}
+        address = self.OUTPUT_ADDRESS
+        for name in self.outputs:
+            slots[name] = address
+            address += self._width(name)
+        for name in sorted(self.outputs, key=lambda name: name not in ('A', 'AX')):
+            low, high = slots[name] & 0xff, slots[name] >> 8
+            if name == 'PSW':
+                code.extend([0xf0, 0x1e])                   # mov a,psw
+            elif name in BYTES and name != 'A':
+                code.append(0x60 + BYTES[name])             # mov a,r
+            elif name in WORDS and name != 'AX':
+                code.append(0xc0 + 2 * WORDS[name])         # movw ax,rp
+            if name in WORDS:
+                code.extend([0x03, low, high])              # movw !addr16,ax
+            else:
+                code.extend([0x9e, low, high])              # mov !addr16,a
+        code.append(0xaf)                                   # ret
+
+        patches = [ self.ADDRESS + offset for name in self.input_names
+                    for offset in positions[name] ]
+        return code, tuple(patches)
+
+    def cases(self):
+        if self.values is None:
+            return list(self._cases)
+        return list(itertools.product(*self.values))
+
+    def run(self, debug, cases):
+        patched = ( self._patch_values(case) for case in cases )
+        return debug.sweep(self.ADDRESS, self.code, self.patches, patched,
+                           self.OUTPUT_ADDRESS, self.read_length, self.CLOBBERS)
+
+    def _patch_values(self, case):
+        values = []
+        for name, value in zip(self.input_names, case):
+            if self._width(name) == 2:
+                values.extend([value >> 8, value & 0xff])
+            else:
+                values.append(value)
+        return tuple(values)
+
+    def report(self, case, output):
+        inputs = dict(zip(self.input_names, case))
+        ins = [ self._field(name, 'IN', inputs[name]) for name in self.report_inputs ]
+        outs = []
+        offset = 0
+        for name in self.outputs:
+            value = output[offset]
+            if self._width(name) == 2:
+                value += output[offset + 1] << 8
+            outs.append(self._field(name, 'OUT', value))
+            offset += self._width(name)
+        return "%s -> %s\n" % (', '.join(ins), ', '.join(outs))
+
+    def _field(self, name, direction, value):
+        return "%s(%s)=%0*x" % (name, direction, 2 * self._width(name), value)
+
+    def test(self, debug, outfile):
+        all_cases = self.cases()
+        write_report(outfile, all_cases, self.run(debug, all_cases), self.report)
+
+    def main(self):
+        debug = make_debugger_from_argv()
+        self.test(debug, sys.stdout)
+
+    def fixture(self):
+        '''Return the (cases, run, report, test, main) functions of a
+        fixture module'''
+        return self.cases, self.run, self.report, self.test, self.main
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+import serial # pyserial
+from k0emu.board import VirtualBoard
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from k0emu.asyncdebug import AsyncSerialDebugger
+
+
+@unittest.skipUnless(sys.version_info >= (3, 5), "needs async def")
+@unittest.skipUnless(hasattr(os, 'openpty'), "needs a pseudo-terminal")
+class AsyncSerialDebuggerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.boards = []
+        self.debugs = []
+        for i in range(2):
+            board = VirtualBoard()
+            board.start()
+            ser = serial.Serial(port=board.port, baudrate=38400, timeout=0)
+            debug = AsyncSerialDebugger(ser)
+            self._run(debug.find_prompt())
+            self.boards.append(board)
+            self.debugs.append(debug)
+
+    def tearDown(self):
+        for debug in self.debugs:
+            debug.ser.close()
+        for board in self.boards:
+            board.close()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_write_then_read(self):
+        debug = self.debugs[0]
+        self._run(debug.write(0xf000, [1, 2, 3]))
+        self.assertEqual(self._run(debug.read(0xf000, 3)), bytearray([1, 2, 3]))
+
+    def test_execute(self):
+        code = [
+            0xa1, 0x42,         # mov a,#0x42
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        data = self._run(self.debugs[0].execute(0xf000, code, 0xfe06, read_length=1))
+        self.assertEqual(data, bytearray([0x42]))
+
+    def test_boards_run_concurrently(self):
+        for i, board in enumerate(self.boards):
+            board.debug.proc.memory[0xf000] = i + 1
+        reads = [ debug.read(0xf000, 1) for debug in self.debugs ]
+        results = self._run(asyncio.gather(*reads))
+        self.assertEqual(results, [bytearray([1]), bytearray([2])])
+
+    def test_commands_from_concurrent_tasks_do_not_interleave(self):
+        debug = self.debugs[0]
+        writes = [ debug.write(0xf000 + i, [i]) for i in range(20) ]
+        self._run(asyncio.gather(*writes))
+        self.assertEqual(self._run(debug.read(0xf000, 20)), bytearray(range(20)))
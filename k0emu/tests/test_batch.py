@@ -0,0 +1,76 @@
+import unittest
+from k0emu.batch import BatchExecutor, BatchUnsupported, numpy
+from k0emu.debug import BaseDebugger, EmulatorDebugger
+from k0emu.processor import Processor
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class BatchExecutorTests(unittest.TestCase):
+
+    def _sweeps(self, code, patches, cases, read_address, read_length):
+        '''Returns the outputs of the sweep run at once and one at a time,
+        and the memory each leaves behind'''
+        batch = EmulatorDebugger(Processor())
+        single = EmulatorDebugger(Processor())
+        batch_outputs = BatchExecutor(batch.proc).sweep(
+            0xf000, code, patches, cases, read_address, read_length)
+        single_outputs = list(BaseDebugger.sweep(
+            single, 0xf000, code, patches, cases, read_address, read_length))
+        return (batch_outputs, single_outputs, batch.proc.memory, single.proc.memory)
+
+    def test_add_matches_single_steps(self):
+        code = [
+            0x11, 0x1e, 0,      # mov psw,#<psw>
+            0xa1, 0,            # mov a,#<a>
+            0xa0, 0,            # mov x,#<x>
+            0x61, 0x08,         # add a,x
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xf0, 0x1e,         # mov a,psw
+            0x9e, 0x07, 0xfe,   # mov 0xfe07,a
+            0xaf                # ret
+        ]
+        cases = [ (psw, a, x) for psw in (0, 0x51, 0xff)
+                  for a in range(0, 256, 3) for x in range(0, 256, 5) ]
+        batch, single, batch_mem, single_mem = self._sweeps(
+            code, (0xf002, 0xf004, 0xf006), cases, 0xfe06, 2)
+        self.assertEqual(batch, single)
+        self.assertEqual(batch_mem, single_mem)
+
+    def test_adjba_matches_single_steps(self):
+        code = [
+            0x11, 0x1e, 0,      # mov psw,#<psw>
+            0xa1, 0,            # mov a,#<a>
+            0x61, 0x80,         # adjba
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xf0, 0x1e,         # mov a,psw
+            0x9e, 0x07, 0xfe,   # mov 0xfe07,a
+            0xaf                # ret
+        ]
+        cases = [ (psw, a) for psw in (0, 0x01, 0x10, 0x11) for a in range(256) ]
+        batch, single, batch_mem, single_mem = self._sweeps(
+            code, (0xf002, 0xf004), cases, 0xfe06, 2)
+        self.assertEqual(batch, single)
+        self.assertEqual(batch_mem, single_mem)
+
+    def test_cases_reading_memory_of_earlier_cases_are_unsupported(self):
+        code = [
+            0xa1, 0,            # mov a,#<a>
+            0x08, 0x06, 0xfe,   # add a,!0xfe06
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        with self.assertRaises(BatchUnsupported):
+            BatchExecutor(Processor()).sweep(0xf000, code, (0xf001,),
+                                             [ (a,) for a in range(10) ], 0xfe06, 1)
+
+    def test_emulator_debugger_falls_back_to_single_steps(self):
+        code = [
+            0xa1, 0,            # mov a,#<a>
+            0x08, 0x06, 0xfe,   # add a,!0xfe06
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        debug = EmulatorDebugger(Processor())
+        results = debug.sweep(0xf000, code, (0xf001,), [ (a,) for a in range(10) ],
+                              0xfe06, read_length=1)
+        self.assertEqual([ r[0] for r in results ], [0, 1, 3, 6, 10, 15, 21, 28, 36, 45])
@@ -0,0 +1,297 @@
+import os
+import time
+import unittest
+import serial # pyserial
+from k0emu import memtest
+from k0emu.board import VirtualBoard
+from k0emu.debug import (BULK_BLOCK, SerialDebugger, SerialPipeline, crc_xmodem,
+                         make_serial_debugger)
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "needs a pseudo-terminal")
+class VirtualBoardTests(unittest.TestCase):
+
+    def setUp(self):
+        self.board = VirtualBoard()
+        self.board.start()
+        self.ser = serial.Serial(port=self.board.port, baudrate=38400, timeout=2)
+        self.debug = SerialDebugger(self.ser)
+
+    def tearDown(self):
+        self.ser.close()
+        self.board.close()
+
+    def test_write_then_read(self):
+        self.debug.write(0xf000, [1, 2, 3])
+        self.assertEqual(self.debug.read(0xf000, 3), bytearray([1, 2, 3]))
+        self.assertEqual(self.board.debug.proc.memory[0xf000:0xf003], bytearray([1, 2, 3]))
+
+    def test_read_reserved_memory_reads_0x08(self):
+        self.assertEqual(self.debug.read(0xf800, 2), bytearray([0x08, 0x08]))
+
+    def test_call(self):
+        code = [
+            0xa1, 0x42,         # mov a,#0x42
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        self.debug.write(0xf000, code)
+        self.debug.call(0xf000)
+        self.assertEqual(self.debug.read(0xfe06, 1), bytearray([0x42]))
+
+    def test_unknown_command_sends_prompt(self):
+        self.ser.write(b'?')
+        self.assertEqual(self.ser.read(1), b'>')
+        self.assertEqual(self.debug.read(0xfe00, 1), bytearray([0]))
+
+    def test_execute(self):
+        code = [
+            0xa1, 0x42,         # mov a,#0x42
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        data = self.debug.execute(0xf000, code, 0xfe06, read_length=1)
+        self.assertEqual(data, bytearray([0x42]))
+
+    def test_execute_without_code_calls_code_in_memory(self):
+        code = [
+            0xa1, 0x42,         # mov a,#0x42
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        self.debug.write(0xf000, code)
+        data = self.debug.execute(0xf000, [], 0xfe06, read_length=1)
+        self.assertEqual(data, bytearray([0x42]))
+
+    def test_execute_many(self):
+        codes = [ [0xa1, a, 0x9e, 0x06, 0xfe, 0xaf] for a in range(100) ]
+        results = self.debug.execute_many(0xf000, codes, 0xfe06, read_length=1)
+        self.assertEqual([ r[0] for r in results ], list(range(100)))
+
+    def test_sweep(self):
+        code = [
+            0xa1, 0,            # mov a,#<a>
+            0xa0, 0,            # mov x,#<x>
+            0x61, 0x08,         # add a,x
+            0x9e, 0x06, 0xfe,   # mov 0xfe06,a
+            0xaf                # ret
+        ]
+        cases = [ (a, x) for a in range(4, 20) for x in range(250, 256) ] + [(0, 0)]
+        results = self.debug.sweep(0xf000, code, (0xf001, 0xf003), cases,
+                                   0xfe06, read_length=1)
+        self.assertEqual([ r[0] for r in results ],
+                         [ (a + x) & 0xff for a, x in cases ])
+
+    def test_set_baudrate(self):
+        self.assertTrue(self.debug.set_baudrate(57600))
+        self.assertEqual(self.ser.baudrate, 57600)
+        self.assertEqual(self.debug.read(0xf800, 1), bytearray([0x08]))
+
+    def test_bulk_write_then_read(self):
+        data = bytearray([ i * 7 & 0xff for i in range(1000) ])
+        self.debug.write(0xe000, data)
+        self.assertEqual(self.board.debug.proc.memory[0xe000:0xe000 + 1000], data)
+        self.assertEqual(self.debug.read(0xe000, 1000), data)
+
+    def test_bulk_read_of_all_memory(self):
+        self.board.debug.proc.memory[0xf000] = 0x55
+        data = self.debug.read(0, 0x10000)
+        self.assertEqual(len(data), 0x10000)
+        self.assertEqual(data[0xf000], 0x55)
+        self.assertEqual(data[0xf800], 0x08)
+
+    def test_put_block_with_bad_crc_is_sent_again(self):
+        self.ser.write(b'P\x00\xe0\x02\x00')
+        self.assertEqual(self.ser.read(1), b'p')
+        self.ser.write(b'\x12\x34\x00\x00')
+        self.assertEqual(self.ser.read(1), b'n')
+        crc = crc_xmodem(b'\x12\x34')
+        self.ser.write(bytearray([0x12, 0x34, crc >> 8, crc & 0xff]))
+        self.assertEqual(self.ser.read(2), b'k>')
+        self.assertEqual(self.debug.read(0xe000, 2), bytearray([0x12, 0x34]))
+
+    def test_command_after_sweep_consumed_through_zip(self):
+        code = [0xa1, 0, 0x9e, 0x06, 0xfe, 0xaf]  # mov a,#<a>; mov 0xfe06,a; ret
+        cases = [ (a,) for a in range(32) ]
+        outputs = self.debug.sweep(0xf000, code, (0xf001,), cases, 0xfe06, read_length=1)
+        self.assertEqual([ output[0] for case, output in zip(cases, outputs) ],
+                         list(range(32)))
+        self.assertEqual(self.debug.read(0xfe06, 1), bytearray([31]))
+
+    def test_sweep_and_execute_run_code_at_the_same_sp(self):
+        code = [0xa1, 0,            # mov a,#<a>
+                0x89, 0x1c,         # movw ax,sp
+                0x03, 0x00, 0xfe,   # movw 0xfe00,ax
+                0xaf]               # ret
+        cases = [ (a,) for a in range(SerialDebugger.SWEEP_MIN_CASES) ]
+        outputs = self.debug.sweep(0xf000, code, (0xf001,), cases, 0xfe00, read_length=2)
+        swept = set([ bytes(output) for output in outputs ])
+        pipeline = SerialPipeline(self.debug)
+        executed = pipeline.execute(0xf000, code, 0xfe00, 2)
+        pipeline.flush()
+        self.assertEqual(swept, set([bytes(executed.result())]))
+        self.assertEqual(executed.result(), bytearray([0x1d, 0xfe]))
+
+    def test_pipeline_never_overflows_the_receive_fifo(self):
+        pipeline = SerialPipeline(self.debug)
+        futures = [ pipeline.write(0xfb00 + i * 4, [i] * 4) for i in range(64) ]
+        pipeline.flush()
+        self.assertEqual([ f.result() for f in futures ], [None] * 64)
+        self.assertEqual(self.debug.read(0xfb00 + 63 * 4, 4), bytearray([63] * 4))
+
+    def test_overflow_of_the_receive_fifo_raises(self):
+        packet = self.debug._write_packet(0xfb00, [0x55] * 4)
+        self.ser.write(bytes(packet * 20))
+        with self.assertRaisesRegex(Exception, "receive FIFO overflowed"):
+            self.debug._read_response(b'w')
+        self.assertEqual(self.debug.read(0xfb00, 4), bytearray([0x55] * 4))
+
+    def test_serial_debugger_reads_the_chip_unless_shadow_is_asked_for(self):
+        environ = dict(os.environ)
+        try:
+            os.environ.pop('FTDI_SHADOW', None)
+            self.assertIsNone(make_serial_debugger(self.ser).shadow)
+            self.assertIsNotNone(make_serial_debugger(self.ser, shadow=True).shadow)
+            os.environ['FTDI_SHADOW'] = '1'
+            self.assertIsNotNone(make_serial_debugger(self.ser).shadow)
+            self.assertIsNone(make_serial_debugger(self.ser, shadow=False).shadow)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_pipeline_resolves_futures_in_order(self):
+        pipeline = SerialPipeline(self.debug, rx_fifo_size=8)
+        futures = []
+        for address in range(0xfb00, 0xfb20):
+            futures.append(pipeline.write(address, [address & 0xff]))
+        read = pipeline.read(0xfb00, 0x20)
+        pipeline.flush()
+        self.assertEqual([ f.result() for f in futures ], [None] * 0x20)
+        self.assertEqual(read.result(), bytearray(range(0x20)))
+
+
+class LossyBoard(VirtualBoard):
+    '''VirtualBoard that garbles the first block of its first answer to
+    F: the block loses a byte and the rest of the answer comes after a
+    pause, or the block has a bad CRC'''
+    PAUSE = 0.5  # seconds
+
+    def __init__(self, lose):
+        VirtualBoard.__init__(self)
+        self.lose = lose
+        self.garbled = False
+
+    def _cmd_fetch(self):
+        if self.garbled:
+            return VirtualBoard._cmd_fetch(self)
+        self.garbled = True
+        address = self._get_word()
+        length = self._get_word() or 0x10000
+        self._put(b'f')
+        for start in range(0, length, BULK_BLOCK):
+            data = bytearray(self.debug.read(address + start, min(BULK_BLOCK, length - start)))
+            crc = crc_xmodem(data)
+            if start == 0 and self.lose:
+                del data[0]
+            elif start == 0:
+                data[0] ^= 0xff
+            self._put(bytes(data) + bytes([crc >> 8, crc & 0xFF]))
+            if start == 0 and self.lose:
+                time.sleep(self.PAUSE)
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "needs a pseudo-terminal")
+class FetchRetryTests(unittest.TestCase):
+    # all prompts, so a data byte taken for the prompt would show
+    DATA = bytearray([0x3e] * 0x300)
+
+    def make_debugger(self, lose):
+        self.board = LossyBoard(lose)
+        self.board.debug.write(0xf000, self.DATA)
+        self.board.start()
+        self.ser = serial.Serial(port=self.board.port, baudrate=38400, timeout=0.2)
+        return SerialDebugger(self.ser)
+
+    def tearDown(self):
+        self.ser.close()
+        self.board.close()
+
+    def test_lost_bytes_are_fetched_again(self):
+        debug = self.make_debugger(lose=True)
+        self.assertEqual(debug.read(0xf000, len(self.DATA)), self.DATA)
+        self.assertEqual(debug.read(0xf000, 2), bytearray([0x3e, 0x3e]))
+
+    def test_block_with_bad_crc_is_fetched_again(self):
+        debug = self.make_debugger(lose=False)
+        self.assertEqual(debug.read(0xf000, len(self.DATA)), self.DATA)
+        self.assertEqual(debug.read(0xf000, 2), bytearray([0x3e, 0x3e]))
+
+    def test_dead_link_raises(self):
+        debug = self.make_debugger(lose=False)
+        self.board.stop()
+        with self.assertRaises(Exception):
+            debug._resync()
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "needs a pseudo-terminal")
+class ShadowedSerialDebuggerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.board = VirtualBoard()
+        self.board.start()
+        self.ser = serial.Serial(port=self.board.port, baudrate=38400, timeout=2)
+        self.debug = SerialDebugger(self.ser, shadow=True)
+        self.memory = self.board.debug.proc.memory
+
+    def tearDown(self):
+        self.ser.close()
+        self.board.close()
+
+    def test_read_of_written_memory_is_served_locally(self):
+        self.debug.write(0xf000, [1, 2, 3])
+        self.memory[0xf001] = 0xff  # changed behind the shadow's back
+        self.assertEqual(self.debug.read(0xf000, 3), bytearray([1, 2, 3]))
+
+    def test_write_sends_only_changed_bytes(self):
+        self.debug.write(0xf000, [1, 2, 3])
+        self.memory[0xf000] = 0xff  # changed behind the shadow's back
+        self.debug.write(0xf000, [1, 2, 4])
+        self.assertEqual(self.memory[0xf000:0xf003], bytearray([0xff, 2, 4]))
+
+    def test_call_invalidates_everything(self):
+        self.debug.write(0xf000, [0xaf, 0x55]) # ret
+        self.memory[0xf001] = 0xaa
+        self.debug.call(0xf000)
+        self.assertEqual(self.debug.read(0xf001, 1), bytearray([0xaa]))
+
+    def test_call_invalidates_only_clobbered_ranges(self):
+        self.debug.write(0xf000, [0xaf, 0x55]) # ret
+        self.memory[0xf001] = 0xaa
+        self.debug.call(0xf000, clobbers=[range(0xfe00, 0xfe0a)])
+        self.assertEqual(self.debug.read(0xf001, 1), bytearray([0x55]))
+
+    def test_ram_test_reads_back_from_the_chip(self):
+        self.board.debug.proc.write_memory_bytes = lambda address, data: None  # stuck memory
+        cases = memtest.cases([range(0xf000, 0xf010)], [memtest.solid(0x55)])
+        self.assertEqual(list(memtest.run(self.debug, cases)), [0] * 16)
+
+    def test_volatile_memory_is_always_read(self):
+        self.debug.write(0xfef8, [0x55])
+        self.memory[0xfef8] = 0xaa
+        self.assertEqual(self.debug.read(0xfef8, 1), bytearray([0xaa]))
+
+    def test_execute_many_results_are_unchanged(self):
+        codes = [ [0xa1, a, 0x9e, 0x06, 0xfe, 0xaf] for a in range(100) ]
+        results = self.debug.execute_many(0xf000, codes, 0xfe06, read_length=1,
+                                          clobbers=[range(0xfe00, 0xfe0a)])
+        self.assertEqual([ r[0] for r in results ], list(range(100)))
+
+    def test_sweep_then_execute_sees_target_memory(self):
+        code = [0xa1, 0, 0x9e, 0x06, 0xfe, 0xaf]  # mov a,#<a>; mov 0xfe06,a; ret
+        cases = [ (a,) for a in range(32) ]
+        results = self.debug.sweep(0xf000, code, (0xf001,), cases, 0xfe06, read_length=1,
+                                   clobbers=[range(0xfe00, 0xfe0a)])
+        self.assertEqual([ r[0] for r in results ], list(range(32)))
+        data = self.debug.execute(0xf000, code, 0xfe06, read_length=1,
+                                  clobbers=[range(0xfe00, 0xfe0a)])
+        self.assertEqual(data, bytearray([0]))
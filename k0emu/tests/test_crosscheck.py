@@ -0,0 +1,78 @@
+import unittest
+from k0emu.batch import BatchProcessor
+from k0emu.crosscheck import CrossCheck, field_name, state_hash
+from k0emu.processor import Memory, Processor
+
+
+class BadAddcProcessor(Processor):
+    '''Processor whose "addc a,#imm" ignores the carry when A is 0x42'''
+    def _opcode_0x2d(self, opcode):
+        if self.read_gp_reg(1) == 0x42:
+            self.write_psw(self.read_psw() & ~1)
+        Processor._opcode_0x2d(self, opcode)
+
+
+class CrossCheckTests(unittest.TestCase):
+    CODE = [
+        0x10, 0x00, 0x00,   # f000 movw ax,#0
+        0x20,               # f003 set1 cy
+        0x2d, 0x01,         # f004 addc a,#1
+        0x8a, 0xfb,         # f006 dbnz c,$f003
+        0x9b, 0x00, 0xf0,   # f008 br !f000
+    ]
+
+    def make_reference(self):
+        proc = Processor()
+        proc.write_memory_bytes(0xf000, self.CODE)
+        proc.write_sp(0xfe1f)
+        proc.pc = 0xf000
+        return proc
+
+    def test_same_configuration_has_no_mismatch(self):
+        check = CrossCheck(self.make_reference(), Processor(), interval=100)
+        self.assertEqual(check.run(5000), None)
+        self.assertEqual(check.count, 5000)
+        self.assertEqual(state_hash(check.reference), state_hash(check.candidate))
+
+    def test_batch_processor_has_no_mismatch(self):
+        candidate = BatchProcessor(Memory(0x10000), {})
+        check = CrossCheck(self.make_reference(), candidate, interval=1000)
+        self.assertEqual(check.run(5000), None)
+
+    def test_running_hash_depends_on_interval_states_only(self):
+        hashes = []
+        for candidate in (Processor(), BatchProcessor(Memory(0x10000), {})):
+            check = CrossCheck(self.make_reference(), candidate, interval=100)
+            check.run(1000)
+            hashes.append(check.hash)
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[0], 0)
+
+    def test_mismatch_reports_first_instruction_and_fields(self):
+        check = CrossCheck(self.make_reference(), BadAddcProcessor(), interval=1000)
+        mismatch = check.run(5000)
+        # a = 0x42 after 0x21 passes of set1 cy, addc a,#1, dbnz
+        self.assertEqual(mismatch.count, 1 + 3 * 0x21 + 2)
+        self.assertEqual(mismatch.address, 0xf004)
+        self.assertEqual(mismatch.code, bytearray([0x2d, 0x01]))
+        self.assertEqual(mismatch.differences, [('RB0.A', 0x44, 0x43)])
+        self.assertEqual(str(mismatch),
+                         "Instruction 102: f004: 2d 01  addc a,#0x01\n"
+                         "  RB0.A: reference=44 candidate=43\n")
+
+    def test_mismatch_when_only_one_raises(self):
+        reference = self.make_reference()
+        reference.write_memory(0xf004, 0x31)    # not implemented: 31 ff
+        reference.write_memory(0xf005, 0xff)
+        candidate = BadAddcProcessor()
+        candidate._opcode_map_prefix_0x31 = {0xff: lambda opcode: None}
+        mismatch = CrossCheck(reference, candidate).run(100)
+        self.assertEqual(mismatch.count, 3)
+        self.assertEqual(mismatch.differences[0][0], 'exception')
+        self.assertEqual(mismatch.differences[0][2], None)
+
+    def test_field_name(self):
+        self.assertEqual(field_name(0xfef9), 'RB0.A')
+        self.assertEqual(field_name(0xfee7), 'RB3.H')
+        self.assertEqual(field_name(0xff1e), 'PSW')
+        self.assertEqual(field_name(0xf123), 'f123')
@@ -0,0 +1,161 @@
+import unittest
+from k0emu.debug import (EmulatorDebugger, ShadowMemory, _sweep_blocks,
+                         brgc0_for_baudrate, crc_xmodem)
+from k0emu.processor import InstructionBudgetExceeded, Processor
+
+
+class ShadowMemoryTests(unittest.TestCase):
+
+    def test_lookup_returns_none_for_unknown_bytes(self):
+        shadow = ShadowMemory()
+        self.assertEqual(shadow.lookup(0xf000, 1), None)
+
+    def test_lookup_returns_bytes_after_update(self):
+        shadow = ShadowMemory()
+        shadow.update(0xf000, [1, 2, 3])
+        self.assertEqual(shadow.lookup(0xf000, 3), bytearray([1, 2, 3]))
+        self.assertEqual(shadow.lookup(0xf001, 2), bytearray([2, 3]))
+        self.assertEqual(shadow.lookup(0xf001, 3), None)
+
+    def test_volatile_ranges_are_never_known(self):
+        shadow = ShadowMemory(volatile=[range(0xff00, 0x10000)])
+        shadow.update(0xfeff, [1, 2])
+        self.assertEqual(shadow.lookup(0xfeff, 1), bytearray([1]))
+        self.assertEqual(shadow.lookup(0xff00, 1), None)
+
+    def test_invalidate_all(self):
+        shadow = ShadowMemory()
+        shadow.update(0xf000, [1, 2, 3])
+        shadow.invalidate()
+        self.assertEqual(shadow.lookup(0xf000, 1), None)
+
+    def test_invalidate_ranges(self):
+        shadow = ShadowMemory()
+        shadow.update(0xf000, [1, 2, 3])
+        shadow.invalidate([range(0xf001, 0xf002)])
+        self.assertEqual(shadow.lookup(0xf000, 1), bytearray([1]))
+        self.assertEqual(shadow.lookup(0xf001, 1), None)
+        self.assertEqual(shadow.lookup(0xf002, 1), bytearray([3]))
+
+    def test_changes_of_unknown_memory_is_everything(self):
+        shadow = ShadowMemory()
+        self.assertEqual(shadow.changes(0xf000, [1, 2, 3]),
+                         [(0xf000, bytearray([1, 2, 3]))])
+
+    def test_changes_returns_only_changed_runs(self):
+        shadow = ShadowMemory()
+        code = [0] * 32
+        shadow.update(0xf000, code)
+        code[4] = 0xaa
+        code[20] = 0xbb
+        code[21] = 0xcc
+        self.assertEqual(shadow.changes(0xf000, code),
+                         [(0xf004, bytearray([0xaa])),
+                          (0xf014, bytearray([0xbb, 0xcc]))])
+
+    def test_changes_merges_runs_separated_by_small_gaps(self):
+        shadow = ShadowMemory()
+        shadow.update(0xf000, [0] * 8)
+        self.assertEqual(shadow.changes(0xf000, [1, 0, 0, 1]),
+                         [(0xf000, bytearray([1, 0, 0, 1]))])
+
+    def test_changes_splits_runs_longer_than_a_packet(self):
+        shadow = ShadowMemory()
+        runs = shadow.changes(0xf000, [0] * 300)
+        self.assertEqual([ (a, len(d)) for a, d in runs ],
+                         [(0xf000, 255), (0xf0ff, 45)])
+
+    def test_changes_is_empty_when_memory_matches(self):
+        shadow = ShadowMemory()
+        shadow.update(0xf000, [1, 2, 3])
+        self.assertEqual(shadow.changes(0xf000, [1, 2, 3]), [])
+
+
+class SweepBlocksTests(unittest.TestCase):
+
+    def test_nested_loops_are_one_block_per_fixed_prefix(self):
+        cases = [ (psw, a, x) for psw in (0, 1) for a in range(256) for x in range(256) ]
+        self.assertEqual(list(_sweep_blocks(cases)),
+                         [(0, 0x10000, 256, 256), (0x10000, 0x20000, 256, 256)])
+
+    def test_single_value_is_one_row(self):
+        cases = [ (a,) for a in range(10, 20) ]
+        self.assertEqual(list(_sweep_blocks(cases)), [(0, 10, 1, 10)])
+
+    def test_counting_down_is_one_block_per_case(self):
+        cases = [ (a,) for a in range(3, 0, -1) ]
+        self.assertEqual(list(_sweep_blocks(cases)),
+                         [(0, 1, 1, 1), (1, 2, 1, 1), (2, 3, 1, 1)])
+
+    def test_incomplete_last_row_is_a_separate_block(self):
+        cases = [ (a, x) for a in range(3) for x in range(4) ][:-1]
+        self.assertEqual(list(_sweep_blocks(cases)), [(0, 8, 2, 4), (8, 11, 1, 3)])
+
+
+class Brgc0ForBaudrateTests(unittest.TestCase):
+
+    def test_38400_is_the_firmware_default(self):
+        self.assertEqual(brgc0_for_baudrate(38400), 0x1b)
+
+    def test_57600(self):
+        self.assertEqual(brgc0_for_baudrate(57600), 0x12)
+
+    def test_rate_too_fast_raises(self):
+        with self.assertRaises(Exception):
+            brgc0_for_baudrate(115200)
+
+
+class CrcXmodemTests(unittest.TestCase):
+
+    def test_check_value(self):
+        self.assertEqual(crc_xmodem(b'123456789'), 0x31c3)
+
+    def test_crc_of_data_and_its_crc_is_zero(self):
+        data = bytearray(range(256))
+        crc = crc_xmodem(data)
+        self.assertEqual(crc_xmodem(data + bytearray([crc >> 8, crc & 0xff])), 0)
+
+
+class EmulatorDebuggerCallTests(unittest.TestCase):
+
+    def test_code_may_call_subroutines(self):
+        debug = EmulatorDebugger(Processor())
+        code = [
+            0x9a, 0x09, 0xf0,   # call !0xf009
+            0xa1, 0x42,         # mov a,#0x42
+            0x9e, 0x00, 0xfe,   # mov 0xfe00,a
+            0xaf,               # ret
+            0xa1, 0x41,         # 0xf009: mov a,#0x41
+            0x9e, 0x01, 0xfe,   # mov 0xfe01,a
+            0xaf                # ret
+        ]
+        self.assertEqual(debug.execute(0xf000, code, 0xfe00, 2), bytearray([0x42, 0x41]))
+        self.assertEqual(debug.proc.read_sp(), 0xfe1f)
+
+    def test_sp_is_the_same_as_in_the_firmware(self):
+        debug = EmulatorDebugger(Processor())
+        code = [
+            0x89, 0x1c,         # movw ax,sp
+            0x03, 0x00, 0xfe,   # movw 0xfe00,ax
+            0xaf                # ret
+        ]
+        self.assertEqual(debug.execute(0xf000, code, 0xfe00, 2), bytearray([0x1d, 0xfe]))
+
+    def test_code_that_never_returns_raises(self):
+        debug = EmulatorDebugger(Processor())
+        debug.write(0xf000, [0xfa, 0xfe])  # br $0xf000
+        with self.assertRaises(InstructionBudgetExceeded):
+            debug.call(0xf000, max_instructions=100)
+
+    def test_call_after_runaway_code_starts_clean(self):
+        debug = EmulatorDebugger(Processor())
+        debug.write(0xf000, [0xb1, 0xfa, 0xfd])  # push ax; br $0xf000
+        with self.assertRaises(InstructionBudgetExceeded):
+            debug.call(0xf000, max_instructions=100)
+        self.assertEqual(debug.proc.read_sp(), 0xfe1f)
+        code = [
+            0x89, 0x1c,         # movw ax,sp
+            0x03, 0x00, 0xfe,   # movw 0xfe00,ax
+            0xaf                # ret
+        ]
+        self.assertEqual(debug.execute(0xf000, code, 0xfe00, 2), bytearray([0x1d, 0xfe]))
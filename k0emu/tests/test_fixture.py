@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from k0emu.debug import make_emulator_debugger
+from k0emu.fixture import CHECKPOINT_SUFFIX, ShardScheduler, resume_report, submit_fixture
+
+TESTPROGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'debugger', 'testprogs')
+
+
+class IncFixture(object):
+    '''Fixture like test_inc.py that can be split up'''
+
+    def cases(self):
+        return [ (a,) for a in range(256) ]
+
+    def run(self, debug, cases):
+        code = [0xa1, 0, 0x41, 0x9e, 0x00, 0xfe, 0xaf] # mov a,#<a>; inc a; mov 0xfe00,a; ret
+        return debug.sweep(0xf000, code, (0xf001,), cases, 0xfe00, read_length=1)
+
+    def report(self, case, output):
+        return "%02x -> %02x\n" % (case[0], output[0])
+
+
+class FailingDebugger(object):
+    def sweep(self, *args, **kwargs):
+        raise Exception("board dropped out")
+
+
+class FlakyDebugger(object):
+    '''Emulator debugger that fails on its sweep number <fail_at>'''
+    def __init__(self, fail_at):
+        self.debug = make_emulator_debugger()
+        self.sweeps = 0
+        self.fail_at = fail_at
+
+    def sweep(self, *args, **kwargs):
+        self.sweeps += 1
+        if self.sweeps == self.fail_at:
+            raise Exception("serial timeout")
+        return self.debug.sweep(*args, **kwargs)
+
+
+class ShardSchedulerTests(unittest.TestCase):
+
+    def expected_report(self):
+        return ''.join([ "%02x -> %02x\n" % (a, (a + 1) & 0xff) for a in range(256) ])
+
+    def test_report_is_in_case_order(self):
+        debuggers = [ make_emulator_debugger() for i in range(3) ]
+        scheduler = ShardScheduler(debuggers, shard_size=10)
+        outfile = io.StringIO()
+        scheduler.run(IncFixture(), outfile)
+        self.assertEqual(outfile.getvalue(), self.expected_report())
+
+    def test_shards_of_failed_debugger_are_rerun(self):
+        failing = FailingDebugger()
+        scheduler = ShardScheduler([failing, make_emulator_debugger()], shard_size=10)
+        outfile = io.StringIO()
+        scheduler.run(IncFixture(), outfile)
+        self.assertEqual(outfile.getvalue(), self.expected_report())
+        self.assertEqual(len(scheduler.debuggers), 1)
+        self.assertEqual(scheduler.failures[0][0], failing)
+
+    def test_all_debuggers_failing_raises(self):
+        scheduler = ShardScheduler([FailingDebugger()], shard_size=10)
+        with self.assertRaises(Exception):
+            scheduler.run(IncFixture(), io.StringIO())
+        self.assertEqual(scheduler.debuggers, [])
+
+    def test_fixture_without_cases_runs_test_on_one_debugger(self):
+        class Fixture(object):
+            def test(self, debug, outfile):
+                outfile.write("ran\n")
+        outfile = io.StringIO()
+        ShardScheduler([make_emulator_debugger()]).run(Fixture(), outfile)
+        self.assertEqual(outfile.getvalue(), "ran\n")
+
+
+class ResumeReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.outfilename = os.path.join(self.tempdir, 'test_inc.txt')
+        self.fixture = IncFixture()
+        self.cases = self.fixture.cases()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def resume(self, debug):
+        scheduler = ShardScheduler([debug], shard_size=10)
+        def run(outfile, start, stop, progress):
+            scheduler.run(self.fixture, outfile, start, stop, progress)
+        resume_report(self.outfilename, self.cases, run)
+
+    def read_report(self):
+        with open(self.outfilename) as f:
+            return f.read()
+
+    def expected_report(self):
+        return ''.join([ "%02x -> %02x\n" % (a, (a + 1) & 0xff) for a in range(256) ])
+
+    def test_uninterrupted_run_leaves_no_checkpoint(self):
+        self.resume(make_emulator_debugger())
+        self.assertEqual(self.read_report(), self.expected_report())
+        self.assertFalse(os.path.exists(self.outfilename + CHECKPOINT_SUFFIX))
+
+    def test_interrupted_run_is_resumed(self):
+        with self.assertRaises(Exception):
+            self.resume(FlakyDebugger(fail_at=5))
+        self.assertEqual(self.read_report(), self.expected_report()[:4 * 10 * 9])
+        with self.assertRaises(Exception):
+            self.resume(FlakyDebugger(fail_at=20))
+        self.resume(make_emulator_debugger())
+        self.assertEqual(self.read_report(), self.expected_report())
+        self.assertFalse(os.path.exists(self.outfilename + CHECKPOINT_SUFFIX))
+
+    def test_lines_after_the_checkpoint_are_discarded(self):
+        with self.assertRaises(Exception):
+            self.resume(FlakyDebugger(fail_at=3))
+        with open(self.outfilename, 'a') as f:
+            f.write("03 -> 0")  # killed while writing a line
+        self.resume(make_emulator_debugger())
+        self.assertEqual(self.read_report(), self.expected_report())
+
+    def test_checkpoint_for_other_cases_raises(self):
+        with self.assertRaises(Exception):
+            self.resume(FlakyDebugger(fail_at=3))
+        self.cases = [ (a,) for a in range(255, -1, -1) ]
+        with self.assertRaises(Exception):
+            self.resume(make_emulator_debugger())
+
+    def test_resumed_report_that_differs_from_rerun_is_removed(self):
+        with self.assertRaises(Exception):
+            self.resume(FlakyDebugger(fail_at=3))
+        with open(self.outfilename, 'r+') as f:
+            f.seek(len("00 -> 01\n") * 19)
+            f.write("13 -> ff\n")  # corrupted before the interruption
+        with self.assertRaises(Exception):
+            self.resume(make_emulator_debugger())
+        self.assertFalse(os.path.exists(self.outfilename))
+        self.assertFalse(os.path.exists(self.outfilename + CHECKPOINT_SUFFIX))
+
+
+class SubmitFixtureTests(unittest.TestCase):
+
+    def test_shards_from_pool_match_serial_report(self):
+        fixture = os.path.join(TESTPROGS, 'fixtures', 'test_rol.py')
+        with ProcessPoolExecutor(2) as executor:
+            futures = submit_fixture(executor, fixture, shard_size=100)
+            report = ''.join([ f.result() for f in futures ])
+        self.assertEqual(len(futures), 6)
+        with open(os.path.join(TESTPROGS, 'results', 'serial', 'test_rol.txt')) as f:
+            self.assertEqual(report, f.read())
+
+    def test_every_shard_is_traced(self):
+        fixture = os.path.join(TESTPROGS, 'fixtures', 'test_rol.py')
+        with ProcessPoolExecutor(1) as executor:
+            futures = submit_fixture(executor, fixture, shard_size=100, trace=True)
+            results = [ f.result() for f in futures ]
+        with open(os.path.join(TESTPROGS, 'results', 'serial', 'test_rol.txt')) as f:
+            self.assertEqual(''.join([ text for text, seconds, functions in results ]),
+                             f.read())
+        for text, seconds, functions in results:
+            self.assertIn('k0emu.debug:make_emulator_debugger', functions)
+            self.assertIn('k0emu.processor:Processor._opcode_0x26', functions)   # rol a,1
+
+    def test_functions_reached_only_by_a_later_shard_are_traced(self):
+        fixture = os.path.join(TESTPROGS, 'fixtures', 'test_ram.py')
+        with ProcessPoolExecutor(1) as executor:
+            futures = submit_fixture(executor, fixture, trace=True)
+            results = [ f.result() for f in futures ]
+        self.assertNotIn('k0emu.processor:_overlap', results[0][2])
+        self.assertIn('k0emu.processor:_overlap', results[-1][2])
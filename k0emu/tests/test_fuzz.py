@@ -0,0 +1,99 @@
+import unittest
+from k0dasm.disassemble import disassemble
+from k0emu.crosscheck import CANDIDATES
+from k0emu.fuzz import Failure, Fuzzer, FuzzReport, opcodes
+from k0emu.processor import Processor
+from k0emu.tests.test_crosscheck import BadAddcProcessor
+
+
+class ReservedWriteProcessor(Processor):
+    '''Processor whose "nop" writes to the reserved memory'''
+    def _opcode_0x00(self, opcode):
+        self.memory[0xf900] ^= 0xff
+
+
+class RunawayPcProcessor(Processor):
+    '''Processor whose "nop" moves the PC past the end of memory'''
+    def _opcode_0x00(self, opcode):
+        self.pc = 0x10000
+
+
+class UnimplementedNopProcessor(Processor):
+    def _opcode_0x00(self, opcode):
+        raise NotImplementedError()
+
+
+class FuzzerTests(unittest.TestCase):
+    def make_case(self, code):
+        memory = bytearray(0x10000)
+        memory[Fuzzer.CODE_ADDRESS:Fuzzer.CODE_ADDRESS + len(code)] = code
+        return memory
+
+    def test_case_is_made_from_its_seed_alone(self):
+        fuzzer = Fuzzer()
+        self.assertEqual(fuzzer.case(42), fuzzer.case(42))
+        self.assertNotEqual(fuzzer.case(42)[0], fuzzer.case(43)[0])
+
+    def test_case_has_valid_instructions_at_code_address(self):
+        fuzzer = Fuzzer(instructions=5)
+        memory, addresses = fuzzer.case(7)
+        address = Fuzzer.CODE_ADDRESS
+        for i in range(5):
+            self.assertIn(address, addresses)
+            address += len(disassemble(memory, address).all_bytes)
+        self.assertEqual(len(addresses), 5)
+
+    def test_opcodes_come_from_the_opcode_maps(self):
+        result = opcodes(Processor())
+        self.assertIn([0x00], result)
+        self.assertIn([0x31, 0x01], result)   # btclr saddr.0,$rel
+        self.assertIn([0x61, 0x01], result)   # add a,a
+        self.assertNotIn([0x31], result)
+        self.assertNotIn([0x61], result)
+
+    def test_processor_has_no_failures(self):
+        report = Fuzzer().run(200, seed=1)
+        self.assertEqual(report.cases, 200)
+        self.assertEqual([ str(f) for f in report.failures ], [])
+
+    def test_write_to_reserved_memory_fails(self):
+        fuzzer = Fuzzer(ReservedWriteProcessor())
+        failure, steps = fuzzer._check(5, self.make_case([0x00]), set([0xf000]))
+        self.assertEqual(steps, 1)
+        self.assertEqual(str(failure),
+                         "seed 5, instruction 1 at f000: reserved memory at f800-faff changed")
+
+    def test_pc_out_of_range_fails(self):
+        fuzzer = Fuzzer(RunawayPcProcessor())
+        failure, steps = fuzzer._check(5, self.make_case([0x00]), set([0xf000]))
+        self.assertEqual(failure.message, "PC is 65536")
+
+    def test_not_implemented_ends_the_case(self):
+        fuzzer = Fuzzer(UnimplementedNopProcessor())
+        memory = self.make_case([0xa1, 0x01, 0x00])   # mov a,#1; nop
+        failure, steps = fuzzer._check(5, memory, set([0xf000, 0xf002]))
+        self.assertEqual((failure, steps), (None, -1))
+
+    def test_difference_from_reference_fails(self):
+        fuzzer = Fuzzer(BadAddcProcessor(), reference=Processor())
+        memory = self.make_case([
+            0xa1, 0x42,     # f000 mov a,#0x42
+            0x20,           # f002 set1 cy
+            0x2d, 0x01,     # f003 addc a,#0x01
+            ])
+        failure = fuzzer._compare(9, memory, 3)
+        self.assertEqual((failure.seed, failure.count, failure.address), (9, 3, 0xf003))
+        self.assertTrue(failure.message.startswith("differs from the reference: "))
+        self.assertIn("RB0.A: reference=44 candidate=43", failure.message)
+
+    def test_candidate_has_no_failures_against_the_reference(self):
+        report = Fuzzer(CANDIDATES['batch'](), reference=Processor()).run(200, seed=1)
+        self.assertEqual([ str(f) for f in report.failures ], [])
+
+    def test_report_counts_cases_per_second(self):
+        report = FuzzReport()
+        self.assertEqual(report.cases_per_second(), 0.0)
+        report.cases, report.seconds, report.undefined = 500, 2.0, 3
+        report.failures.append(Failure(1, 2, 0xf000, "PC is None"))
+        self.assertEqual(str(report),
+                         "500 cases in 2.0 s (250 cases/s), 3 undefined, 1 failures")
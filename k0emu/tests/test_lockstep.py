@@ -0,0 +1,109 @@
+import os
+import unittest
+import serial # pyserial
+from k0emu.board import VirtualBoard
+from k0emu.debug import SerialDebugger
+from k0emu.lockstep import Lockstep, LockstepError
+from k0emu.processor import Processor, Registers
+
+
+class BadIncProcessor(Processor):
+    '''Processor whose "inc a" adds 2'''
+    def _opcode_0x40_to_0x47_inc(self, opcode):
+        Processor._opcode_0x40_to_0x47_inc(self, opcode)
+        if opcode == 0x41:
+            Processor._opcode_0x40_to_0x47_inc(self, opcode)
+
+
+class BadBzProcessor(Processor):
+    '''Processor whose "bz" never branches'''
+    def _opcode_0xad(self, opcode):
+        self._consume_byte()
+
+    def _init_opcode_map_unprefixed(self):
+        Processor._init_opcode_map_unprefixed(self)
+        self._opcode_map_unprefixed[0xad] = self._opcode_0xad
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "needs a pseudo-terminal")
+class LockstepTests(unittest.TestCase):
+    CODE = [
+        0xa1, 0x05,         # f000 mov a,#0x05
+        0x41,               # f002 inc a
+        0x9a, 0x10, 0xf0,   # f003 call !0xf010
+        0x4d, 0x07,         # f006 cmp a,#0x07
+        0xad, 0x02,         # f008 bz $0xf00c
+        0xa1, 0xee,         # f00a mov a,#0xee
+        0x9e, 0x00, 0xf1,   # f00c mov !0xf100,a
+        0xaf,               # f00f ret
+        0xb1,               # f010 push ax
+        0xb0,               # f011 pop ax
+        0x41,               # f012 inc a
+        0xaf,               # f013 ret
+    ]
+
+    def make_lockstep(self, board_processor=None, watch=None):
+        self.board = VirtualBoard(board_processor)
+        self.board.start()
+        self.ser = serial.Serial(port=self.board.port, baudrate=38400, timeout=2)
+        proc = Processor()
+        proc.write_sp(0xfe1f)
+        proc.pc = 0xf000
+        debug = SerialDebugger(self.ser)
+        if watch is None:
+            lockstep = Lockstep(debug, proc)
+        else:
+            lockstep = Lockstep(debug, proc, watch)
+        lockstep.load(0xf000, self.CODE)
+        lockstep.load(0xf100, [0])
+        lockstep.start()
+        return lockstep
+
+    def tearDown(self):
+        self.ser.close()
+        self.board.close()
+
+    def test_same_code_runs_without_divergence(self):
+        lockstep = self.make_lockstep(watch=[range(0xf100, 0xf101)])
+        self.assertEqual(lockstep.run(stop_address=0xf00f), None)
+        self.assertEqual(lockstep.steps, 10)
+        self.assertEqual(lockstep.proc.read_memory(0xf100), 0x07)
+        self.assertEqual(self.board.debug.proc.read_memory(0xf100), 0x07)
+
+    def test_breakpoints_are_removed_after_each_step(self):
+        lockstep = self.make_lockstep()
+        lockstep.run(max_steps=5)
+        self.assertEqual(self.board.debug.read(0xf000, len(self.CODE)),
+                         bytearray(self.CODE))
+
+    def test_stops_at_first_register_difference(self):
+        lockstep = self.make_lockstep(BadIncProcessor())
+        divergence = lockstep.run()
+        self.assertEqual(divergence.step, 2)
+        self.assertEqual(divergence.address, 0xf002)
+        self.assertEqual(divergence.code, bytearray([0x41]))
+        self.assertEqual(divergence.differences, [('A', 0x07, 0x06)])
+        self.assertEqual(str(divergence),
+                         "Step 2: f002: 41  inc a\n"
+                         "  A: board=07 emulator=06\n")
+
+    def test_stops_at_first_branch_difference(self):
+        lockstep = self.make_lockstep(BadBzProcessor())
+        # the board does not branch, so the next instruction differs
+        divergence = lockstep.run()
+        self.assertEqual(divergence.address, 0xf008)
+        self.assertEqual(divergence.differences, [('PC', 0xf00a, 0xf00c)])
+
+    def test_stops_at_first_watched_memory_difference(self):
+        lockstep = self.make_lockstep(watch=[range(0xf100, 0xf108)])
+        self.board.debug.write(0xf104, [0x55])
+        divergence = lockstep.run()
+        self.assertEqual(divergence.step, 1)
+        self.assertEqual(divergence.differences, [('f104', 0x55, 0x00)])
+
+    def test_branch_into_itself_raises(self):
+        lockstep = self.make_lockstep()
+        lockstep.load(0xf000, [0x8b, 0xfe])   # dbnz b,$
+        lockstep.proc.write_gp_reg(Registers.B, 2)
+        with self.assertRaises(LockstepError):
+            lockstep.step()
@@ -0,0 +1,86 @@
+import unittest
+from k0emu import memtest
+from k0emu.debug import EmulatorDebugger, SerialDebugger
+from k0emu.processor import Processor
+
+
+class RecordingDebugger(EmulatorDebugger):
+    '''Emulator that records the transfers and answers reads from its
+    copy of memory until it is invalidated, like the shadow memory of
+    SerialDebugger'''
+    VOLATILE_RANGES = (range(0xfe80, 0xfec0),)
+
+    def __init__(self):
+        EmulatorDebugger.__init__(self, Processor())
+        self.transfers = []
+        self.copy = {}
+
+    def write(self, address, data):
+        self.transfers.append(('write', address, len(data)))
+        EmulatorDebugger.write(self, address, data)
+        for i, value in enumerate(data):
+            self.copy[address + i] = value
+
+    def read(self, address, length):
+        self.transfers.append(('read', address, length))
+        data = EmulatorDebugger.read(self, address, length)
+        for i in range(length):
+            data[i] = self.copy.get(address + i, data[i])
+        return data
+
+    def invalidate(self, ranges=None):
+        for r in ranges:
+            for address in r:
+                self.copy.pop(address, None)
+
+
+class MemtestTests(unittest.TestCase):
+
+    def test_one_write_and_one_read_per_range_and_pattern(self):
+        debug = RecordingDebugger()
+        cases = memtest.cases([range(0xf000, 0xf100), range(0xfb00, 0xfb10)],
+                              [memtest.solid(0x55), memtest.walking_ones])
+        outputs = list(memtest.run(debug, cases))
+        self.assertEqual(outputs, [ pattern for _, pattern in cases ])
+        self.assertEqual(debug.transfers, [
+            ('write', 0xf000, 0x100), ('read', 0xf000, 0x100),
+            ('write', 0xf000, 0x100), ('read', 0xf000, 0x100),
+            ('write', 0xfb00, 0x10), ('read', 0xfb00, 0x10),
+            ('write', 0xfb00, 0x10), ('read', 0xfb00, 0x10),
+        ])
+
+    def test_volatile_addresses_are_tested_one_byte_at_a_time(self):
+        debug = RecordingDebugger()
+        cases = memtest.cases([range(0xfe7e, 0xfe82)], [memtest.solid(0xaa)])
+        list(memtest.run(debug, cases))
+        self.assertEqual([ t for t in debug.transfers if t[0] == 'write' ], [
+            ('write', 0xfe7e, 2), ('write', 0xfe80, 1), ('write', 0xfe81, 1),
+        ])
+
+    def test_reserved_memory_is_tested_with_bulk_transfers(self):
+        debug = RecordingDebugger()
+        debug.VOLATILE_RANGES = SerialDebugger.VOLATILE_RANGES
+        cases = memtest.cases([range(0xf800, 0xfb00)], [memtest.solid(0x55)])
+        self.assertEqual(list(memtest.run(debug, cases)), [0x08] * 0x300)
+        self.assertEqual(debug.transfers, [('write', 0xf800, 0x300), ('read', 0xf800, 0x300)])
+
+    def test_reads_come_from_the_target(self):
+        debug = RecordingDebugger()
+        debug.proc.write_memory = lambda address, value: None  # stuck memory
+        debug.proc.write_memory_bytes = lambda address, data: None
+        outputs = list(memtest.run(debug, [(0xf000, 0x55), (0xf001, 0x55)]))
+        self.assertEqual(outputs, [0, 0])
+
+    def test_reserved_memory_is_different(self):
+        debug = EmulatorDebugger(Processor())
+        cases = memtest.cases([range(0xf7ff, 0xf801)], [memtest.solid(0x55)])
+        lines = [ memtest.report(case, output) for case, output
+                  in zip(cases, memtest.run(debug, cases)) ]
+        self.assertEqual(lines, ["f7ff: IN=55 -> OUT=55 (OK)\n",
+                                 "f800: IN=55 -> OUT=08 (DIFFERENT)\n"])
+
+    def test_patterns(self):
+        self.assertEqual([ memtest.walking_ones(a) for a in range(9) ],
+                         [1, 2, 4, 8, 16, 32, 64, 128, 1])
+        self.assertEqual(memtest.complement(memtest.walking_ones)(0), 0xfe)
+        self.assertEqual(memtest.address_in_address(0xf012), 0xe2)
@@ -1,6 +1,6 @@
 import unittest
 import sys
-from k0emu.processor import Processor, Registers, RegisterPairs, Flags
+from k0emu.processor import Processor, Registers, RegisterPairs, Flags, load_rom
 
 class ProcessorTests(unittest.TestCase):
 
@@ -81,6 +81,56 @@ class ProcessorTests(unittest.TestCase):
         for address in range(0xF800, 0xFB00):
             self.assertEqual(proc.read_memory(address), 0x08)
 
+    # bulk memory
+
+    def test_read_memory_bytes_matches_read_memory(self):
+        proc = Processor()
+        for address in range(0x10000):
+            proc.memory[address] = address & 0xFF
+        for address, length in ((0xF7F0, 0x20), (0xFAF0, 0x20), (0xF700, 0x500),
+                                (0xFFF0, 0x20), (0x1234, 0)):
+            expected = bytearray([ proc.read_memory((address + i) & 0xFFFF)
+                                   for i in range(length) ])
+            self.assertEqual(proc.read_memory_bytes(address, length), expected)
+
+    def test_write_memory_bytes_matches_write_memory(self):
+        proc, expected = Processor(), Processor()
+        for address, length in ((0xF7F0, 0x20), (0xFAF0, 0x20), (0xF700, 0x500),
+                                (0xFF10, 0x20), (0xFFF0, 0x20)):
+            data = bytearray([ (address + i) & 0xFF ^ 0xFF for i in range(length) ])
+            proc.write_memory_bytes(address, data)
+            for i, value in enumerate(data):
+                expected.write_memory((address + i) & 0xFFFF, value)
+            self.assertEqual(proc.memory, expected.memory)
+
+    def test_memory_slice_masks_psw(self):
+        proc = Processor()
+        proc.memory[Processor.PSW_ADDRESS - 1:Processor.PSW_ADDRESS + 1] = b'\xff\xff'
+        self.assertEqual(proc.memory[Processor.PSW_ADDRESS - 1], 0xff)
+        self.assertEqual(proc.read_psw(), 0b11111011)
+
+    def test_memory_slice_of_another_size_raises(self):
+        proc = Processor()
+        with self.assertRaises(Exception):
+            proc.memory[0:2] = b'\x00'
+        self.assertEqual(len(proc.memory), 0x10000)
+
+    def test_push_word_pushes_like_call(self):
+        proc = Processor()
+        proc.write_sp(0xfe1f)
+        proc.push(0x02)
+        proc.push_word(0xabcd)
+        self.assertEqual(proc.read_sp(), 0xfe1c)
+        self.assertEqual(proc.read_memory_bytes(0xfe1c, 3), bytearray([0xcd, 0xab, 0x02]))
+
+    def test_load_rom_resets_and_zeroes_ram(self):
+        proc = Processor()
+        proc.memory[0xfe00] = 0x55
+        load_rom(proc, [0x34, 0x12, 0xaf])
+        self.assertEqual(proc.pc, 0x1234)
+        self.assertEqual(proc.read_memory_bytes(0, 3), bytearray([0x34, 0x12, 0xaf]))
+        self.assertEqual(proc.memory[0xfe00], 0)
+
     # instructions
 
     # nop
@@ -0,0 +1,72 @@
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+from k0emu.debug import make_emulator_debugger
+from k0emu.processor import Processor
+from k0emu.resultcache import ResultCache, function_hash, module_hash, trace_calls
+
+
+def run_and():
+    debug = make_emulator_debugger()
+    code = [0xa1, 0x0f, 0x5d, 0x3c, 0x9e, 0x00, 0xfe, 0xaf]  # mov a,#0x0f; and a,#0x3c; ...
+    return debug.execute(0xf000, code, 0xfe00, 1)
+
+
+class TraceCallsTests(unittest.TestCase):
+
+    def test_names_of_k0emu_functions_called(self):
+        result, names = trace_calls(run_and)
+        self.assertEqual(result, bytearray([0x0c]))
+        self.assertIn('k0emu.processor:Processor._operation_and', names)
+        self.assertIn('k0emu.debug:EmulatorDebugger.call', names)
+        self.assertNotIn('k0emu.processor:Processor._operation_or', names)
+        self.assertEqual([ n for n in names if not n.startswith('k0emu.') ], [])
+
+
+class HashTests(unittest.TestCase):
+
+    def test_function_hash_of_missing_function_is_none(self):
+        self.assertEqual(function_hash('k0emu.processor:Processor.no_such_method'), None)
+
+    def test_module_hash_leaves_sources_intact(self):
+        source = inspect.getsource(Processor._operation_and)
+        module_hash('k0emu.processor')
+        self.assertEqual(inspect.getsource(Processor._operation_and), source)
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tempdir, 'manifest.json')
+        self.fixture = os.path.join(self.tempdir, 'test_and.py')
+        with open(self.fixture, 'w') as f:
+            f.write("# fixture\n")
+        self.functions = trace_calls(run_and)[1]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_recorded_report_is_current(self):
+        ResultCache(self.manifest).record('test_and', self.fixture, self.functions, 1.5)
+        cache = ResultCache(self.manifest)
+        self.assertTrue(cache.is_current('test_and', self.fixture))
+        self.assertEqual(cache.entries['test_and']['seconds'], 1.5)
+        self.assertFalse(cache.is_current('test_or', self.fixture))
+
+    def test_report_is_stale_when_the_fixture_changes(self):
+        cache = ResultCache(self.manifest)
+        cache.record('test_and', self.fixture, self.functions, 1.5)
+        with open(self.fixture, 'a') as f:
+            f.write("# changed\n")
+        self.assertFalse(cache.is_current('test_and', self.fixture))
+
+    def test_report_is_stale_when_a_function_it_ran_changes(self):
+        cache = ResultCache(self.manifest)
+        cache.record('test_and', self.fixture, self.functions, 1.5)
+        cache.entries['test_and']['functions'][
+            'k0emu.processor:Processor._operation_and'] = 'hash of the old source'
+        cache.save()
+        self.assertFalse(ResultCache(self.manifest).is_current('test_and', self.fixture))
@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+import unittest
+from k0emu.fixture import load_fixture
+from k0emu.results import LineParser, Results, iter_results, parse_report, read_results, write_results
+
+TESTPROGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'debugger', 'testprogs')
+
+
+def report_bytes(case, output):
+    (a, x), (a_out, psw_out) = case, output
+    return "A(IN)=%02x, X(IN)=%02x -> A(OUT)=%02x, PSW(OUT)=%02x\n" % (a, x, a_out, psw_out)
+
+def report_int(case, output):
+    (address, pat), pat_out = case, output
+    msg = 'OK' if pat_out == pat else 'DIFFERENT'
+    return "%04x: IN=%02x -> OUT=%02x (%s)\n" % (address, pat, pat_out, msg)
+
+
+class ResultsTests(unittest.TestCase):
+
+    def roundtrip(self, results):
+        outfile = io.BytesIO()
+        write_results(outfile, results)
+        return read_results(io.BytesIO(outfile.getvalue()), results.cases)
+
+    def test_write_then_read(self):
+        cases = [ (a, x) for a in range(16) for x in range(16) ]
+        outputs = [ bytearray([a ^ x, a]) for a, x in cases ]
+        results = self.roundtrip(Results('test_xor', cases, outputs))
+        self.assertEqual(results.name, 'test_xor')
+        self.assertEqual(results.outputs, outputs)
+        self.assertFalse(results.scalar)
+
+    def test_int_outputs(self):
+        cases = [ (0xf000 + i, 0x55) for i in range(300) ]
+        outputs = [ 0x55 if i != 7 else 0x54 for i in range(300) ]
+        results = self.roundtrip(Results('test_ram', cases, outputs, scalar=True))
+        self.assertEqual(results.outputs, outputs)
+        self.assertTrue(results.scalar)
+
+    def test_iter_results_maps_the_file(self):
+        cases = [ (a,) for a in range(256) ]
+        outputs = [ bytearray([a, a ^ 0xff]) for a in range(256) ]
+        with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+            write_results(f, Results('test_inc', cases, outputs))
+            f.flush()
+            self.assertEqual(list(iter_results(f.name, cases)), outputs)
+
+    def test_reading_with_other_cases_raises(self):
+        outfile = io.BytesIO()
+        write_results(outfile, Results('test_inc', [ (a,) for a in range(4) ],
+                                       [ bytearray([a]) for a in range(4) ]))
+        with self.assertRaises(Exception):
+            read_results(io.BytesIO(outfile.getvalue()), [ (a,) for a in range(1, 5) ])
+
+    def test_parse_report_renders_the_same_text(self):
+        cases = [ (a, x) for a in range(0, 256, 15) for x in range(0, 256, 15) ]
+        text = ''.join([ report_bytes(case, bytearray([(case[0] + case[1]) & 0xff, case[1]]))
+                         for case in cases ])
+        results = parse_report('test_add', cases, text.splitlines(True), report_bytes)
+        self.assertEqual(results.render(report_bytes), text)
+
+    def test_parse_report_with_int_outputs(self):
+        cases = [ (0xf000 + i, 0xaa) for i in range(20) ]
+        text = ''.join([ report_int(case, 0xaa if i != 3 else 0) for i, case in enumerate(cases) ])
+        results = parse_report('test_ram', cases, text.splitlines(True), report_int)
+        self.assertEqual(results.outputs[3], 0)
+        self.assertEqual(results.render(report_int), text)
+
+    def test_parse_report_with_a_line_report_cannot_give_raises(self):
+        cases = [ (1, 2) ]
+        lines = ["A(IN)=01, X(IN)=02 -> A(OUT)=zz, PSW(OUT)=00\n"]
+        with self.assertRaises(Exception):
+            parse_report('test_add', cases, lines, report_bytes)
+
+    def test_serial_reference_converts_both_ways(self):
+        mod = load_fixture(os.path.join(TESTPROGS, 'fixtures', 'test_rol4.py'))
+        with open(os.path.join(TESTPROGS, 'results', 'serial', 'test_rol4.txt')) as f:
+            text = f.read()
+        results = parse_report('test_rol4', mod.cases(), text.splitlines(True), mod.report)
+        self.assertEqual(self.roundtrip(results).render(mod.report), text)
+
+    def test_spec_fixture_converts_both_ways(self):
+        mod = load_fixture(os.path.join(TESTPROGS, 'fixtures', 'test_inc.py'))
+        with open(os.path.join(TESTPROGS, 'results', 'serial', 'test_inc.txt')) as f:
+            text = f.read()
+        results = parse_report('test_inc', mod.cases(), text.splitlines(True), mod.report)
+        self.assertEqual((results.scalar, len(results.outputs[0])), (False, 2))
+        self.assertEqual(self.roundtrip(results).render(mod.report), text)
+
+    def test_spec_fixture_lines_parse_like_diff_does(self):
+        mod = load_fixture(os.path.join(TESTPROGS, 'fixtures', 'test_incw.py'))
+        case = mod.cases()[0]
+        parser = LineParser(case, mod.report)
+        output = bytearray([0x34, 0x12, 0x44])
+        self.assertEqual(parser.parse(case, mod.report(case, output)), output)
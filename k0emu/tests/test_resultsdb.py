@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from k0emu.resultsdb import Layout, ResultsDatabase, pack_line, parse_line
+
+
+class ParseLineTests(unittest.TestCase):
+
+    def test_named_inputs_and_outputs(self):
+        inputs, fields = parse_line("PSW(IN)=11, A(IN)=99 -> PSW(OUT)=01, A(OUT)=f9")
+        self.assertEqual(inputs, "PSW(IN)=11, A(IN)=99")
+        self.assertEqual(fields, [('PSW_in', 0x11), ('A_in', 0x99),
+                                  ('PSW_out', 0x01), ('A_out', 0xf9)])
+
+    def test_ram_line(self):
+        inputs, fields = parse_line("f123: IN=55 -> OUT=54 (DIFFERENT)")
+        self.assertEqual(fields, [('ADDR_in', 0xf123), ('VALUE_in', 0x55), ('VALUE_out', 0x54)])
+
+    def test_line_without_inputs(self):
+        inputs, fields = parse_line("PSW(OUT)=02, FF1E(OUT)=02")
+        self.assertEqual(inputs, '')
+        self.assertEqual(fields, [('PSW_out', 2), ('FF1E_out', 2)])
+
+    def test_packed_line_is_rendered_again(self):
+        text = "f123: IN=55 -> OUT=0A (100% DIFFERENT), SP(OUT)=fe1f"
+        template, names, fields = pack_line(text)
+        self.assertEqual(template, "%04x: IN=%02x -> OUT=%02X (100%% DIFFERENT), SP(OUT)=%04x")
+        self.assertEqual(names, ['ADDR_in', 'VALUE_in', 'VALUE_out', 'SP_out'])
+        self.assertEqual(fields, b'\x23\xf1\x55\x0a\x1f\xfe')
+        layout = Layout(template, names)
+        self.assertEqual(layout.value(fields, 'SP_out'), 0xfe1f)
+        self.assertEqual(layout.text(fields), text)
+
+
+class ResultsDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = ResultsDatabase(os.path.join(self.tempdir, 'results.sqlite3'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def write_report(self, source, psw_out):
+        path = os.path.join(self.tempdir, source + '.txt')
+        with open(path, 'w') as f:
+            for a in range(256):
+                f.write("A(IN)=%02x -> A(OUT)=%02x, PSW(OUT)=%02x\n" % (
+                    a, (a + 1) & 0xff, psw_out(a)))
+        return path
+
+    def ingest(self, path, source):
+        def readlines():
+            with open(path) as f:
+                return f.readlines()
+        return self.db.ingest(path, 'test_inc', source, readlines)
+
+    def test_ingest_is_skipped_when_unchanged(self):
+        path = self.write_report('serial', lambda a: 0)
+        self.assertTrue(self.ingest(path, 'serial'))
+        self.assertFalse(self.ingest(path, 'serial'))
+        self.write_report('serial', lambda a: 1)
+        self.assertTrue(self.ingest(path, 'serial'))
+        self.assertEqual(self.db.query("SELECT COUNT(*) FROM lines"), [(256,)])
+        self.assertEqual(self.db.lookup(['test_inc'], A_in=0x10)[0][3],
+                         "A(IN)=10 -> A(OUT)=11, PSW(OUT)=01")
+
+    def test_lookup_across_sources(self):
+        self.ingest(self.write_report('serial', lambda a: 0), 'serial')
+        self.ingest(self.write_report('emulator', lambda a: 0), 'emulator')
+        rows = self.db.lookup(['test_inc'], A_in=0xff, A_out=0)
+        self.assertEqual([ (source, line) for _, source, line, _ in rows ],
+                         [('emulator', 255), ('serial', 255)])
+
+    def test_differ_by_bit(self):
+        self.ingest(self.write_report('serial', lambda a: 0x40 if a == 0xff else 0), 'serial')
+        self.ingest(self.write_report('emulator', lambda a: 0x50 if a == 0xff else 0x10 * (a == 3)),
+                    'emulator')
+        self.assertEqual(self.db.differ('test_inc', 'PSW_out', 0x10),
+                         [(3, 'A(IN)=03', 0x00, 0x10), (255, 'A(IN)=ff', 0x40, 0x50)])
+        self.assertEqual(self.db.differ('test_inc', 'PSW_out', 0x40), [])
+
+    def test_forget_missing(self):
+        path = self.write_report('serial', lambda a: 0)
+        self.ingest(path, 'serial')
+        os.remove(path)
+        self.assertEqual(self.db.forget_missing(), [path])
+        self.assertEqual(self.db.query("SELECT COUNT(*) FROM lines"), [(0,)])
+
+    def test_database_of_an_older_schema_is_made_again(self):
+        filename = os.path.join(self.tempdir, 'old.sqlite3')
+        conn = sqlite3.connect(filename)
+        conn.execute("CREATE TABLE lines (file INTEGER, line INTEGER, inputs TEXT, outputs TEXT)")
+        conn.commit()
+        conn.close()
+        self.db.close()
+        self.db = ResultsDatabase(filename)
+        self.assertTrue(self.ingest(self.write_report('serial', lambda a: 0), 'serial'))
+        self.assertEqual(self.db.query("SELECT COUNT(*) FROM lines"), [(256,)])
@@ -0,0 +1,105 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from k0emu.romfuzz import CoverageReport, make_fuzzer, mutate, run_workers
+
+
+class RomFuzzerTests(unittest.TestCase):
+    ROM = {
+        0x0000: [0x80, 0x00],               # reset vector
+        0x0080: [0xee, 0x1c, 0x1f, 0xfe,    # 0080 movw sp,#0xfe1f
+                 0x9a, 0x00, 0x01,          # 0084 call !0x0100
+                 0xfa, 0xfe],               # 0087 br $0x0087
+        0x0100: [0x8e, 0x80, 0xfe,          # 0100 mov a,!0xfe80
+                 0x4d, 0x52,                # 0103 cmp a,#'R'
+                 0xbd, 0x0b,                # 0105 bnz $0x0112
+                 0x8e, 0x81, 0xfe,          # 0107 mov a,!0xfe81
+                 0x4d, 0x44,                # 010a cmp a,#'D'
+                 0xbd, 0x04,                # 010c bnz $0x0112
+                 0x06,                      # 010e (not implemented)
+                 0x00, 0x00, 0x00,
+                 0xaf],                     # 0112 ret
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rom = bytearray(0x200)
+        for address, code in self.ROM.items():
+            rom[address:address + len(code)] = code
+        self.options = {
+            'rom': os.path.join(self.tmpdir, 'rom.bin'),
+            'entry': 0x0100,
+            'buffer': range(0xfe80, 0xfe88),
+            'directory': os.path.join(self.tmpdir, 'corpus'),
+            'count_address': 0xfe7f,
+        }
+        with open(self.options['rom'], 'wb') as f:
+            f.write(rom)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_edges_are_branches_and_where_they_went(self):
+        fuzzer = make_fuzzer(**self.options)
+        self.assertEqual(fuzzer.execute(b'X'), (set([0x01050112, 0x0112ffff]), None))
+        edges, error = fuzzer.execute(b'R')
+        self.assertEqual(edges, set([0x01050107, 0x010c0112, 0x0112ffff]))
+
+    def test_input_and_its_length_are_written_to_ram(self):
+        fuzzer = make_fuzzer(**self.options)
+        fuzzer.execute(b'abc')
+        self.assertEqual(fuzzer.proc.read_memory_bytes(0xfe7f, 5), bytearray(b'\x03abc\x00'))
+
+    def test_exception_and_hang_are_returned(self):
+        fuzzer = make_fuzzer(**self.options)
+        edges, error = fuzzer.execute(b'RD')
+        self.assertIsInstance(error, NotImplementedError)
+        fuzzer.INSTRUCTIONS = 3
+        edges, error = fuzzer.execute(b'X')
+        self.assertEqual(str(error), "Handler did not return after 3 instructions, PC=0112")
+
+    def test_only_inputs_with_new_edges_are_kept(self):
+        fuzzer = make_fuzzer(**self.options)
+        report = CoverageReport()
+        for data in (b'X', b'Y', b'R', b'RX'):
+            fuzzer.add(data, report)
+        self.assertEqual(fuzzer.corpus, [b'X', b'R'])
+        self.assertEqual(len(os.listdir(self.options['directory'])), 3)  # and crashes/
+        self.assertEqual(report.executions, 4)
+
+    def test_other_workers_inputs_are_synced(self):
+        first = make_fuzzer(**self.options)
+        second = make_fuzzer(**self.options)
+        first.add(b'R', CoverageReport())
+        second.sync()
+        self.assertEqual(second.corpus, [b'R'])
+        self.assertEqual(second.coverage, first.coverage)
+
+    def test_fuzzing_finds_crash(self):
+        os.makedirs(self.options['directory'])
+        with open(os.path.join(self.options['directory'], 'seed'), 'wb') as f:
+            f.write(b'RE')
+        report = make_fuzzer(**self.options).fuzz(2000, seed=1)
+        self.assertEqual(report.crashes, 1)
+        crashes = os.path.join(self.options['directory'], 'crashes')
+        with open(os.path.join(crashes, os.listdir(crashes)[0]), 'rb') as f:
+            self.assertEqual(f.read()[:2], b'RD')
+
+    def test_workers_share_the_corpus_directory(self):
+        os.makedirs(self.options['directory'])
+        with open(os.path.join(self.options['directory'], 'seed'), 'wb') as f:
+            f.write(b'RE')
+        reports = run_workers(self.options, 2, 300)
+        self.assertEqual([ r.executions for r in reports ], [300, 300])
+        fuzzer = make_fuzzer(**self.options)
+        fuzzer.sync()
+        self.assertEqual(len(fuzzer.coverage), 4)
+
+    def test_mutate_keeps_inputs_in_the_buffer(self):
+        rng = random.Random(3)
+        data = b''
+        for i in range(1000):
+            data = mutate(rng, data, 8, [b'RD', b'12345678'])
+            self.assertLessEqual(len(data), 8)
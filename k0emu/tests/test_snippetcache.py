@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from k0emu.debug import EmulatorDebugger, MemoDebugger
+from k0emu.processor import Processor
+from k0emu.snippetcache import SnippetCache, snippet_key
+
+
+class CountingDebugger(EmulatorDebugger):
+    '''Emulator that counts the snippets it runs'''
+    def __init__(self):
+        EmulatorDebugger.__init__(self, Processor())
+        self.calls = 0
+        self.clobbers = None
+
+    def call(self, address, clobbers=None):
+        self.calls += 1
+        self.clobbers = clobbers
+        EmulatorDebugger.call(self, address, clobbers)
+
+
+CODE = [
+    0xa1, 0,            # mov a,#<a>
+    0x41,               # inc a
+    0x9e, 0x00, 0xfe,   # mov 0xfe00,a
+    0xaf                # ret
+]
+
+def codes(values):
+    return [ [0xa1, a] + CODE[2:] for a in values ]
+
+
+class SnippetCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'snippets.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cached_snippets_are_not_run_again(self):
+        cache = SnippetCache(self.filename, 'serial')
+        debug = CountingDebugger()
+        memo = MemoDebugger(debug, cache)
+        first = list(memo.execute_many(0xf000, codes(range(4)), 0xfe00, 1))
+        second = list(memo.execute_many(0xf000, codes(range(8)), 0xfe00, 1))
+        self.assertEqual(first + second, [ bytearray([(a + 1) & 0xff])
+                                           for a in list(range(4)) + list(range(8)) ])
+        self.assertEqual(debug.calls, 8)
+
+    def test_sweep_runs_only_the_cases_not_cached(self):
+        cache = SnippetCache(self.filename, 'emulator', 'v1')
+        debug = CountingDebugger()
+        memo = MemoDebugger(debug, cache)
+        cases = [ (a,) for a in range(256) ]
+        first = list(memo.sweep(0xf000, CODE, (0xf001,), cases[:16], 0xfe00, 1))
+        second = list(memo.sweep(0xf000, CODE, (0xf001,), cases, 0xfe00, 1))
+        self.assertEqual(second[:16], first)
+        self.assertEqual(second[255], bytearray([0]))
+        self.assertEqual(cache.hits, 16)
+        self.assertEqual(cache.misses, 256)
+
+    def test_emulator_entries_are_dropped_when_the_version_changes(self):
+        key = snippet_key(0xf000, CODE, 0xfe00, 1)
+        cache = SnippetCache(self.filename, 'emulator', 'v1')
+        cache.put(key, b'\x01')
+        cache.close()
+        self.assertEqual(SnippetCache(self.filename, 'emulator', 'v1').get(key), b'\x01')
+        self.assertEqual(SnippetCache(self.filename, 'emulator', 'v2').get(key), None)
+
+    def test_serial_entries_are_kept(self):
+        key = snippet_key(0xf000, CODE, 0xfe00, 1)
+        cache = SnippetCache(self.filename, 'serial')
+        cache.put(key, b'\x01')
+        cache.close()
+        SnippetCache(self.filename, 'emulator', 'v2').close()
+        self.assertEqual(SnippetCache(self.filename, 'serial').get(key), b'\x01')
+
+    def test_key_depends_on_what_is_read(self):
+        self.assertNotEqual(snippet_key(0xf000, CODE, 0xfe00, 1),
+                            snippet_key(0xf000, CODE, 0xfe00, 2))
+
+    def test_writes_before_a_snippet_are_part_of_its_key(self):
+        cache = SnippetCache(self.filename, 'serial')
+        debug = CountingDebugger()
+        memo = MemoDebugger(debug, cache)
+        code = [0x8e, 0x10, 0xfe,   # mov a,!0xfe10
+                0x9e, 0x00, 0xfe,   # mov 0xfe00,a
+                0xaf]               # ret
+        outputs = []
+        for value in (1, 2, 2):
+            memo.write(0xfe10, [value])
+            outputs.append(memo.execute(0xf000, code, 0xfe00, 1))
+            cache.flush()
+        outputs.append(memo.execute(0xf000, code, 0xfe00, 1))
+        self.assertEqual(outputs, [ bytearray([v]) for v in (1, 2, 2, 2) ])
+        self.assertEqual(debug.calls, 3)  # the second write of 2 hit, no write missed
+
+    def test_call_passes_clobbers_to_the_debugger(self):
+        debug = CountingDebugger()
+        memo = MemoDebugger(debug, SnippetCache(self.filename, 'serial'))
+        memo.write(0xf000, [0xaf])  # ret
+        memo.call(0xf000, [range(0xfe00, 0xfe01)])
+        self.assertEqual(debug.clobbers, [range(0xfe00, 0xfe01)])
+
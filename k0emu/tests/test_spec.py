@@ -0,0 +1,64 @@
+import unittest
+from k0emu.debug import EmulatorDebugger
+from k0emu.processor import Processor
+from k0emu.spec import InstructionSpec
+
+
+class InstructionSpecTests(unittest.TestCase):
+
+    def test_snippet_sets_inputs_runs_instruction_and_stores_outputs(self):
+        spec = InstructionSpec([0x61, 0x08],  # add a,x
+                               inputs=[('PSW', (0, 1)), ('A', range(256)), ('X', range(256))],
+                               outputs=['A', 'PSW'])
+        self.assertEqual(spec.code, [
+            0x11, 0x1e, 0,      # mov psw,#<psw>
+            0xa1, 0,            # mov a,#<a>
+            0xa0, 0,            # mov x,#<x>
+            0x61, 0x08,         # add a,x
+            0x9e, 0x00, 0xfe,   # mov 0xfe00,a
+            0xf0, 0x1e,         # mov a,psw
+            0x9e, 0x01, 0xfe,   # mov 0xfe01,a
+            0xaf                # ret
+        ])
+        self.assertEqual(spec.patches, (0xf002, 0xf004, 0xf006))
+        self.assertEqual(len(spec.cases()), 2 * 256 * 256)
+        self.assertEqual(spec.cases()[:2], [(0, 0, 0), (0, 0, 1)])
+
+    def test_report_shows_inputs_in_report_order(self):
+        spec = InstructionSpec([0x61, 0x80],  # adjba
+                               inputs=[('PSW', (0, 1)), ('A', range(256))],
+                               outputs=['PSW', 'A'], report_inputs=['A', 'PSW'])
+        self.assertEqual(spec.report((0x01, 0x9a), bytearray([0x11, 0x00])),
+                         "A(IN)=9a, PSW(IN)=01 -> PSW(OUT)=11, A(OUT)=00\n")
+
+    def test_word_inputs_and_outputs(self):
+        spec = InstructionSpec([0x80],  # incw ax
+                               inputs=['AX', 'PSW'], outputs=['AX', 'PSW'],
+                               cases=[(0x00ff, 0x01), (0xffff, 0x00)])
+        debug = EmulatorDebugger(Processor())
+        cases = spec.cases()
+        lines = [ spec.report(case, output) for case, output
+                  in zip(cases, spec.run(debug, cases)) ]
+        self.assertEqual(lines, [
+            "AX(IN)=00ff, PSW(IN)=01 -> AX(OUT)=0100, PSW(OUT)=01\n",
+            "AX(IN)=ffff, PSW(IN)=00 -> AX(OUT)=0000, PSW(OUT)=00\n",
+        ])
+
+    def test_operand_input_and_fixed_inputs(self):
+        spec = InstructionSpec([0x0d, 'IMM'],  # add a,#imm
+                               inputs=[('IMM', (0x01, 0x80))], outputs=['A'],
+                               fixed={'PSW': 0, 'A': 0x80})
+        debug = EmulatorDebugger(Processor())
+        outputs = list(spec.run(debug, spec.cases()))
+        self.assertEqual(outputs, [bytearray([0x81]), bytearray([0x00])])
+
+    def test_outputs_other_than_a_go_through_a(self):
+        spec = InstructionSpec([0x31, 0x88],  # mulu x
+                               inputs=[('A', (0x10,)), ('X', (0x20,))],
+                               outputs=['X', 'A'], fixed={'PSW': 0})
+        debug = EmulatorDebugger(Processor())
+        self.assertEqual(list(spec.run(debug, spec.cases())), [bytearray([0x00, 0x02])])
+
+    def test_unknown_input_raises(self):
+        with self.assertRaises(Exception):
+            InstructionSpec([0x00], inputs=[('Q', (0,))], outputs=['A'])
@@ -51,8 +51,8 @@ setup(
     maintainer="Mike Naberezny",
     maintainer_email="mike@naberezny.com",
     packages=find_packages(),
-    install_requires=["k0dasm"],
-    extras_require={},
+    install_requires=["k0dasm", "pyserial"],
+    extras_require={"batch": ["numpy"]},
     tests_require=[],
     include_package_data=True,
     zip_safe=False,
@@ -60,7 +60,12 @@ setup(
     entry_points={
         'console_scripts': [
             'k0emu = k0emu.run:main',
-            'k0debug = k0emu.debug:main'
+            'k0debug = k0emu.debug:main',
+            'k0board = k0emu.board:main',
+            'k0lockstep = k0emu.lockstep:main',
+            'k0crosscheck = k0emu.crosscheck:main',
+            'k0fuzz = k0emu.fuzz:main',
+            'k0romfuzz = k0emu.romfuzz:main'
         ],
     },
 )